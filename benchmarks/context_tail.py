@@ -0,0 +1,82 @@
+"""Benchmark of reading the session context from logs of growing size.
+
+Writes synthetic `script` logs (coloured build output) up to `--max-size-mb`,
+then times `read_context` with a fixed budget: the cost should not depend on
+the size of the log.  Reading from a context snapshot refreshed in the
+background is timed too, and the previous whole-file read for comparison up to
+`--legacy-max-size-mb`.
+
+Usage: python benchmarks/context_tail.py [--max-size-mb 1024] [--budget 20000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shell_ai.context import read_context
+from shell_ai.snapshot import read_snapshot, refresh
+from shell_ai.utils import strip_ansi
+
+LOG_LINE = (
+    "\x1b[32m[ 42%]\x1b[0m Building CXX object src/CMakeFiles/app.dir/módulo.cpp.o ✓\n"
+).encode()
+
+
+def write_log(path: str, size: int):
+    block = LOG_LINE * (1024 * 1024 // len(LOG_LINE))
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+        # Cut mid-line, like a log that is still being written to
+        f.truncate(size)
+
+
+def legacy_read(path: str, budget: int) -> str:
+    with open(path, "r", errors="replace") as f:
+        return strip_ansi(f.read())[-budget:]
+
+
+def bench(name: str, read, path: str, budget: int, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = read(path, budget)
+        best = min(best, time.perf_counter() - start)
+    size_mb = os.path.getsize(path) / 2**20
+    print(
+        f"{name:<8} {size_mb:>8.0f} MB log {len(text):>8} chars {best * 1000:>10.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-size-mb", type=int, default=1024)
+    parser.add_argument("--legacy-max-size-mb", type=int, default=64)
+    parser.add_argument("--budget", type=int, default=20000)
+    args = parser.parse_args()
+
+    sizes_mb = [1]
+    while sizes_mb[-1] * 4 <= args.max_size_mb:
+        sizes_mb.append(sizes_mb[-1] * 4)
+    if sizes_mb[-1] != args.max_size_mb:
+        sizes_mb.append(args.max_size_mb)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.log")
+        for size_mb in sizes_mb:
+            write_log(path, size_mb * 2**20)
+            bench("tail", read_context, path, args.budget)
+            refresh(path, args.budget)
+            bench("snapshot", read_snapshot, path, args.budget)
+            if size_mb <= args.legacy_max_size_mb:
+                bench("legacy", legacy_read, path, args.budget, repeat=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Local mock of an OpenAI-compatible `chat.completions` streaming endpoint.
+
+Can also be run on its own, to point `OPENAI_BASE_URL` at it by hand:
+
+Usage: python benchmarks/mock_server.py [--port 8080] [--rate 50] [--chunk-size 4]
+           [--latency 0.2] [--stall-after 10 --stall 5] [--error-rate 0.1]
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockServer:
+    """Serve a streamed response on a local port in a background thread.
+
+    The response is split into chunks of `chunk_size` characters (one chunk if
+    not set), sent at `rate` chunks per second (as fast as possible if not set)
+    after `latency` seconds.  The stream pauses for `stall` seconds after
+    `stall_after` chunks, and a fraction `error_rate` of requests fail with
+    `error_status`.
+
+    The arrival time (`time.perf_counter()`) of each completion request is
+    recorded in `request_times`, so callers can measure time to request sent.
+    """
+
+    def __init__(
+        self,
+        response: str = "OK",
+        *,
+        chunk_size: int | None = None,
+        rate: float | None = None,
+        latency: float = 0.0,
+        stall_after: int | None = None,
+        stall: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        port: int = 0,
+        seed: int = 0,
+    ):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.rate = rate
+        self.latency = latency
+        self.stall_after = stall_after
+        self.stall = stall
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.request_times: list[float] = []
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def chunks(self) -> list[str]:
+        if not self.chunk_size:
+            return [self.response]
+        return [
+            self.response[i : i + self.chunk_size]
+            for i in range(0, len(self.response), self.chunk_size)
+        ]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                # Connection warm-up
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                server.request_times.append(time.perf_counter())
+                body = json.loads(
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                )
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if server.error_rate and server._random.random() < server.error_rate:
+                    server.errors += 1
+                    self.send_error_response()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                chunks = server.chunks()
+                try:
+                    for i, content in enumerate(chunks):
+                        if i and server.rate:
+                            time.sleep(1 / server.rate)
+                        if i == server.stall_after:
+                            time.sleep(server.stall)
+                        self.send_event({"content": content})
+                    if body.get("stream_options", {}).get("include_usage"):
+                        self.send_event(None, usage=len(chunks))
+                    self.send_data(b"data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the stream
+                    pass
+
+            def send_error_response(self):
+                data = json.dumps(
+                    {"error": {"message": "Mock error", "type": "server_error"}}
+                ).encode()
+                self.send_response(server.error_status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_event(self, delta: dict | None, usage: int | None = None):
+                chunk = {
+                    "id": "mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": "mock",
+                    "choices": (
+                        [{"index": 0, "delta": delta, "finish_reason": None}]
+                        if delta is not None
+                        else []
+                    ),
+                }
+                if usage is not None:
+                    chunk["usage"] = {
+                        "prompt_tokens": 0,
+                        "completion_tokens": usage,
+                        "total_tokens": usage,
+                    }
+                self.send_data(f"data: {json.dumps(chunk)}\n\n".encode())
+
+            def send_data(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--response", default="Hello from the mock server.")
+    parser.add_argument("--chunk-size", type=int, help="Characters per chunk")
+    parser.add_argument("--rate", type=float, help="Chunks per second")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--stall-after", type=int, help="Chunks before the stall")
+    parser.add_argument("--stall", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+
+    with MockServer(
+        args.response,
+        chunk_size=args.chunk_size,
+        rate=args.rate,
+        latency=args.latency,
+        stall_after=args.stall_after,
+        stall=args.stall,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        port=args.port,
+    ) as server:
+        print(f"OPENAI_BASE_URL={server.base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Offline benchmark suite of end-to-end `shell-ai` runs against a mock server.
+
+Each scenario runs `python -m shell_ai` against a local mock of the streaming
+API (see `mock_server.py`), with an isolated HOME, and measures:
+
+- cold start: spawn to request sent
+- first byte: spawn to the first byte of the response on a terminal
+- streaming: a long response, to a terminal, and the stream handler's
+  throughput in-process
+- stall and errors: a stream that pauses, and a server that always fails
+- huge context: a large session log as the context file, whole and with a
+  `max-context-length` budget
+
+Wall times are in milliseconds and peak memory (max RSS) in MiB.  Results are
+written to a JSON file, and compared with a previous one with `--baseline`.
+
+Usage: python benchmarks/run.py [--output FILE] [--baseline FILE] [--quick]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import pty
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stderr
+
+from mock_server import MockServer
+from startup import PROJECT_ROOT, isolated_env, measure_cold_start
+
+sys.path.insert(0, PROJECT_ROOT)
+
+RESPONSE_LINE = "Building module {i}: compiled 42 objects, linked 3 libraries.\n"
+
+
+def long_response(lines: int) -> str:
+    return "".join(RESPONSE_LINE.format(i=i) for i in range(lines))
+
+
+def run_shell_ai(args: list[str], env: dict[str, str], *, terminal: bool) -> dict:
+    """Run shell-ai once, returning its wall time, first output byte and peak memory.
+
+    With `terminal`, its output goes to a pseudo-terminal, as in interactive
+    use, and the time of the first byte is measured.
+    """
+
+    command = [sys.executable, "-m", "shell_ai", *args]
+    start = time.perf_counter()
+    first_byte = None
+    if terminal:
+        master_fd, slave_fd = pty.openpty()
+        process = subprocess.Popen(
+            command,
+            cwd=PROJECT_ROOT,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=slave_fd,
+            stderr=slave_fd,
+        )
+        os.close(slave_fd)
+        while True:
+            try:
+                data = os.read(master_fd, 65536)
+            except OSError:
+                # The child closed the terminal
+                break
+            if not data:
+                break
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+        os.close(master_fd)
+    else:
+        process = subprocess.Popen(
+            command,
+            cwd=PROJECT_ROOT,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    # Wait with wait4 for the child's resource usage
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+
+    result = {
+        "wall_ms": wall * 1000,
+        "max_rss_mib": usage.ru_maxrss / 1024,
+        "exit_code": process.returncode,
+    }
+    if first_byte is not None:
+        result["first_byte_ms"] = first_byte * 1000
+    return result
+
+
+def median_of(runs: list[dict]) -> dict:
+    """Median of each numeric metric over the runs."""
+
+    return {
+        key: statistics.median(run[key] for run in runs)
+        for key in runs[0]
+        if isinstance(runs[0][key], (int, float))
+    }
+
+
+def bench_cold_start(runs: int) -> dict:
+    timings = measure_cold_start(runs)
+    return {"request_sent_ms": statistics.median(timings), "runs": runs}
+
+
+def bench_first_byte(runs: int) -> dict:
+    with MockServer(long_response(20), chunk_size=16, rate=200) as server:
+        with tempfile.TemporaryDirectory() as home:
+            env = isolated_env(server.base_url, home)
+            results = [
+                run_shell_ai(["--raw", "--print", "--", "hi"], env, terminal=True)
+                for _ in range(runs)
+            ]
+    return median_of(results)
+
+
+def bench_streaming(lines: int) -> dict:
+    response = long_response(lines)
+    with MockServer(response, chunk_size=4) as server:
+        with tempfile.TemporaryDirectory() as home:
+            env = isolated_env(server.base_url, home)
+            result = run_shell_ai(["--", "hi"], env, terminal=True)
+    result["chars_per_second"] = len(response) / (result["wall_ms"] / 1000)
+    return result
+
+
+def bench_buffer_handler(lines: int) -> dict:
+    """Throughput of the stream handlers alone, with command tags to parse."""
+
+    from shell_ai import StreamState, buffer_handler, stop_handler
+
+    response = long_response(lines) + "<exec>make && make install</exec>\n"
+    tokens = [response[i : i + 4] for i in range(0, len(response), 4)]
+    state = StreamState()
+    event_queue = []
+    with redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        for token in tokens:
+            buffer_handler(token, event_queue, state=state, print_mode=False)
+        stop_handler(event_queue, state=state, print_mode=False)
+        elapsed = time.perf_counter() - start
+    return {
+        "tokens": len(tokens),
+        "tokens_per_second": len(tokens) / elapsed,
+        "commands": len(event_queue),
+    }
+
+
+def bench_stall(stall: float) -> dict:
+    with MockServer(long_response(20), chunk_size=16, stall_after=5, stall=stall) as (
+        server
+    ):
+        with tempfile.TemporaryDirectory() as home:
+            env = isolated_env(server.base_url, home)
+            result = run_shell_ai(["--raw", "--print", "--", "hi"], env, terminal=False)
+    result["stall_ms"] = stall * 1000
+    return result
+
+
+def bench_errors() -> dict:
+    with MockServer(error_rate=1.0, error_status=500) as server:
+        with tempfile.TemporaryDirectory() as home:
+            env = isolated_env(server.base_url, home)
+            result = run_shell_ai(["--raw", "--print", "--", "hi"], env, terminal=False)
+    result["requests"] = len(server.request_times)
+    return result
+
+
+def bench_huge_context(size_mib: int, max_context_length: int | None = None) -> dict:
+    line = (
+        "\x1b[32m[ 42%]\x1b[0m Building CXX object src/CMakeFiles/app.dir/main.cpp.o\n"
+    )
+    block = line.encode() * (2**20 // len(line))
+    with MockServer() as server, tempfile.TemporaryDirectory() as home:
+        path = os.path.join(home, "session.log")
+        with open(path, "wb") as f:
+            for _ in range(size_mib):
+                f.write(block)
+        if max_context_length:
+            config_dir = os.path.join(home, ".config", "shell-ai")
+            os.makedirs(config_dir)
+            with open(os.path.join(config_dir, "shell-ai.conf"), "w") as f:
+                f.write(f"[DEFAULT]\nmax-context-length = {max_context_length}\n")
+        env = isolated_env(server.base_url, home)
+        result = run_shell_ai(["--context-file", path, "--", "hi"], env, terminal=False)
+    result["context_mib"] = size_mib
+    return result
+
+
+def compare(results: dict, baseline: dict):
+    """Print the change of each metric relative to the baseline."""
+
+    print(f"\nCompared with {baseline['metadata']['commit'] or 'baseline'}:")
+    for scenario, metrics in results["results"].items():
+        for key, value in metrics.items():
+            old = baseline["results"].get(scenario, {}).get(key)
+            if not isinstance(value, (int, float)) or not old:
+                continue
+            print(
+                f"  {scenario + '.' + key:<40} {old:>12.1f} -> {value:>12.1f}"
+                f"  ({value / old - 1:+.1%})"
+            )
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Previous results to compare with")
+    parser.add_argument(
+        "--quick", action="store_true", help="Fewer runs and smaller inputs"
+    )
+    args = parser.parse_args()
+
+    runs = 2 if args.quick else 5
+    scenarios = {
+        "cold_start": lambda: bench_cold_start(runs),
+        "first_byte": lambda: bench_first_byte(runs),
+        "streaming": lambda: bench_streaming(2000 if args.quick else 20000),
+        "buffer_handler": lambda: bench_buffer_handler(20000 if args.quick else 200000),
+        "stall": lambda: bench_stall(1.0),
+        "errors": bench_errors,
+        "huge_context": lambda: bench_huge_context(64 if args.quick else 512),
+        "huge_context_budget": lambda: bench_huge_context(
+            64 if args.quick else 512, max_context_length=20000
+        ),
+    }
+
+    results = {
+        "metadata": {
+            "time": time.time(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "results": {},
+    }
+    for name, bench in scenarios.items():
+        result = bench()
+        results["results"][name] = result
+        summary = ", ".join(
+            f"{key} {value:.1f}" if isinstance(value, float) else f"{key} {value}"
+            for key, value in result.items()
+        )
+        print(f"{name:<16} {summary}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Cold start budget check: time from process spawn to the request being sent.
+
+Runs `python -m shell_ai` against a local mock server several times, and exits
+with status 1 if its median time exceeds the budget, relative to a baseline
+process that only imports the SDK, which sending a request needs anyway.  The
+budget so holds on slow and fast machines alike.  Also run by the test suite,
+in tests/test_startup.py.
+
+Usage: python benchmarks/startup.py [--runs N] [--max-ratio RATIO]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_server import MockServer
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start time allowed, as a multiple of the time to import the SDK
+MAX_RATIO = 1.5
+
+
+def isolated_env(base_url: str, home: str) -> dict[str, str]:
+    """Return an environment that ignores the user's config, state and proxies."""
+
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.lower().endswith("_proxy")
+        and not key.startswith(("OPENAI_", "SHELL_AI_"))
+        and key not in ("XDG_CACHE_HOME", "XDG_STATE_HOME")
+    }
+    env.update(
+        HOME=home,
+        OPENAI_BASE_URL=base_url,
+        OPENAI_API_KEY="mock",
+        OPENAI_MODEL="mock",
+    )
+    return env
+
+
+def measure_baseline(runs: int) -> list[float]:
+    """Return the time of each run of a process that imports the SDK and exits,
+    in milliseconds."""
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import openai"], check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def measure_cold_start(runs: int) -> list[float]:
+    """Return the spawn-to-request time of each run in milliseconds."""
+
+    timings = []
+    with MockServer() as server, tempfile.TemporaryDirectory() as home:
+        env = isolated_env(server.base_url, home)
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-m", "shell_ai", "--print", "--raw", "--", "hi"],
+                cwd=PROJECT_ROOT,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                check=True,
+            )
+            timings.append((server.request_times[-1] - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ratio", type=float, default=MAX_RATIO)
+    args = parser.parse_args()
+
+    baseline = statistics.median(measure_baseline(args.runs))
+    timings = measure_cold_start(args.runs)
+    median = statistics.median(timings)
+    print(
+        f"cold start to request sent: median {median:.1f} ms, "
+        f"min {min(timings):.1f} ms, max {max(timings):.1f} ms "
+        f"(budget {args.max_ratio:.2f} x {baseline:.1f} ms to import the SDK)"
+    )
+    if median > args.max_ratio * baseline:
+        print("FAIL: startup budget exceeded", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Micro-benchmark of response stream tag parsing.
+
+Feeds responses made of a long heredoc `<exec>` command token by token, and
+reports the time per MB for growing sizes: it should stay flat for `TagParser`.
+The previous regex-over-buffer algorithm is included for small sizes as a
+reference, since it grows quadratically.
+
+Usage: python benchmarks/tag_parser.py [--sizes-mb 1 2 4 8] [--token-size 4]
+"""
+
+import argparse
+import html
+import io
+import os
+import re
+import sys
+import time
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shell_ai import StreamState, buffer_handler, stop_handler
+from shell_ai.parser import TagParser
+
+
+def make_response(size: int) -> str:
+    """Return a response of about `size` characters with a heredoc command."""
+
+    line = "echo 'some <b>generated</b> line of a script' >> out.txt\n"
+    body = line * max(1, size // len(line))
+    return f"Here is the script:\n<exec>(\ncat > run.sh << 'EOF'\n{body}EOF\n)</exec>\nDone."
+
+
+def tokenize(text: str, token_size: int) -> list[str]:
+    return [text[i : i + token_size] for i in range(0, len(text), token_size)]
+
+
+def legacy_feed(tokens: list[str]) -> int:
+    """The previous algorithm: re-scan the whole pending buffer on every token."""
+
+    OPENING_TAG = "<exec>"
+    CLOSING_TAG = "</exec>"
+    buffer = acc = ""
+    commands = 0
+    for token in tokens:
+        buffer += token
+        if buffer.find(OPENING_TAG) != -1 or any(
+            buffer.endswith(OPENING_TAG[: j + 1]) for j in range(len(OPENING_TAG))
+        ):
+            while match := re.search(
+                rf"{OPENING_TAG}(.*?){CLOSING_TAG}", buffer, re.DOTALL
+            ):
+                command = html.unescape(match.group(1))
+                buffer = buffer[: match.start()] + command + buffer[match.end() :]
+                commands += 1
+        else:
+            acc += buffer
+            buffer = ""
+    return commands
+
+
+def parser_feed(tokens: list[str]) -> int:
+    parser = TagParser(["exec"])
+    events = 0
+    for token in tokens:
+        events += len(parser.feed(token))
+    return events + len(parser.close())
+
+
+def handler_feed(tokens: list[str]) -> int:
+    """The full non-print-mode stream handler, with stderr discarded."""
+
+    state = StreamState()
+    event_queue = []
+    with redirect_stderr(io.StringIO()):
+        for token in tokens:
+            buffer_handler(token, event_queue, state=state, print_mode=False)
+        stop_handler(event_queue, state=state, print_mode=False)
+    return len(event_queue)
+
+
+def bench(name: str, feed, size: int, token_size: int):
+    tokens = tokenize(make_response(size), token_size)
+    start = time.perf_counter()
+    feed(tokens)
+    elapsed = time.perf_counter() - start
+    mb = size / 1e6
+    print(
+        f"{name:<8} {mb:>8.3f} MB {len(tokens):>10} tokens "
+        f"{elapsed * 1000:>10.1f} ms {elapsed / mb * 1000:>10.1f} ms/MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--legacy-sizes-mb", type=float, nargs="+", default=[0.025, 0.05, 0.1]
+    )
+    parser.add_argument("--token-size", type=int, default=4)
+    args = parser.parse_args()
+
+    for size_mb in args.legacy_sizes_mb:
+        bench("legacy", legacy_feed, int(size_mb * 1e6), args.token_size)
+    for size_mb in args.legacy_sizes_mb + args.sizes_mb:
+        bench("parser", parser_feed, int(size_mb * 1e6), args.token_size)
+    for size_mb in args.sizes_mb:
+        bench("handler", handler_feed, int(size_mb * 1e6), args.token_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark of writing streamed tokens to a pseudo-terminal.
+
+Compares the previous behaviour, a `print(..., flush=True)` per token, with
+the coalescing `OutputWriter`.  A child process streams the tokens from an
+event loop, as `request_completion` does, to a pseudo-terminal that the parent
+drains; the writes made and the child's CPU time are reported.  `--rate`
+simulates a model that produces that many tokens per second.
+
+Usage: python benchmarks/terminal_output.py [--tokens N] [--rate TOKENS_PER_S]
+"""
+
+import argparse
+import os
+import pty
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, os, sys
+from shell_ai.output import OutputWriter
+
+mode, tokens, rate, report_fd = sys.argv[1], int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4])
+writer = OutputWriter(sys.stderr)
+writes = 0
+
+async def stream():
+    global writes
+    for i in range(tokens):
+        token = f"tok{i % 10} " if i % 12 else "\\n"
+        if mode == "print":
+            print(token, end="", flush=True, file=sys.stderr)
+            writes += 1
+        else:
+            writer.write(token)
+        # Tokens arrive in network reads, which yield to the event loop
+        await asyncio.sleep(1 / rate if rate else 0)
+    writer.flush()
+
+asyncio.run(stream())
+os.write(report_fd, str(writes or writer.writes).encode())
+"""
+
+
+def run(mode: str, tokens: int, rate: float) -> dict:
+    master_fd, slave_fd = pty.openpty()
+    report_read, report_write = os.pipe()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", CHILD, mode, str(tokens), str(rate), str(report_write)],
+        cwd=PROJECT_ROOT,
+        stdin=subprocess.DEVNULL,
+        stdout=slave_fd,
+        stderr=slave_fd,
+        pass_fds=[report_write],
+    )
+    os.close(slave_fd)
+    os.close(report_write)
+
+    received = 0
+    while True:
+        try:
+            data = os.read(master_fd, 65536)
+        except OSError:
+            # The child closed the terminal
+            break
+        if not data:
+            break
+        received += len(data)
+    os.close(master_fd)
+
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    with os.fdopen(report_read) as report:
+        writes = int(report.read() or 0)
+    return {
+        "wall_s": wall,
+        "cpu_s": usage.ru_utime + usage.ru_stime,
+        "writes": writes,
+        "bytes": received,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=50000)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="Tokens per second (default: no limit)"
+    )
+    args = parser.parse_args()
+
+    for mode in ("print", "writer"):
+        result = run(mode, args.tokens, args.rate)
+        print(
+            f"{mode:<8} {result['writes']:>8} writes {result['bytes']:>9} bytes "
+            f"{result['wall_s']:>8.2f} s wall {result['cpu_s']:>8.2f} s CPU"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark of replaying session logs into their visible text.
+
+Reports the size of the context left by `strip_ansi` and by `TerminalReplay`,
+and the replay throughput when fed whole and in 4 KiB chunks.  Synthetic logs
+mimic `pip install` progress bars and BuildKit's redrawn `docker build` output;
+captured `script` logs can be passed as arguments as well.
+
+Usage: python benchmarks/terminal_replay.py [LOG ...] [--scale N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shell_ai.terminal import TerminalReplay
+from shell_ai.utils import strip_ansi
+
+
+def pip_install_log(packages: int) -> str:
+    """Progress bars redrawn with carriage returns, as pip's rich output does."""
+
+    parts = ["$ pip install -r requirements.txt\r\n"]
+    for i in range(packages):
+        parts.append(f"Collecting package-{i}==1.{i}.0\r\n")
+        parts.append(f"  Downloading package_{i}-1.{i}.0-py3-none-any.whl (2.4 MB)\r\n")
+        parts.append("\x1b[?25l")
+        for step in range(0, 101, 2):
+            bar = "━" * (step * 40 // 100) + "╺" + " " * (40 - step * 40 // 100)
+            parts.append(
+                f"\r     \x1b[38;5;197m{bar}\x1b[0m \x1b[32m{step * 24 / 1000:.1f}/2.4 MB\x1b[0m "
+                f"\x1b[31m{step / 10:.1f} MB/s\x1b[0m eta \x1b[36m0:00:0{(100 - step) // 20}\x1b[0m"
+            )
+        parts.append("\x1b[?25h\r\n")
+    parts.append(f"Successfully installed {packages} packages\r\n$ ")
+    return "".join(parts)
+
+
+def docker_build_log(steps: int) -> str:
+    """A block of status lines redrawn in place with cursor-up and erase-line."""
+
+    parts = ["$ docker build -t app .\r\n"]
+    drawn = 0
+    for tick in range(steps * 10):
+        done = tick // 10
+        lines = [f"[+] Building {tick / 10:.1f}s ({done}/{steps})"]
+        for step in range(min(done + 1, steps)):
+            state = "DONE 0.3s" if step < done else f"{tick % 10 / 10:.1f}s"
+            lines.append(f" => [{step + 1}/{steps}] RUN make step-{step}  {state}")
+        if drawn:
+            parts.append(f"\x1b[{drawn}A")
+        parts.extend(f"\x1b[K{line}\r\n" for line in lines)
+        drawn = len(lines)
+    parts.append("$ ")
+    return "".join(parts)
+
+
+def bench(name: str, log: str):
+    size = len(log.encode())
+    stripped = len(strip_ansi(log).encode())
+
+    start = time.perf_counter()
+    terminal = TerminalReplay()
+    terminal.feed(log)
+    text = terminal.text()
+    whole = time.perf_counter() - start
+
+    start = time.perf_counter()
+    terminal = TerminalReplay()
+    for i in range(0, len(log), 4096):
+        terminal.feed(log[i : i + 4096])
+    assert terminal.text() == text
+    chunked = time.perf_counter() - start
+
+    replayed = len(text.encode())
+    print(
+        f"{name:<16} {size / 1e6:>8.2f} MB -> strip_ansi {stripped / 1e6:>8.2f} MB, "
+        f"replay {replayed / 1e6:>8.3f} MB ({1 - replayed / size:.1%} smaller), "
+        f"{size / 1e6 / whole:>6.1f} MB/s whole, {size / 1e6 / chunked:>6.1f} MB/s chunked"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="Captured session logs to replay")
+    parser.add_argument("--scale", type=int, default=1)
+    args = parser.parse_args()
+
+    bench("pip install", pip_install_log(40 * args.scale))
+    bench("docker build", docker_build_log(30 * args.scale))
+    for path in args.logs:
+        with open(path, "rb") as f:
+            bench(os.path.basename(path), f.read().decode(errors="replace"))
+
+
+if __name__ == "__main__":
+    main()
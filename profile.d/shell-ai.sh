@@ -1,5 +1,8 @@
 [[ $- != *i* ]] && return
 
+SCRIPT_DIR=$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &>/dev/null && pwd)
+PROJECT_ROOT="$(dirname $SCRIPT_DIR)"
+
 # Session logging
 log() {
     if [[ -z $1 ]]; then
@@ -13,6 +16,11 @@ log() {
         mkdir -p $(dirname "$SESSION_LOG_FILE")
         # Start scripting
         shopt -q login_shell 2>/dev/null && LOGIN_FLAG=-l
+        if [[ -n "$SHELL_AI_RECORDER" ]]; then
+            # Record to a bounded ring buffer log, with an index of commands
+            exec "$PROJECT_ROOT/bin/shell-ai-recorder" record "$SESSION_LOG_FILE" \
+                ${SHELL_AI_RECORDER_SIZE:+--size "$SHELL_AI_RECORDER_SIZE"} -- $SHELL $LOGIN_FLAG
+        fi
         exec script -fq "$SESSION_LOG_FILE" -c "$SHELL $LOGIN_FLAG"
         return 0
     elif [[ $1 == status ]]; then
@@ -37,15 +45,25 @@ log() {
         if log status 2>/dev/null; then
             # Use tail to avoid following the file while it's being written to
             # Use cat -e to escape ANSI in the output
-            tail -n +1 "$SESSION_LOG_FILE" | cat -e && echo
+            if [[ -n "$SHELL_AI_RECORDER" ]]; then
+                "$PROJECT_ROOT/bin/shell-ai-recorder" dump "$SESSION_LOG_FILE" | cat -e && echo
+            else
+                tail -n +1 "$SESSION_LOG_FILE" | cat -e && echo
+            fi
         else
             echo "Session logging not started" >&2
             return 1
         fi
     elif [[ $1 == clear ]]; then
-        : >"$SESSION_LOG_FILE"
+        if [[ -n "$SHELL_AI_RECORDER" ]]; then
+            "$PROJECT_ROOT/bin/shell-ai-recorder" clear "$SESSION_LOG_FILE"
+        else
+            : >"$SESSION_LOG_FILE"
+        fi
+        rm -f "$SESSION_LOG_FILE.conversation" "$SESSION_LOG_FILE.snapshot"
     elif [[ $1 == stop ]]; then
-        rm -f "$SESSION_LOG_FILE"
+        rm -f "$SESSION_LOG_FILE" "$SESSION_LOG_FILE.index" "$SESSION_LOG_FILE.conversation" \
+            "$SESSION_LOG_FILE.snapshot"
         unset SESSION_LOG_FILE
     elif [[ $1 == update ]]; then
         # Start logging if accidentally terminated
@@ -66,12 +84,32 @@ log() {
             # Remove logging indicator
             PS1="${PS1//$LOG_INDICATOR_TEXT}"
         fi
+        # Process the output written since the last refresh into the context
+        # snapshot in the background, so that `ai` does not have to.  Only once
+        # enough was written, or the log was cleared, since `ai` processes the
+        # rest on top of the snapshot
+        if [[ -f "$SESSION_LOG_FILE" && -z "$SHELL_AI_RECORDER" ]]; then
+            local size last=${SHELL_AI_SNAPSHOT_SIZE:-0}
+            size=$(wc -c <"$SESSION_LOG_FILE")
+            if ((size < last || size - last >= ${SHELL_AI_SNAPSHOT_INTERVAL:-65536})); then
+                SHELL_AI_SNAPSHOT_SIZE=$size
+                ("$PROJECT_ROOT/bin/shell-ai-snapshot" "$SESSION_LOG_FILE" &>/dev/null &)
+            fi
+        fi
     fi
 }
 
 # Set PROMPT_COMMAND to automatically update prompt before each command
 PROMPT_COMMAND="log update${PROMPT_COMMAND:+; $PROMPT_COMMAND}"
 
+if [[ -n "$SHELL_AI_RECORDER" ]]; then
+    # Mark command boundaries for the recorder's index (OSC 133): the exit
+    # status of the last command and the start of the prompt, then the start
+    # of the output once a command is entered
+    PROMPT_COMMAND='printf "\e]133;D;%s\a\e]133;A\a" "$?"; '"$PROMPT_COMMAND"
+    PS0=$'\e]133;C\a'"$PS0"
+fi
+
 # Start session logging
 log start 2>/dev/null
 log update
@@ -84,8 +122,6 @@ clear() {
 }
 
 # Shell AI integration
-SCRIPT_DIR=$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &>/dev/null && pwd)
-PROJECT_ROOT="$(dirname $SCRIPT_DIR)"
 export PATH="$PATH:$PROJECT_ROOT/bin"
 ai() {
     eval "$(shell-ai --context-file "$SESSION_LOG_FILE" -- "$*")"
@@ -1,74 +1,122 @@
 import argparse
+import asyncio
 import html
 import re
 import sys
-from typing import TextIO
-
-from .completion import request_completion
-from .config import MAX_CONTEXT_LENGTH
-from .models import Event, EventType, Ref
-from .prompts import construct_prompt
-from .utils import ask_yes_no, escape_printf, indent, print_styled, strip_ansi, styled
+import time
+from dataclasses import dataclass, field
+
+from .batch import DEFAULT_CONCURRENCY, run_batch
+from .client import start_time
+from .compaction import compact_context, read_length
+from .completion import IncompleteResponse, request_completion, warm_up_connection
+from .config import load_config
+from .context import is_position_readable, log_position, read_context
+from .conversation import MAX_ROUNDS, load_conversation, save_conversation
+from .models import (
+    Conversation,
+    Event,
+    EventType,
+    Message,
+    ParseEvent,
+    ParseEventType,
+    SuggestedCommand,
+    Workflow,
+)
+from .output import OutputWriter
+from .parser import TagParser
+from .prompts import construct_prompt, tool_results_prompt, workflow_type
+from .snapshot import read_snapshot
+from .timings import Timings
+from .tools import MAX_TOOL_ROUNDS, describe_call, describe_tools, run_tools
+from .utils import ask_yes_no, escape_printf, indent, print_styled, styled
 
 PRIMARY_COLOR = (38, 2, 255, 99, 132)
 SECONDARY_COLOR = (38, 2, 255, 159, 64)
 
 
-def flush_buffer(
-    buffer: Ref[str], acc: Ref[str], event_queue: list[Event], *, file: TextIO
-):
-    """Print the buffer contents to stderr and clear it."""
+@dataclass
+class StreamState:
+    """State of the response stream, shared by the stream handlers."""
 
-    if buffer.value:
-        print(buffer.value, end="", flush=True, file=file)
-        acc.value += buffer.value
-        buffer.value = ""
+    parser: TagParser = field(default_factory=lambda: TagParser(["exec", "tool"]))
+    command: list[str] | None = None  # Chunks of the tag being received
+    parallel: bool = False  # Whether the tag being received is `<exec parallel>`
+    last_output: str = ""
+    # Follow redirects of the standard streams, e.g. in the benchmarks
+    stdout: OutputWriter = field(
+        default_factory=lambda: OutputWriter(lambda: sys.stdout)
+    )
+    stderr: OutputWriter = field(
+        default_factory=lambda: OutputWriter(lambda: sys.stderr)
+    )
+    # Suggested commands to approve while the response is streaming
+    suggestions: asyncio.Queue[SuggestedCommand | None] | None = None
 
 
-def buffer_handler(
-    buffer: Ref[str], acc: Ref[str], event_queue: list[Event], *, print_mode: bool
-):
-    """Handle the response stream buffer."""
+def write_output(output: list[str], state: StreamState, *, writer: OutputWriter):
+    """Write the collected output pieces at once."""
 
-    if print_mode:
-        flush_buffer(buffer, acc, event_queue, file=sys.stdout)
-        return
+    if text := "".join(output):
+        writer.write(text)
+        state.last_output = text
 
-    OPENING_TAG = "<exec>"
-    CLOSING_TAG = "</exec>"
-
-    # Check if the buffer contains tags or partial tags
-    if buffer.value.find(OPENING_TAG) != -1 or any(
-        buffer.value.endswith(OPENING_TAG[: j + 1]) for j in range(len(OPENING_TAG))
-    ):
-        # Replace tags and trigger event
-        while True:
-            changed = False
-
-            if run_command_match := re.search(
-                rf"{OPENING_TAG}(.*?){CLOSING_TAG}", buffer.value, re.DOTALL
-            ):
-                # Trigger command suggestion
-                command = html.unescape(
-                    run_command_match.group(1)
-                )  # Unescape &lt;, &gt;, etc.
-                buffer.value = (
-                    buffer.value[: run_command_match.start()]
-                    + styled(command, "bold", code_tuple=SECONDARY_COLOR)
-                    + buffer.value[run_command_match.end() :]
-                )
-                event_queue.append(Event(EventType.SUGGEST_COMMAND, command))
-                changed = True
 
-            if not changed:
-                break
+def handle_parse_event(
+    event: ParseEvent, state: StreamState, output: list[str], event_queue: list[Event]
+):
+    """Collect the output of a parse event, and trigger events for closed tags."""
+
+    if event.type == ParseEventType.OPENING_TAG:
+        state.command = []
+        state.parallel = "parallel" in event.attrs
+    elif event.type == ParseEventType.CLOSING_TAG and event.tag == "tool":
+        # Run the tool once the response ends
+        call = html.unescape("".join(state.command or []))
+        output.append(styled(f"[{describe_call(call)}]", "dim"))
+        event_queue.append(Event(EventType.CALL_TOOL, call))
+        state.command = None
+    elif event.type == ParseEventType.CLOSING_TAG:
+        # Trigger command suggestion
+        command = html.unescape(
+            "".join(state.command or [])
+        )  # Unescape &lt;, &gt;, etc.
+        output.append(styled(command, "bold", code_tuple=SECONDARY_COLOR))
+        suggestion = SuggestedCommand(command, state.parallel)
+        event_queue.append(Event(EventType.SUGGEST_COMMAND, suggestion))
+        if state.suggestions is not None:
+            state.suggestions.put_nowait(suggestion)
+        state.command = None
+    elif state.command is not None:
+        state.command.append(event.data)
     else:
-        flush_buffer(buffer, acc, event_queue, file=sys.stderr)
+        output.append(event.data)
 
 
-def start_handler(
-    buffer: Ref[str], acc: Ref[str], event_queue: list[Event], *, print_mode: bool
+def buffer_handler(
+    token: str, event_queue: list[Event], *, state: StreamState, print_mode: bool
 ):
+    """Handle a token of the response stream."""
+
+    if print_mode:
+        write_output([token], state, writer=state.stdout)
+        return
+
+    output: list[str] = []
+    tag_boundary = False
+    for event in state.parser.feed(token):
+        handle_parse_event(event, state, output, event_queue)
+        tag_boundary = tag_boundary or event.type != ParseEventType.TEXT
+    write_output(output, state, writer=state.stderr)
+    if tag_boundary:
+        # Show a suggested command as a whole
+        state.stderr.flush()
+        if state.suggestions is not None and not state.suggestions.empty():
+            # Hold back the rest of the response while the user is prompted
+            state.stderr.hold()
+
+
+def start_handler(event_queue: list[Event], *, state: StreamState, print_mode: bool):
     if not print_mode:
         print_styled(
             "AI:",
@@ -78,19 +126,146 @@ def start_handler(
         )
 
 
-def stop_handler(
-    buffer: Ref[str], acc: Ref[str], event_queue: list[Event], *, print_mode: bool
-):
-    flush_buffer(
-        buffer, acc, event_queue, file=sys.stdout if print_mode else sys.stderr
-    )
+def stop_handler(event_queue: list[Event], *, state: StreamState, print_mode: bool):
+    writer = state.stdout if print_mode else state.stderr
 
-    if not acc.value.endswith("\n"):
+    output: list[str] = []
+    for event in state.parser.close():
+        handle_parse_event(event, state, output, event_queue)
+    if state.command is not None:
+        # Print an unclosed tag as is
+        output.append(f"<{state.parser.open_tag}>" + "".join(state.command))
+    write_output(output, state, writer=writer)
+    # Start over for the next response, after tool calls
+    state.parser = TagParser(state.parser.tags)
+    state.command = None
+
+    if not state.last_output.endswith("\n"):
         # Print a final newline
-        print(file=sys.stdout if print_mode else sys.stderr)
+        writer.write("\n")
+    writer.flush()
+
+
+async def approve_commands(
+    state: StreamState, timings: Timings
+) -> list[SuggestedCommand]:
+    """Ask for approval of each suggested command as soon as it is complete.
 
+    Runs alongside the response stream until `None` is queued, and returns
+    the approved commands in the order they were suggested.
+    """
 
-def parse_arguments():
+    approved_commands: list[SuggestedCommand] = []
+    while (suggestion := await state.suggestions.get()) is not None:
+        header = "\nAI suggests running this command"
+        if suggestion.parallel:
+            header += " (in parallel with its neighbours)"
+        print(styled(header + ":", "bold", code_tuple=PRIMARY_COLOR), file=sys.stderr)
+        print_styled(
+            indent(suggestion.command, 0),
+            "bold",
+            code_tuple=SECONDARY_COLOR,
+            file=sys.stderr,
+        )
+        with timings.measure("approval"):
+            approved = await ask_yes_no(
+                styled("Approve?", "bold", code_tuple=PRIMARY_COLOR)
+            )
+        if approved:
+            approved_commands.append(suggestion)
+        if state.suggestions.empty():
+            # Show the response received in the meantime
+            state.stderr.release()
+    state.stderr.release()
+    return approved_commands
+
+
+PROCEED_PATTERN = re.compile(r"ai proceed|ai \"proceed\"|ai \'proceed\'")
+
+# Shell variable holding the output directory of a parallel group
+OUTPUT_DIR_VARIABLE = "__shell_ai_output"
+
+
+def group_commands(commands: list[SuggestedCommand]) -> list[list[tuple[int, str]]]:
+    """Split the numbered commands into groups that run one after another.
+
+    Consecutive parallel commands form a group, and any other command is a
+    group of its own.  Commands with `ai proceed` are never run in parallel,
+    since they have to run last.
+    """
+
+    groups: list[list[tuple[int, str]]] = []
+    previous_parallel = False
+    for i, command in enumerate(commands, 1):
+        parallel = command.parallel and not PROCEED_PATTERN.search(command.command)
+        if parallel and previous_parallel:
+            groups[-1].append((i, command.command))
+        else:
+            groups.append([(i, command.command)])
+        previous_parallel = parallel
+    return groups
+
+
+def combine_parallel_commands(group: list[tuple[int, str]], total: int) -> str:
+    """Run a group of commands concurrently, each with its output captured to a
+    file of a temporary directory, and then print the outputs in order with
+    their exit statuses.
+
+    The jobs run in a subshell, where job control is off, so that the shell
+    does not report them.  Their input is /dev/null, since they cannot share
+    the terminal.
+    """
+
+    directory = f'"${OUTPUT_DIR_VARIABLE}"'
+    combined_command = f"printf {escape_printf(styled(f'\nAI is executing approved commands ({group[0][0]}-{group[-1][0]}/{total}) in parallel...', 'bold', code_tuple=PRIMARY_COLOR))};\n"
+    combined_command += f"{OUTPUT_DIR_VARIABLE}=$(mktemp -d);\n(\n"
+    for i, command in group:
+        combined_command += f"( (\n{command.strip()}\n) >{directory}/{i} 2>&1 </dev/null; echo $? >{directory}/{i}.status ) &\n"
+    combined_command += "wait\n);\n"
+    for i, _ in group:
+        combined_command += f"printf {escape_printf(styled(f'\nAI executed approved command ({i}/{total}), exit status: ', 'bold', code_tuple=PRIMARY_COLOR))};\n"
+        combined_command += f"cat {directory}/{i}.status {directory}/{i} 2>/dev/null;\n"
+    combined_command += f"rm -rf {directory}; unset {OUTPUT_DIR_VARIABLE};\n"
+    return combined_command
+
+
+def combine_commands(commands: list[SuggestedCommand]) -> str:
+    """Construct the shell code that runs the approved commands."""
+
+    combined_command = ""
+    has_proceed = False
+    for group in group_commands(commands):
+        if len(group) > 1:
+            combined_command += combine_parallel_commands(group, len(commands))
+            continue
+        i, command = group[0]
+        if PROCEED_PATTERN.search(command):
+            has_proceed = True
+        combined_command += f"printf {escape_printf(styled(f'\nAI is executing approved command ({i}/{len(commands)}):', 'bold', code_tuple=PRIMARY_COLOR))};\n"
+        combined_command += f"printf {escape_printf('\n')};\n"
+        # combined_command += f"printf {escape_printf('\n' + indent(command, 0))};\n"
+        combined_command += f"{{\n{command.strip()}\n}};"
+    if commands and not has_proceed:
+        combined_command += f"printf {escape_printf(styled('\nAI done.\n', 'bold', code_tuple=PRIMARY_COLOR))};\n"
+    return combined_command
+
+
+class ProfileStartupAction(argparse.Action):
+    """Print the startup import profile and exit, like `--help`."""
+
+    def __init__(self, option_strings, dest, **kwargs):
+        super().__init__(
+            option_strings, dest, nargs=0, default=argparse.SUPPRESS, **kwargs
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from .profiling import print_startup_profile
+
+        print_startup_profile(file=sys.stderr)
+        parser.exit()
+
+
+def parse_arguments(argv: list[str] | None = None):
     parser = argparse.ArgumentParser(
         prog="shell-ai", formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -104,8 +279,46 @@ def parse_arguments():
         "--print", action="store_true", help="Print response directly to stdout"
     )
     parser.add_argument("--raw", action="store_true", help="Raw prompt mode")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use the completion cache for raw prompts",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print the time taken by each phase to stderr",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Run the prompts of a JSONL file concurrently ('-' for stdin)",
+    )
+    parser.add_argument(
+        "--out",
+        metavar="FILE",
+        help="Append the batch results to this file, skipping the prompts "
+        "it already has a result for (default: stdout)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Prompts run at once in batch mode (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action=ProfileStartupAction,
+        help="Report the import cost of each package on startup and exit",
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.batch is not None and args.message:
+        parser.error("a message cannot be given with --batch")
+    if args.out is not None and args.batch is None:
+        parser.error("--out requires --batch")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
 
     return (
         str(args.context_file) if args.context_file is not None else None,
@@ -113,85 +326,234 @@ def parse_arguments():
         args.model,
         args.print,
         args.raw,
+        args.no_cache,
+        args.timings,
+        args.batch,
+        args.out,
+        args.concurrency,
     )
 
 
-async def main():
-    global agent_name
-    context_file, message, model, print_mode, raw_mode = parse_arguments()
-
-    # Read the shell session context if context file is provided
+def build_prompt(
+    context_file: str | None,
+    message: str,
+    raw_mode: bool,
+    timings: Timings,
+    *,
+    use_tools: bool = True,
+) -> list[Message]:
+    """Read the session context and construct the prompt messages.
+
+    With `use_tools`, the prompt offers the tools enabled in the config.
+    """
+
+    config = load_config()
+
+    # Continue the conversation of `ai proceed` rounds, with only the terminal
+    # output since the last round, unless the log has been cleared since
+    history = None
+    since = 0
+    if context_file and not raw_mode and workflow_type(message) == Workflow.PROCEED:
+        conversation = load_conversation(context_file)
+        if (
+            conversation is not None
+            and len(conversation.messages) < 2 * MAX_ROUNDS
+            and is_position_readable(context_file, conversation.position)
+        ):
+            history = conversation.messages
+            since = conversation.position.offset
+
+    # Read the end of the shell session context if context file is provided,
+    # and compact it into the token budget
     session_context = None
     if context_file:
-        try:
-            with open(context_file, "r", errors="replace") as f:
-                session_context = strip_ansi(f.read())
-        except:
-            pass
+        with timings.measure("context"):
+            max_length = read_length(config)
+            try:
+                # Most of the log is usually processed already, in the
+                # background (see `snapshot`)
+                if not since:
+                    session_context = read_snapshot(context_file, max_length)
+                if session_context is None:
+                    session_context = read_context(
+                        context_file,
+                        max_length,
+                        max_commands=config.max_context_commands,
+                        since=since,
+                    )
+            except:
+                pass
+            if session_context and config.max_context_tokens:
+                session_context = compact_context(
+                    session_context,
+                    config.max_context_tokens,
+                    truncated=len(session_context) == max_length,
+                )
 
     # Construct the prompt
-    prompt = construct_prompt(
-        session_context=session_context[-(MAX_CONTEXT_LENGTH or 0) :]
-        if session_context is not None
-        else "Failed to acquire context",
-        message=message,
-        raw_mode=raw_mode,
+    with timings.measure("prompt"):
+        messages = construct_prompt(
+            session_context=(
+                session_context
+                if session_context is not None
+                else "Failed to acquire context"
+            ),
+            message=message,
+            raw_mode=raw_mode,
+            history=history,
+            tools=describe_tools(config.tools) if use_tools else None,
+        )
+    timings.prompt_size = sum(len(message["content"]) for message in messages)
+    return messages
+
+
+async def warm_up(timings: Timings):
+    with timings.measure("connect"):
+        await warm_up_connection()
+
+
+async def main(argv: list[str] | None = None, *, started_at: float | None = None):
+    global agent_name
+    (
+        context_file,
+        message,
+        model,
+        print_mode,
+        raw_mode,
+        no_cache,
+        timings_mode,
+        batch_file,
+        output_file,
+        concurrency,
+    ) = parse_arguments(argv)
+
+    if batch_file is not None:
+        # The flags are the defaults of the prompts
+        summary = await run_batch(
+            batch_file,
+            output_file,
+            concurrency=concurrency,
+            model=model,
+            raw=raw_mode,
+            print_mode=print_mode,
+            use_cache=not no_cache,
+        )
+        if summary.failed:
+            sys.exit(1)
+        return
+
+    # Time from the launcher script, if available
+    if started_at is None:
+        started_at = start_time()
+    timings = Timings(started_at or time.time())
+    if started_at:
+        timings.add("startup", time.time() - started_at)
+
+    # Set up the API connection while the prompt is being built
+    warm_up_task = asyncio.create_task(warm_up(timings))
+    # Responses are not parsed in print mode, so tools cannot be called
+    messages = await asyncio.to_thread(
+        build_prompt,
+        context_file,
+        message,
+        raw_mode,
+        timings,
+        use_tools=not print_mode,
     )
+    await warm_up_task
 
-    # Invoke the LLM API and handle the response
+    # Invoke the LLM API and handle the response, asking for approval of the
+    # suggested commands while it streams
     event_queue: list[Event] = []
+    state = StreamState()
+    if not print_mode:
+        state.suggestions = asyncio.Queue()
+        approval_task = asyncio.create_task(approve_commands(state, timings))
+    incomplete = False
     try:
-        await request_completion(
-            [{"role": "user", "content": prompt}],
-            model=model,
-            event_queue=event_queue,
-            buffer_handler=lambda *args: buffer_handler(*args, print_mode=print_mode),
-            start_handler=lambda *args: start_handler(*args, print_mode=print_mode),
-            stop_handler=lambda *args: stop_handler(*args, print_mode=print_mode),
+        for tool_round in range(MAX_TOOL_ROUNDS + 1):
+            round_start = len(event_queue)
+            reply = await request_completion(
+                messages,
+                model=model,
+                event_queue=event_queue,
+                buffer_handler=lambda *args: buffer_handler(
+                    *args, state=state, print_mode=print_mode
+                ),
+                # The response continues after tool calls
+                start_handler=(
+                    None
+                    if tool_round
+                    else lambda *args: start_handler(
+                        *args, state=state, print_mode=print_mode
+                    )
+                ),
+                stop_handler=lambda *args: stop_handler(
+                    *args, state=state, print_mode=print_mode
+                ),
+                # Raw prompts carry no session context, so repeating them is common
+                use_cache=raw_mode and not no_cache,
+                timings=timings,
+                workflow=workflow_type(message, raw_mode),
+            )
+
+            # Send the results of the tools called back in the same
+            # conversation, and continue the response
+            calls = [
+                event.data
+                for event in event_queue[round_start:]
+                if event.type == EventType.CALL_TOOL
+            ]
+            if not calls or raw_mode or tool_round == MAX_TOOL_ROUNDS:
+                break
+            with timings.measure("tools"):
+                results = await asyncio.to_thread(run_tools, calls, context_file)
+            messages = [*messages, reply, tool_results_prompt(calls, results)]
+    except IncompleteResponse as e:
+        # Keep what was received, e.g. the commands suggested so far
+        print_styled(
+            f"Warning: {e}.  The response is incomplete.", "yellow", file=sys.stderr
         )
+        reply = e.reply
+        incomplete = True
     except Exception as e:
+        if not print_mode:
+            approval_task.cancel()
+            state.stderr.release()
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
-    # Process the events from the response
-    commands_to_run: list[str] = []
-    for event in event_queue:
-        if event.type == EventType.SUGGEST_COMMAND:
-            if not print_mode:
-                # Ask the user for confirmation before running the command
-                print(
-                    styled(
-                        "\nAI suggests running this command:",
-                        "bold",
-                        code_tuple=PRIMARY_COLOR,
-                    ),
-                    file=sys.stderr,
-                )
-                print_styled(
-                    indent(event.data, 0),
-                    "bold",
-                    code_tuple=SECONDARY_COLOR,
-                    file=sys.stderr,
-                )
-            if (
-                print_mode  # Approve without asking, since it will not execute anyway
-                or ask_yes_no(styled("Approve?", "bold", code_tuple=PRIMARY_COLOR))
-            ):
-                commands_to_run.append(event.data)
+    if print_mode:
+        # Approve without asking, since it will not execute anyway
+        commands_to_run = [
+            event.data
+            for event in event_queue
+            if event.type == EventType.SUGGEST_COMMAND
+        ]
+    else:
+        state.suggestions.put_nowait(None)
+        commands_to_run = await approval_task
 
-    # Construct the combined command
-    combined_command = ""
-    proceed_pattern = re.compile(r"ai proceed|ai \"proceed\"|ai \'proceed\'")
-    has_proceed = False
-    for i, command in enumerate(commands_to_run, 1):
-        if proceed_pattern.search(command):
-            has_proceed = True
-        combined_command += f"printf {escape_printf(styled(f'\nAI is executing approved command ({i}/{len(commands_to_run)}):', 'bold', code_tuple=PRIMARY_COLOR))};\n"
-        combined_command += f"printf {escape_printf('\n')};\n"
-        # combined_command += f"printf {escape_printf('\n' + indent(command, 0))};\n"
-        combined_command += f"{{\n{command.strip()}\n}};"
-    if commands_to_run and not has_proceed:
-        combined_command += f"printf {escape_printf(styled('\nAI done.\n', 'bold', code_tuple=PRIMARY_COLOR))};\n"
+    combined_command = combine_commands(commands_to_run)
+
+    if context_file and not raw_mode:
+        # Keep the conversation for the next `ai proceed` round, up to what
+        # the terminal shows now
+        try:
+            position = log_position(context_file)
+        except (OSError, ValueError):
+            pass
+        else:
+            save_conversation(
+                context_file, Conversation([*messages[1:], reply], position)
+            )
+
+    if timings_mode:
+        timings.report(file=sys.stderr)
+    # Imported here, so that `python -m shell_ai.usage` runs it only once
+    from .usage import record_usage
+
+    record_usage(timings, timings.model or model or load_config().openai_model)
 
     if print_mode:
         pass
@@ -199,6 +561,10 @@ async def main():
         # Write the combined command to stdout, which will be executed in shell using `eval`
         print(combined_command, file=sys.stdout)
 
+    if incomplete:
+        # Do not let scripts take the partial output for a complete one
+        sys.exit(1)
+
 
 def cleanup():
     pass
@@ -6,9 +6,16 @@ from .utils import print_styled
 
 if __name__ == "__main__":
     from . import main, cleanup
+    from .completion import close_client
+
+    async def run():
+        try:
+            await main()
+        finally:
+            await close_client()
 
     try:
-        asyncio.run(main())
+        asyncio.run(run())
     except KeyboardInterrupt:
         print_styled("\nProcess interrupted by user.", "yellow", file=sys.stderr)
         sys.exit(0)
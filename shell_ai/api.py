@@ -0,0 +1,172 @@
+"""Library API, for tools that make requests in-process instead of running
+`shell-ai --print --raw`.
+
+The process-wide API client is reused across calls, so many requests in one
+process share the same warm connections.  The synchronous functions run on a
+private event loop that is kept between calls for that reason.
+
+    from shell_ai.api import astream, complete, stream
+
+    print(complete("Translate to French: good morning"))
+
+    for token in stream("Tell me a story"):
+        print(token, end="", flush=True)
+
+    async for token in astream("Tell me a story"):
+        print(token, end="", flush=True)
+    await aclose()
+
+Async callers should `await aclose()` before their event loop ends, to close
+the connections.
+"""
+
+import asyncio
+import atexit
+from collections.abc import AsyncIterator, Iterator
+
+from .completion import close_client, request_completion
+from .models import Message
+
+Prompt = str | list[Message]
+
+
+def _messages(prompt: Prompt, system: str | None) -> list[Message]:
+    messages = (
+        [{"role": "user", "content": prompt}] if isinstance(prompt, str) else prompt
+    )
+    if system is not None:
+        messages = [{"role": "system", "content": system}, *messages]
+    return messages
+
+
+async def acomplete(
+    prompt: Prompt,
+    *,
+    model: str | None = None,
+    system: str | None = None,
+    use_cache: bool = True,
+    hint: str | None = None,
+) -> str:
+    """Return the completion of a prompt, or of a list of messages.
+
+    The completion cache is used if it is enabled in the config, unless
+    `use_cache` is false.  Without `model`, the model is chosen by the routes
+    of the config, which can match the caller's `hint`, e.g. "translate".
+    """
+
+    message = await request_completion(
+        _messages(prompt, system), model=model, use_cache=use_cache, hint=hint
+    )
+    return message["content"]
+
+
+async def astream(
+    prompt: Prompt,
+    *,
+    model: str | None = None,
+    system: str | None = None,
+    use_cache: bool = True,
+    hint: str | None = None,
+) -> AsyncIterator[str]:
+    """Yield the completion of a prompt, or of a list of messages, as it arrives."""
+
+    tokens: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def run():
+        try:
+            await request_completion(
+                _messages(prompt, system),
+                model=model,
+                buffer_handler=lambda token, _: tokens.put_nowait(token),
+                use_cache=use_cache,
+                hint=hint,
+            )
+        finally:
+            tokens.put_nowait(None)
+
+    task = asyncio.create_task(run())
+    try:
+        while (token := await tokens.get()) is not None:
+            yield token
+        # Raise the request's error, if any
+        await task
+    finally:
+        task.cancel()
+
+
+async def aclose():
+    """Close the process-wide API client and its connections."""
+
+    await close_client()
+
+
+_runner: asyncio.Runner | None = None
+
+
+def _run(coroutine):
+    global _runner
+    if _runner is None:
+        _runner = asyncio.Runner()
+        atexit.register(_close_runner)
+    return _runner.run(coroutine)
+
+
+def _close_runner():
+    global _runner
+    if _runner is not None:
+        _runner.run(close_client())
+        try:
+            _runner.close()
+        except RuntimeError:
+            # The default executor cannot be shut down at interpreter exit, but
+            # the interpreter joins its threads anyway
+            pass
+        _runner = None
+
+
+def complete(
+    prompt: Prompt,
+    *,
+    model: str | None = None,
+    system: str | None = None,
+    use_cache: bool = True,
+    hint: str | None = None,
+) -> str:
+    """Synchronous version of `acomplete`, for code without an event loop."""
+
+    return _run(
+        acomplete(prompt, model=model, system=system, use_cache=use_cache, hint=hint)
+    )
+
+
+async def _next(tokens: AsyncIterator[str]) -> str:
+    return await anext(tokens)
+
+
+async def _close(tokens: AsyncIterator[str]):
+    await tokens.aclose()
+
+
+def stream(
+    prompt: Prompt,
+    *,
+    model: str | None = None,
+    system: str | None = None,
+    use_cache: bool = True,
+    hint: str | None = None,
+) -> Iterator[str]:
+    """Synchronous version of `astream`, for code without an event loop.
+
+    The request only makes progress while the caller waits for a token.
+    """
+
+    tokens = astream(prompt, model=model, system=system, use_cache=use_cache, hint=hint)
+    try:
+        while True:
+            try:
+                yield _run(_next(tokens))
+            except StopAsyncIteration:
+                return
+    finally:
+        # Cancel the request of a stream that is not read to the end
+        _run(_close(tokens))
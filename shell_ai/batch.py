@@ -0,0 +1,222 @@
+"""Batch mode: run the prompts of a JSONL file concurrently in one process.
+
+Each input line is an object with a `message`, and optionally an `id` (the
+line number by default), a `model`, the `raw` and `print` flags of the
+command line, and the terminal `context` of a non-raw prompt.  The prompts
+share the process-wide API client, so its warm connections, and at most
+`concurrency` of them are in flight at once.  Each result is written as soon
+as it completes, tagged with the id of its input, so they can be out of
+order.  When the output file already has a result for an id, the prompt is
+skipped, so a killed job can be run again to finish it.
+"""
+
+import asyncio
+import html
+import json
+import sys
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import TextIO
+
+from .completion import IncompleteResponse, request_completion
+from .models import ParseEventType
+from .parser import TagParser
+from .prompts import construct_prompt, workflow_type
+from .timings import Timings
+
+DEFAULT_CONCURRENCY = 8
+
+# Terminal context of a non-raw prompt without one
+NO_CONTEXT = "Not available in batch mode"
+
+
+@dataclass
+class BatchSummary:
+    completed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    tokens: int = 0
+
+
+def _key(item_id) -> str:
+    # Ids are compared as JSON, so that 1 and "1" are different ids
+    return json.dumps(item_id)
+
+
+def load_done(path: str) -> set[str]:
+    """Return the ids of the prompts with a successful result in the output file."""
+
+    done = set()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A line cut short by a killed job
+                    continue
+                if isinstance(result, dict) and "error" not in result:
+                    done.add(_key(result.get("id")))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def read_items(f: TextIO) -> Iterator[dict]:
+    """Yield the prompts of the input as they are read.
+
+    An invalid line is yielded as an item with an `error`.
+    """
+
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield {"id": number, "error": f"Invalid JSON: {e}"}
+            continue
+        if not isinstance(item, dict) or not isinstance(item.get("message"), str):
+            yield {"id": number, "error": "Expected an object with a message"}
+            continue
+        item.setdefault("id", number)
+        yield item
+
+
+def split_commands(content: str) -> tuple[str, list[str]]:
+    """Return the text of a response as the terminal shows it, and its commands."""
+
+    parser = TagParser(["exec"])
+    text: list[str] = []
+    commands: list[str] = []
+    command: list[str] | None = None
+    for event in [*parser.feed(content), *parser.close()]:
+        if event.type == ParseEventType.OPENING_TAG:
+            command = []
+        elif event.type == ParseEventType.CLOSING_TAG:
+            commands.append(html.unescape("".join(command or [])))
+            text.append(commands[-1])
+            command = None
+        elif command is not None:
+            command.append(event.data)
+        else:
+            text.append(event.data)
+    if command is not None:
+        # An unclosed tag is kept as is
+        text.append("<exec>" + "".join(command))
+    return "".join(text), commands
+
+
+async def run_item(
+    item: dict, *, model: str | None, raw: bool, print_mode: bool, use_cache: bool
+) -> dict:
+    """Run the prompt of an item, and return its result."""
+
+    if "error" in item:
+        return item
+
+    raw = item.get("raw", raw)
+    print_mode = item.get("print", print_mode)
+    message = item["message"]
+    messages = construct_prompt(
+        session_context=item.get("context") or NO_CONTEXT,
+        message=message,
+        raw_mode=raw,
+    )
+    timings = Timings(prompt_size=sum(len(entry["content"]) for entry in messages))
+    result = {"id": item["id"]}
+    try:
+        reply = await request_completion(
+            messages,
+            model=item.get("model", model),
+            # Raw prompts carry no session context, so repeating them is common
+            use_cache=raw and use_cache,
+            timings=timings,
+            workflow=workflow_type(message, raw),
+        )
+    except IncompleteResponse as e:
+        reply = e.reply
+        result["error"] = f"{e}.  The response is incomplete."
+    except Exception as e:
+        return {**result, "error": str(e)}
+    from .usage import record_usage
+
+    record_usage(timings, timings.model)
+
+    if print_mode:
+        result["content"] = reply["content"]
+    else:
+        result["content"], result["commands"] = split_commands(reply["content"])
+    result["model"] = timings.model
+    result["tokens"] = timings.completion_tokens
+    return result
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str | None,
+    *,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    model: str | None = None,
+    raw: bool = False,
+    print_mode: bool = False,
+    use_cache: bool = True,
+) -> BatchSummary:
+    """Run the prompts of the input file, appending their results to the output.
+
+    "-" or None reads from stdin or writes to stdout, without resuming.  A
+    summary of the throughput and failures is printed to stderr.
+    """
+
+    done = load_done(output_path) if output_path not in (None, "-") else set()
+    summary = BatchSummary()
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.monotonic()
+
+    input_file = sys.stdin if input_path == "-" else open(input_path)
+    output_file = sys.stdout if output_path in (None, "-") else open(output_path, "a")
+
+    async def run(item: dict):
+        try:
+            result = await run_item(
+                item,
+                model=model,
+                raw=raw,
+                print_mode=print_mode,
+                use_cache=use_cache,
+            )
+        finally:
+            semaphore.release()
+        if "error" in result:
+            summary.failed += 1
+        else:
+            summary.completed += 1
+            summary.tokens += result.get("tokens") or 0
+        output_file.write(json.dumps(result) + "\n")
+        output_file.flush()
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            for item in read_items(input_file):
+                if _key(item["id"]) in done:
+                    summary.skipped += 1
+                    continue
+                # Read no further than the prompts that can run
+                await semaphore.acquire()
+                group.create_task(run(item))
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    elapsed = time.monotonic() - started
+    print(
+        f"{summary.completed} completed, {summary.failed} failed, "
+        f"{summary.skipped} skipped in {elapsed:.1f} s "
+        f"({summary.completed / elapsed:.1f} prompts/s, "
+        f"{summary.tokens / elapsed:.0f} tokens/s)",
+        file=sys.stderr,
+    )
+    return summary
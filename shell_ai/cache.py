@@ -0,0 +1,230 @@
+"""Persistent cache of completions, for repeated deterministic requests.
+
+Entries are kept in an SQLite database in WAL mode, so that any number of
+processes can read and write it at once.  The key is a hash of the model and
+the normalized messages.  Entries expire after a time to live, and the least
+recently used ones are evicted once the total size exceeds a limit.
+
+Usage: python -m shell_ai.cache {stats|clear}
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+from .config import load_config
+from .models import Message
+
+CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "shell-ai",
+    "completions.sqlite3",
+)
+
+# How long to wait for another process holding the write lock
+BUSY_TIMEOUT = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def cache_key(model: str, messages: list[Message]) -> str:
+    """Hash the model and the messages, ignoring insignificant differences."""
+
+    normalized = [
+        {
+            "role": message["role"],
+            "content": message["content"].replace("\r\n", "\n").strip(),
+        }
+        for message in messages
+    ]
+    data = json.dumps(
+        {"model": model, "messages": normalized},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class CompletionCache:
+    def __init__(
+        self,
+        path: str = CACHE_FILE,
+        *,
+        max_size: int | None = None,
+        ttl: float | None = None,
+    ):
+        config = load_config()
+        self.max_size = max_size if max_size is not None else config.cache_max_size
+        self.ttl = ttl if ttl is not None else config.cache_ttl
+
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        self.connection = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, key: str) -> str | None:
+        """Return the cached content for the key, counting a hit or a miss."""
+
+        now = time.time()
+        with self._transaction():
+            row = self.connection.execute(
+                "SELECT content, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl and row[1] < now - self.ttl:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE entries SET accessed = ? WHERE key = ?", (now, key)
+                )
+            self._count("hits" if row is not None else "misses")
+        return row[0] if row is not None else None
+
+    def put(self, key: str, model: str, content: str):
+        """Store the content, then evict entries over the limits."""
+
+        now = time.time()
+        size = len(key) + len(content.encode())
+        with self._transaction():
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, content, size, now, now),
+            )
+            self._evict(now)
+
+    def stats(self) -> dict[str, int]:
+        counters = dict(self.connection.execute("SELECT name, value FROM counters"))
+        entries, size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "size": size,
+        }
+
+    def clear(self):
+        with self._transaction():
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("DELETE FROM counters")
+        self.connection.execute("VACUUM")
+
+    @contextmanager
+    def _transaction(self):
+        # Take the write lock up front, so that concurrent transactions wait
+        # for it instead of failing to upgrade a read lock
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _count(self, name: str, n: int = 1):
+        self.connection.execute(
+            "INSERT INTO counters VALUES (?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    def _evict(self, now: float):
+        evicted = 0
+        if self.ttl:
+            evicted += self.connection.execute(
+                "DELETE FROM entries WHERE created < ?", (now - self.ttl,)
+            ).rowcount
+
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total > self.max_size:
+            # Drop the least recently used entries until the rest fit
+            rows = self.connection.execute(
+                "SELECT key, size FROM entries ORDER BY accessed"
+            ).fetchall()
+            keys = []
+            for key, size in rows:
+                if total <= self.max_size:
+                    break
+                keys.append((key,))
+                total -= size
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", keys)
+            evicted += len(keys)
+
+        if evicted:
+            self._count("evictions", evicted)
+
+
+def lookup(model: str, messages: list[Message]) -> str | None:
+    """Return the cached completion, or None on a miss or a cache error."""
+
+    try:
+        with CompletionCache() as cache:
+            return cache.get(cache_key(model, messages))
+    except sqlite3.Error:
+        return None
+
+
+def store(model: str, messages: list[Message], content: str):
+    try:
+        with CompletionCache() as cache:
+            cache.put(cache_key(model, messages), model, content)
+    except sqlite3.Error:
+        pass
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    with CompletionCache() as cache:
+        if action == "stats":
+            stats = cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            hit_rate = stats["hits"] / lookups if lookups else 0.0
+            print(f"entries:   {stats['entries']} ({stats['size'] / 1024:.1f} KiB)")
+            print(f"hits:      {stats['hits']} ({hit_rate:.1%})")
+            print(f"misses:    {stats['misses']}")
+            print(f"evictions: {stats['evictions']}")
+        elif action == "clear":
+            cache.clear()
+        else:
+            print(__doc__.strip().splitlines()[-1], file=sys.stderr)
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Thin client for the shell-ai daemon.
+
+This module is executed directly as a script by `bin/shell-ai`, so it must only
+depend on the standard library and must not import the rest of the package.
+When no daemon is listening, it replaces itself with the in-process CLI.
+"""
+
+import json
+import os
+import socket
+import stat
+import sys
+
+
+def runtime_dir() -> str:
+    """Return the per-user runtime directory, creating it if necessary.
+
+    Raises PermissionError if the directory is not a private directory of the
+    user, since another user could then serve fake responses from its socket.
+    """
+
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    path = (
+        os.path.join(base, "shell-ai")
+        if base
+        else os.path.join("/tmp", f"shell-ai-{os.getuid()}")
+    )
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or info.st_mode & 0o077
+    ):
+        raise PermissionError(
+            f"{path} is not a directory of the user with mode 700, refusing to use it"
+        )
+    return path
+
+
+def socket_path() -> str:
+    return os.path.join(runtime_dir(), "daemon.sock")
+
+
+def send_message(sock: socket.socket, message: dict):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def start_time() -> float | None:
+    """Return the start time set by the launcher script, if any."""
+
+    try:
+        # Bash formats $EPOCHREALTIME with the locale's decimal separator
+        return float(os.environ.get("SHELL_AI_START", "").replace(",", "."))
+    except ValueError:
+        return None
+
+
+# Variables that change how a call runs, which the daemon must share with the
+# client to run it, besides those with these prefixes and suffixes
+ENVIRONMENT_NAMES = frozenset(
+    {"LANG", "XDG_CONFIG_HOME", "XDG_CACHE_HOME", "XDG_STATE_HOME", "PYTHONPATH"}
+)
+ENVIRONMENT_PREFIXES = ("OPENAI_", "LC_", "SSL_CERT_", "REQUESTS_CA_")
+ENVIRONMENT_SUFFIXES = ("_proxy", "_PROXY")
+
+# Set for each call, and passed separately
+PER_CALL_NAMES = frozenset({"SHELL_AI_START", "SHELL_AI_CWD"})
+
+
+def forwarded_environment() -> dict[str, str]:
+    """Return the variables of the environment that a call depends on."""
+
+    return {
+        name: value
+        for name, value in os.environ.items()
+        if name not in PER_CALL_NAMES
+        and (
+            name in ENVIRONMENT_NAMES
+            or name.startswith(("SHELL_AI_", *ENVIRONMENT_PREFIXES))
+            or name.endswith(ENVIRONMENT_SUFFIXES)
+        )
+    }
+
+
+def caller_directory() -> str:
+    """Return the directory `shell-ai` was called from."""
+
+    return os.environ.get("SHELL_AI_CWD") or os.getcwd()
+
+
+def run_in_process(argv: list[str]):
+    """Replace the current process with the in-process CLI.
+
+    It runs in the caller's directory, with the package on its path.
+    """
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    python_path = os.environ.get("PYTHONPATH")
+    os.environ["PYTHONPATH"] = (
+        f"{project_root}{os.pathsep}{python_path}" if python_path else project_root
+    )
+    try:
+        os.chdir(caller_directory())
+    except OSError:
+        pass
+    os.execv(sys.executable, [sys.executable, "-m", "shell_ai", *argv])
+
+
+def run_remote(sock: socket.socket, argv: list[str]) -> int | None:
+    """Forward a CLI invocation to the daemon and relay its terminal I/O.
+
+    Returns None if the daemon declined to run it, because it was started
+    with another environment, e.g. other API settings or proxies.
+    """
+
+    # The daemon does not see our environment, so pass the start time and
+    # working directory along, and the variables it has to share with us
+    send_message(
+        sock,
+        {
+            "type": "run",
+            "argv": argv,
+            "started_at": start_time(),
+            "cwd": caller_directory(),
+            "env": forwarded_environment(),
+        },
+    )
+
+    with sock.makefile("rb") as responses:
+        for line in responses:
+            message = json.loads(line)
+            if message["type"] == "write":
+                stream = sys.stdout if message["stream"] == "stdout" else sys.stderr
+                stream.write(message["data"])
+                stream.flush()
+            elif message["type"] == "input":
+                data = sys.stdin.readline()
+                send_message(sock, {"type": "input", "data": data or None})
+            elif message["type"] == "exit":
+                return message["code"]
+            elif message["type"] == "decline":
+                return None
+
+    # The daemon went away without reporting an exit status
+    print("Error: Connection to shell-ai daemon lost", file=sys.stderr)
+    return 1
+
+
+def main():
+    argv = sys.argv[1:]
+    if any(arg == "--batch" or arg.startswith("--batch=") for arg in argv):
+        # Long jobs gain nothing from the daemon, which could not stream their
+        # stdin
+        run_in_process(argv)
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Also fails if the runtime directory is unsafe
+        sock.connect(socket_path())
+    except OSError:
+        sock.close()
+        run_in_process(argv)
+        return
+
+    with sock:
+        try:
+            code = run_remote(sock, argv)
+        except KeyboardInterrupt:
+            print("\033[33m\nProcess interrupted by user.\033[0m", file=sys.stderr)
+            code = 0
+    if code is None:
+        run_in_process(argv)
+        return
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
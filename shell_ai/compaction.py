@@ -0,0 +1,197 @@
+"""Compaction of the terminal context into a token budget.
+
+The context is split into blocks of a prompt line, with its command, and the
+output of that command.  When the context is over the budget, the last
+commands are kept verbatim, and the output of the older ones is shrunk:
+runs of repeated or similar lines (e.g. progress) are collapsed with a count,
+long lines are cut, and then only the head and tail of each output are kept,
+with markers for what was left out.  The oldest commands are dropped last.
+This keeps the commands that caused the output, which a cut of the last
+characters would often drop.
+"""
+
+import re
+
+from .config import Config
+from .models import CommandBlock
+from .utils import estimate_tokens
+
+# Commands kept verbatim at the end of the context, including the `ai` call
+KEEP_RECENT = 3
+
+# Lines kept of the output of older commands, tried in turn until the context
+# fits, and of the recent commands if they are over the budget on their own
+OLDER_OUTPUT_LIMITS = (None, 40, 16, 6, 2, 0)
+RECENT_OUTPUT_LIMITS = (400, 200, 80, 20)
+
+# Lines longer than that are cut in the output of older commands
+MAX_LINE_LENGTH = 400
+
+# Similar lines in a row over which they are collapsed
+MIN_RUN = 4
+
+# Characters of the log to read per token of the budget, so that the context
+# is bounded without dropping much of what compaction would keep
+READ_CHARS_PER_TOKEN = 32
+
+# Prompt terminator in front of the `ai` call, searched in the last lines
+PROMPT_END = re.compile(r"[$#%>❯] (?=ai\b)")
+PROMPT_SEARCH_LINES = 20
+
+# Runs of digits, masked to tell lines that only differ in numbers
+NUMBER = re.compile(r"\s*\d+")
+
+
+def read_length(config: Config) -> int | None:
+    """Characters of the end of the log to read as the context, if limited."""
+
+    if config.max_context_length is None and config.max_context_tokens:
+        return config.max_context_tokens * READ_CHARS_PER_TOKEN
+    return config.max_context_length
+
+
+def prompt_pattern(lines: list[str]) -> tuple[str, str] | None:
+    """Guess the shell prompt from the last line with the `ai` call.
+
+    Returns the start of the prompt, and its terminator (e.g. "$ ").
+    """
+
+    for line in reversed(lines[-PROMPT_SEARCH_LINES:]):
+        if match := PROMPT_END.search(line):
+            return line[: min(match.end(), 8)], match.group()
+    return None
+
+
+def split_blocks(lines: list[str]) -> list[CommandBlock]:
+    """Split the lines of the context at each prompt line."""
+
+    pattern = prompt_pattern(lines)
+    blocks = [CommandBlock(None, [])]
+    for line in lines:
+        if pattern and line.startswith(pattern[0]) and pattern[1] in line:
+            blocks.append(CommandBlock(line, []))
+        else:
+            blocks[-1].output.append(line)
+    if not blocks[0].output and len(blocks) > 1:
+        blocks.pop(0)
+    return blocks
+
+
+def collapse_repeats(lines: list[str]) -> list[str]:
+    """Collapse runs of lines that only differ in their numbers."""
+
+    shapes = [NUMBER.sub("#", line) for line in lines]
+    collapsed = []
+    start = 0
+    while start < len(lines):
+        end = start + 1
+        while end < len(lines) and shapes[end] == shapes[start]:
+            end += 1
+        run = end - start
+        if run < MIN_RUN:
+            collapsed.extend(lines[start:end])
+        elif lines[start:end].count(lines[start]) == run:
+            collapsed.append(lines[start])
+            collapsed.append(f"[... repeated {run - 1} more times ...]")
+        else:
+            collapsed.append(lines[start])
+            collapsed.append(f"[... {run - 2} similar lines ...]")
+            collapsed.append(lines[end - 1])
+        start = end
+    return collapsed
+
+
+def shorten_line(line: str) -> str:
+    if len(line) <= MAX_LINE_LENGTH:
+        return line
+    half = MAX_LINE_LENGTH // 2
+    return (
+        f"{line[:half]}[... {len(line) - 2 * half} characters omitted ...]"
+        f"{line[-half:]}"
+    )
+
+
+def head_and_tail(lines: list[str], limit: int | None) -> list[str]:
+    if limit is None or len(lines) <= limit:
+        return lines
+    if limit == 0:
+        return [f"[... {len(lines)} lines of output omitted ...]"]
+    head = (limit + 1) // 2
+    tail = limit - head
+    return [
+        *lines[:head],
+        f"[... {len(lines) - limit} lines omitted ...]",
+        *lines[len(lines) - tail :],
+    ]
+
+
+def render(block: CommandBlock, limit: int | None = None) -> str:
+    lines = head_and_tail(block.output, limit)
+    return "\n".join(lines if block.command is None else [block.command, *lines])
+
+
+def keep_end(text: str, budget: int) -> str:
+    """Return the longest end of the text within the budget, roughly."""
+
+    length = budget * 4
+    while length and estimate_tokens(text[-length:]) > budget:
+        length = length * 9 // 10
+    return text[-length:] if length else ""
+
+
+def compact_context(text: str, budget: int, *, truncated: bool = False) -> str:
+    """Fit the context into about `budget` tokens.
+
+    With `truncated`, the text is the end of a longer context, and its first
+    line is partial.
+    """
+
+    if truncated and (newline := text.find("\n")) != -1:
+        text = "[... earlier output omitted ...]" + text[newline:]
+    if estimate_tokens(text) <= budget:
+        return text
+
+    blocks = split_blocks(text.split("\n"))
+    recent = blocks[-KEEP_RECENT:]
+    older = [
+        CommandBlock(
+            block.command,
+            [shorten_line(line) for line in collapse_repeats(block.output)],
+        )
+        for block in blocks[:-KEEP_RECENT]
+    ]
+
+    recent_text = "\n".join(render(block) for block in recent)
+    recent_tokens = estimate_tokens(recent_text)
+    if recent_tokens > budget:
+        # A recent command is noisy on its own: shrink its output too
+        recent = [
+            CommandBlock(block.command, collapse_repeats(block.output))
+            for block in recent
+        ]
+        for limit in RECENT_OUTPUT_LIMITS:
+            recent_text = "\n".join(render(block, limit) for block in recent)
+            recent_tokens = estimate_tokens(recent_text)
+            if recent_tokens <= budget:
+                break
+        else:
+            return keep_end(recent_text, budget)
+
+    for limit in OLDER_OUTPUT_LIMITS:
+        rendered = [render(block, limit) for block in older]
+        tokens = [estimate_tokens(text) for text in rendered]
+        if sum(tokens) + recent_tokens <= budget:
+            break
+
+    # Drop the oldest commands that still do not fit
+    total = sum(tokens) + recent_tokens
+    omitted = 0
+    while omitted < len(rendered) and total > budget:
+        total -= tokens[omitted]
+        omitted += 1
+
+    parts = rendered[omitted:]
+    if omitted:
+        parts.insert(0, f"[... {omitted} earlier commands omitted ...]")
+    parts.append(recent_text)
+    return "\n".join(parts)
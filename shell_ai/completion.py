@@ -1,15 +1,51 @@
 import asyncio
+import importlib.util
 import os
-from collections.abc import Callable
+import time
+from collections.abc import AsyncIterator, Callable
+from typing import TYPE_CHECKING
 
-import httpx
-import openai
+from .config import Endpoint, load_config
+from .models import Event, Message, Ref, Workflow
+from .prompts import RESUME_PROMPT
+from .routing import select_route
+from .timings import Timings
+from .utils import estimate_tokens
 
-from .config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL
-from .models import Event, Message, Ref
+# The SDK is slow to import, so it is only imported once a request is made
+if TYPE_CHECKING:
+    import httpx
+    import openai
 
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+# Keep idle connections around between requests, e.g. in the daemon or batches
+KEEPALIVE_EXPIRY = 120.0
+
+# Seconds that the warm-up request waits for a reply once connected, since the
+# actual request waits for it
+WARM_UP_TIMEOUT = 2.0
+
+# Times a stalled or broken response is requested again
+MAX_RESUMES = 2
+
+# Characters of a resumed response searched for a repeat of the text received
+OVERLAP_WINDOW = 256
+MIN_OVERLAP = 8
+
+
+class IncompleteResponse(Exception):
+    """The response stopped early and could not be resumed.
+
+    `reply` holds the part of the response received.
+    """
+
+    reply: Message | None = None
+
+
+def _create_http_client() -> "httpx.AsyncClient":
+    import httpx
 
-def _create_http_client():
     proxy = (
         os.environ.get("all_proxy")
         or os.environ.get("http_proxy")
@@ -17,70 +53,546 @@ def _create_http_client():
         or os.environ.get("https_proxy")
         or os.environ.get("HTTPS_PROXY")
     )
-    return (
-        httpx.AsyncClient(proxy=proxy.replace("socks://", "socks5://"))
-        if proxy
-        else None
+    # Same defaults as the SDK's own client, plus HTTP/2 if available
+    return httpx.AsyncClient(
+        proxy=proxy.replace("socks://", "socks5://") if proxy else None,
+        http2=importlib.util.find_spec("h2") is not None,
+        timeout=httpx.Timeout(600.0, connect=load_config().connect_timeout),
+        limits=httpx.Limits(
+            max_connections=1000,
+            max_keepalive_connections=100,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        follow_redirects=True,
     )
 
 
-async def request_completion(
+_http_client: "httpx.AsyncClient | None" = None
+# By endpoint settings, so a reloaded config with another key or URL gets new ones
+_clients: "dict[Endpoint, openai.AsyncOpenAI]" = {}
+_last_used: float | None = None
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """Return the process-wide pooled HTTP client, creating it on first use."""
+
+    global _http_client
+    if _http_client is None:
+        _http_client = _create_http_client()
+    return _http_client
+
+
+def get_client(endpoint: Endpoint | None = None) -> "openai.AsyncOpenAI":
+    """Return the process-wide API client of an endpoint, creating it on first use.
+
+    The client (and its connection pool) is shared by every completion made in
+    this process, so a long-lived process such as the daemon keeps its
+    connections warm between requests.  Without `endpoint`, the default
+    endpoint is used.
+    """
+
+    endpoint = endpoint or load_config().endpoints[0]
+    if endpoint not in _clients:
+        import openai
+
+        _clients[endpoint] = openai.AsyncOpenAI(
+            base_url=endpoint.base_url,
+            api_key=endpoint.api_key,
+            http_client=get_http_client(),
+        )
+    return _clients[endpoint]
+
+
+def primary_endpoint() -> Endpoint:
+    """Return the endpoint that requests are sent to first."""
+
+    endpoints = load_config().endpoints
+    if len(endpoints) == 1:
+        return endpoints[0]
+
+    from . import endpoints as endpoint_stats
+
+    return endpoint_stats.rank(endpoints, endpoint_stats.load_stats())[0]
+
+
+async def warm_up_connection():
+    """Open a pooled connection to the API host ahead of the first request.
+
+    DNS, TCP, TLS and proxy handshakes happen on a cheap `HEAD` request, while
+    the SDK is imported in a worker thread.  Any error is left for the actual
+    request to report.  A host that is slow to answer `HEAD` delays the request
+    by at most WARM_UP_TIMEOUT after connecting.
+    """
+
+    global _last_used
+    if _last_used is not None and time.monotonic() - _last_used < KEEPALIVE_EXPIRY:
+        # The pool already holds a live connection
+        return
+
+    import httpx
+
+    endpoint = primary_endpoint()
+    await asyncio.gather(
+        get_http_client().head(
+            endpoint.base_url or DEFAULT_BASE_URL,
+            timeout=httpx.Timeout(
+                WARM_UP_TIMEOUT, connect=load_config().connect_timeout
+            ),
+        ),
+        asyncio.to_thread(get_client, endpoint),
+        return_exceptions=True,
+    )
+    _last_used = time.monotonic()
+
+
+async def close_client():
+    """Close the process-wide API client if it has been created."""
+
+    global _http_client, _last_used
+    # The clients only share the HTTP client's connections
+    if _http_client is not None:
+        await _http_client.aclose()
+    _clients.clear()
+    _http_client = _last_used = None
+
+
+async def _content(response, usage: Ref) -> AsyncIterator[str]:
+    """Yield the content of a completion stream, keeping its usage."""
+
+    try:
+        async for chunk in response:
+            if chunk.usage is not None:
+                usage.value = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Release the connection of an abandoned stream
+        await response.close()
+
+
+async def _replay(content: str) -> AsyncIterator[str]:
+    yield content
+
+
+async def _resume(first: str | None, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    if first is None:
+        return
+    yield first
+    async for token in stream:
+        yield token
+
+
+async def _open_stream(
+    endpoint: Endpoint,
+    model: str,
     messages: list,
-    *,
-    model: str | None = None,
-    event_queue: list[Event] | None = None,
-    buffer_handler: Callable[[Ref[str], Ref[str], list[Event]], None] | None = None,
-    start_handler: Callable[[Ref[str], Ref[str], list[Event]], None] | None = None,
-    stop_handler: Callable[[Ref[str], Ref[str], list[Event]], None] | None = None,
-) -> Message:
-    http_client = _create_http_client()
+    usage: Ref,
+    tokens: int,
+    deadline: float | None,
+    fail_over: bool,
+) -> tuple[str | None, AsyncIterator[str], float]:
+    """Start a completion stream on the endpoint, and wait for its first token.
+
+    The endpoint's rate limits are waited for first, and that time does not
+    count in the first token timeout nor against `deadline`.  Also returns
+    the seconds spent waiting.  With `fail_over`, an error is not retried,
+    since another endpoint is tried instead.
+    """
+
+    from . import ratelimit
 
-    client = openai.AsyncOpenAI(
-        base_url=OPENAI_BASE_URL,
-        api_key=OPENAI_API_KEY,
-        http_client=http_client,
+    queued = await ratelimit.acquire(endpoint, tokens)
+    if deadline is not None:
+        deadline += queued
+    token_deadline = _deadline(load_config().first_token_timeout)
+    stream = await asyncio.wait_for(
+        _start_stream(model, messages, usage, endpoint, fail_over),
+        _time_left(token_deadline, deadline),
     )
+    try:
+        first = await asyncio.wait_for(
+            anext(stream, None), _time_left(token_deadline, deadline)
+        )
+    except BaseException:
+        await stream.aclose()
+        raise
+    return first, stream, queued
+
+
+async def _hedged_stream(
+    model: str | None,
+    messages: list,
+    tokens: int,
+    queued: Ref,
+    deadline: float | None,
+) -> tuple[AsyncIterator[str], str, Ref, Endpoint]:
+    """Stream a completion from whichever endpoint produces a token first.
 
+    The request is sent to the endpoints in the order of their statistics.
+    When no token has arrived within the hedge delay, it is also sent to the
+    next endpoint, and when a request fails, to the next one right away.  The
+    slower requests are cancelled.  Each request waits for the first token
+    within the first token timeout and `deadline`, not counting its time in
+    the rate limit queue (see `_open_stream`).  Returns the stream, the model
+    used, the reference to its usage and the endpoint, and adds the time the
+    winning request spent in the queue to `queued`.
+    """
+
+    from . import endpoints as endpoint_stats
+
+    config = load_config()
+    stats = endpoint_stats.load_stats()
+    remaining = endpoint_stats.rank(config.endpoints, stats)
+    attempts: dict[asyncio.Task, tuple[Endpoint, Ref, float]] = {}
+    samples: dict[str, float | None] = {}
+    error: Exception | None = None
+    delay: float | None = None
+
+    def attempt():
+        nonlocal delay
+        endpoint = remaining.pop(0)
+        attempt_usage: Ref = Ref(None)
+        task = asyncio.create_task(
+            _open_stream(
+                endpoint,
+                model or endpoint.model,
+                messages,
+                attempt_usage,
+                tokens,
+                deadline,
+                fail_over=bool(remaining),
+            )
+        )
+        attempts[task] = (endpoint, attempt_usage, time.monotonic())
+        delay = config.hedge_delay or endpoint_stats.hedge_delay(endpoint, stats)
+
+    attempt()
+    try:
+        while attempts:
+            done, _ = await asyncio.wait(
+                attempts,
+                timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                # The first token is late, hedge on the next endpoint
+                attempt()
+                continue
+            for task in done:
+                endpoint, attempt_usage, started = attempts.pop(task)
+                try:
+                    first, stream, waited = task.result()
+                except Exception as e:
+                    samples[endpoint.name] = None
+                    error = error or e
+                    if remaining:
+                        # Fail over right away
+                        attempt()
+                    continue
+                samples[endpoint.name] = time.monotonic() - started - waited
+                queued.value += waited
+                return (
+                    _resume(first, stream),
+                    model or endpoint.model,
+                    attempt_usage,
+                    endpoint,
+                )
+        raise error
+    finally:
+        now = time.monotonic()
+        for task, (endpoint, _, started) in attempts.items():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                await task.result()[1].aclose()
+            task.cancel()
+            # Still waiting for its first token, so at least that slow
+            samples.setdefault(endpoint.name, now - started)
+        endpoint_stats.update_stats(samples)
+
+
+async def _start_stream(
+    model: str, messages: list, usage: Ref, endpoint: Endpoint, fail_over: bool = False
+) -> AsyncIterator[str]:
+    """Start a completion stream on the endpoint, setting `usage` at its end.
+
+    The SDK retries failed requests, unless another endpoint can be tried
+    instead with `fail_over`.
+    """
+
+    client = get_client(endpoint)
+    if fail_over:
+        client = client.with_options(max_retries=0)
     response = await client.chat.completions.create(
-        model=model or OPENAI_MODEL,
+        model=model,
         messages=messages,
         stream=True,
+        # Usage comes in a final chunk without choices
+        stream_options={"include_usage": True},
     )
+    return _content(response, usage)
 
-    stream = (
-        chunk.choices[0].delta.content
-        async for chunk in response
-        if chunk.choices and chunk.choices[0].delta.content is not None
-    )
+
+def _drop_overlap(received: str, continuation: str) -> str:
+    """Drop the start of a continuation that repeats the end of the text received."""
+
+    for size in range(min(len(received), len(continuation)), MIN_OVERLAP - 1, -1):
+        if received.endswith(continuation[:size]):
+            return continuation[size:]
+    return continuation
+
+
+def _deadline(timeout: float | None) -> float | None:
+    return time.monotonic() + timeout if timeout else None
+
+
+def _time_left(*deadlines: float | None) -> float | None:
+    """Seconds until the earliest of the deadlines, or None if there are none."""
+
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
+    if not deadlines:
+        return None
+    return max(min(deadlines) - time.monotonic(), 0.0)
+
+
+async def _watched_stream(
+    model: str,
+    requested_model: str | None,
+    messages: list,
+    usage: Ref,
+    served_model: Ref,
+    queued: Ref,
+    endpoint: Endpoint | None = None,
+) -> AsyncIterator[str]:
+    """Stream a completion, requesting it again when it stalls or breaks.
+
+    The waits for the first token, for each next token and for the whole
+    response are bounded by the timeouts of the config.  On a timeout or a
+    connection error, the request is made again up to MAX_RESUMES times,
+    within the overall deadline.  After partial output, the new request asks
+    to continue the text received so far, and any repeat of it at the start
+    of the continuation is dropped, so tags are not handled twice.  Requests
+    wait their turn for the rate limits of their endpoint (see `ratelimit`).
+    """
+
+    import httpx
+    import openai
+
+    from . import ratelimit
+
+    config = load_config()
+    deadline = _deadline(config.request_timeout)
+    received: list[str] = []
+    request_messages = messages
+    if endpoint is None and len(config.endpoints) == 1:
+        endpoint = config.endpoints[0]
+
+    for _ in range(MAX_RESUMES + 1):
+        stream = None
+        # The start of a continuation, until it can be checked for a repeat
+        head = "" if received else None
+        tokens = sum(estimate_tokens(m["content"]) for m in request_messages)
+        try:
+            # The time spent in the queue does not count in the timeouts
+            if endpoint is None:
+                previously_queued = queued.value
+                stream, served_model.value, attempt_usage, served_endpoint = (
+                    await _hedged_stream(
+                        requested_model, request_messages, tokens, queued, deadline
+                    )
+                )
+                if deadline is not None:
+                    deadline += queued.value - previously_queued
+                # The first token is in already
+                token_deadline = _deadline(config.token_timeout)
+            else:
+                waited = await ratelimit.acquire(endpoint, tokens)
+                queued.value += waited
+                if deadline is not None:
+                    deadline += waited
+                served_model.value, served_endpoint = model, endpoint
+                attempt_usage = Ref(None)
+                token_deadline = _deadline(config.first_token_timeout)
+                stream = await asyncio.wait_for(
+                    _start_stream(model, request_messages, attempt_usage, endpoint),
+                    _time_left(token_deadline, deadline),
+                )
+            while True:
+                try:
+                    token = await asyncio.wait_for(
+                        anext(stream), _time_left(token_deadline, deadline)
+                    )
+                except StopAsyncIteration:
+                    break
+                token_deadline = _deadline(config.token_timeout)
+
+                if head is not None:
+                    head += token
+                    if len(head) < OVERLAP_WINDOW:
+                        continue
+                    token = _drop_overlap("".join(received), head)
+                    head = None
+                received.append(token)
+                yield token
+
+            if head:
+                yield _drop_overlap("".join(received), head)
+            usage.value = attempt_usage.value
+            if usage.value is not None:
+                ratelimit.settle(served_endpoint, tokens, usage.value.total_tokens)
+            return
+        except (TimeoutError, openai.APIConnectionError, httpx.TransportError) as e:
+            if stream is not None:
+                await stream.aclose()
+            error = e
+            if deadline is not None and time.monotonic() >= deadline:
+                error = TimeoutError(
+                    f"No complete response within {config.request_timeout:g} seconds"
+                )
+                break
+            if isinstance(e, TimeoutError):
+                error = TimeoutError("The response stalled")
+
+        if received:
+            # Ask for the rest of the response
+            request_messages = [
+                *messages,
+                {"role": "assistant", "content": "".join(received)},
+                {"role": "user", "content": RESUME_PROMPT},
+            ]
+
+    if received:
+        raise IncompleteResponse(str(error)) from error
+    raise error
+
+
+async def request_completion(
+    messages: list,
+    *,
+    model: str | None = None,
+    event_queue: list[Event] | None = None,
+    buffer_handler: Callable[[str, list[Event]], None] | None = None,
+    start_handler: Callable[[list[Event]], None] | None = None,
+    stop_handler: Callable[[list[Event]], None] | None = None,
+    use_cache: bool = False,
+    timings: Timings | None = None,
+    workflow: Workflow = Workflow.RAW,
+    hint: str | None = None,
+) -> Message:
+    """Stream a completion through the handlers.
+
+    With `use_cache`, and the cache enabled in the config, a cached completion
+    for the same model and messages is replayed through the handlers instead
+    of making a request.  Without `model`, it is chosen by the routes of the
+    config, from the `workflow`, caller `hint` and size of the prompt (see
+    `routing`).  With several endpoints configured, the request is
+    hedged across them (see `_hedged_stream`).  A response that stalls is
+    resumed (see `_watched_stream`); if it cannot be completed, the handlers
+    still get the end of the stream, and `IncompleteResponse` is raised with
+    the partial reply.  The time spent waiting for rate limits, time to first
+    token, streaming time and token counts are recorded in `timings`, for the
+    caller to report and record in the usage log; without `timings`, the
+    request is recorded in the usage log on its own.
+    """
+
+    global _last_used
+    own_timings = timings is None
+    if own_timings:
+        timings = Timings()
+    config = load_config()
+    endpoint = None
+    if model is None and (route := select_route(messages, workflow, hint)):
+        model = route.model or None
+        if route.endpoint is not None:
+            endpoint = next(e for e in config.endpoints if e.name == route.endpoint)
+    requested_model = model
+    model = model or (endpoint.model if endpoint else config.openai_model)
+    use_cache = use_cache and config.cache
+
+    cached = None
+    if use_cache:
+        from . import cache
+
+        cached = await asyncio.to_thread(cache.lookup, model, messages)
+
+    usage: Ref = Ref(None)
+    served_model: Ref = Ref(model)
+    queued: Ref = Ref(0.0)
+    started = time.monotonic()
+
+    if cached is not None:
+        stream = _replay(cached)
+    else:
+        stream = _watched_stream(
+            model,
+            requested_model,
+            messages,
+            usage=usage,
+            served_model=served_model,
+            queued=queued,
+            endpoint=endpoint,
+        )
 
     # Handle stream
+    if event_queue is None:
+        event_queue = []
     first_token_received = False
-    buffer = Ref("")
-    buffer_lock = asyncio.Lock()
-    acc = Ref("")
+    time_to_first_token = None
+    chunks: list[str] = []
 
     if start_handler:
-        start_handler(buffer, acc, event_queue if event_queue is not None else [])
+        start_handler(event_queue)
 
-    async for token in stream:
-        async with buffer_lock:
+    incomplete = None
+    try:
+        async for token in stream:
             if not first_token_received:
                 first_token_received = True
-            buffer.value += token
+                time_to_first_token = time.monotonic() - started - queued.value
+            chunks.append(token)
 
             if buffer_handler:
-                buffer_handler(
-                    buffer, acc, event_queue if event_queue is not None else []
-                )
-            else:
-                acc.value += buffer.value
-                buffer.value = ""
+                buffer_handler(token, event_queue)
+    except IncompleteResponse as e:
+        incomplete = e
 
     if stop_handler:
-        stop_handler(buffer, acc, event_queue if event_queue is not None else [])
+        stop_handler(event_queue)
+
+    timings.model = served_model.value
+    if queued.value:
+        timings.add("queue", queued.value)
+    if time_to_first_token is not None:
+        timings.add("first token", time_to_first_token)
+        timings.add(
+            "streaming",
+            time.monotonic() - started - queued.value - time_to_first_token,
+        )
+        # Summed over the completions of an invocation, e.g. after tool calls
+        if usage.value is not None:
+            timings.prompt_tokens = (
+                timings.prompt_tokens or 0
+            ) + usage.value.prompt_tokens
+            details = getattr(usage.value, "prompt_tokens_details", None)
+            timings.cached_tokens = (timings.cached_tokens or 0) + (
+                getattr(details, "cached_tokens", None) or 0
+            )
+            completion_tokens = usage.value.completion_tokens
+        else:
+            completion_tokens = len(chunks)
+        timings.completion_tokens = (timings.completion_tokens or 0) + completion_tokens
+
+    content = "".join(chunks)
+    if cached is None:
+        _last_used = time.monotonic()
+        if own_timings:
+            from .usage import record_usage
 
-    # Clean up http client
-    if http_client:
-        await http_client.aclose()
+            timings.prompt_size = sum(len(message["content"]) for message in messages)
+            record_usage(timings, served_model.value)
+        if use_cache and content and incomplete is None:
+            await asyncio.to_thread(cache.store, model, messages, content)
 
-    return {"role": "assistant", "content": acc.value}
+    reply = {"role": "assistant", "content": content}
+    if incomplete is not None:
+        incomplete.reply = reply
+        raise incomplete
+    return reply
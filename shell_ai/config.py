@@ -1,30 +1,277 @@
 import os
 import configparser
-
+from dataclasses import dataclass
+from functools import cache
 
 CONFIG_FILE = os.path.expanduser("~/.config/shell-ai/shell-ai.conf")
-config = configparser.ConfigParser()
 
-if os.path.exists(CONFIG_FILE):
-    config.read(CONFIG_FILE)
+STATE_DIR = os.path.join(
+    os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+    "shell-ai",
+)
+DEFAULT_MAX_CONTEXT_TOKENS = 16000
+DEFAULT_CACHE_MAX_SIZE = 64 * 1024 * 1024
+DEFAULT_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_FIRST_TOKEN_TIMEOUT = 60.0
+DEFAULT_TOKEN_TIMEOUT = 30.0
+DEFAULT_REQUEST_TIMEOUT = 600.0
+ENDPOINT_SECTION_PREFIX = "endpoint:"
+ROUTE_SECTION_PREFIX = "route:"
+WORKFLOWS = ("proceed", "empty", "message", "raw")
+TOOLS = ("read_file", "list_dir", "grep", "stat", "tail_log")
 
-OPENAI_BASE_URL = (
-    config.get("DEFAULT", "base-url", fallback=None) or os.getenv("OPENAI_BASE_URL")
-) or None
 
-OPENAI_API_KEY = config.get("DEFAULT", "api-key", fallback=None) or os.getenv(
-    "OPENAI_API_KEY", ""
-)
+@dataclass(frozen=True)
+class Endpoint:
+    name: str
+    base_url: str | None
+    api_key: str
+    model: str
+    # Rate limits shared by all the processes of the user, None for no limit
+    requests_per_minute: int | None = None
+    tokens_per_minute: int | None = None
+
+
+@dataclass(frozen=True)
+class Route:
+    """Rule that sends the matching requests to a model, and endpoint."""
+
+    name: str
+    model: str
+    endpoint: str | None
+    # Conditions, all of which must hold
+    workflows: frozenset[str]  # Any if empty
+    hints: frozenset[str]  # Any if empty
+    min_prompt_size: int | None  # Characters
+    max_prompt_size: int | None
+    context_window: int | None  # Tokens
+
+
+@dataclass(frozen=True)
+class Config:
+    openai_base_url: str | None
+    openai_api_key: str
+    openai_model: str
+    max_context_length: int | None
+    max_context_commands: int | None
+    max_context_tokens: int | None  # Budget of the compacted context
+    cache: bool
+    cache_max_size: int
+    cache_ttl: int | None
+    usage_file: str | None
+    # The endpoint of the DEFAULT section, then those of [endpoint:*] sections
+    endpoints: tuple[Endpoint, ...]
+    hedge_delay: float | None
+    # Seconds, or None for no limit
+    connect_timeout: float | None
+    first_token_timeout: float | None
+    token_timeout: float | None
+    request_timeout: float | None
+    # [route:*] sections, in order
+    routes: tuple[Route, ...]
+    # Read-only tools the model can call in-process, and the directories
+    # they can read, relative to the working directory
+    tools: tuple[str, ...]
+    tool_paths: tuple[str, ...]
+
+
+def _get_int(
+    config: configparser.ConfigParser,
+    option: str,
+    default: int | None = None,
+    *,
+    section: str = "DEFAULT",
+) -> int | None:
+    try:
+        return config.getint(section, option, fallback=default)
+    except ValueError:
+        raise ValueError(
+            f"{CONFIG_FILE}: Invalid type for {option}: must be an integer"
+        )
 
-OPENAI_MODEL = config.get("DEFAULT", "model", fallback=None) or os.getenv(
-    "OPENAI_MODEL", ""
-)
 
-MAX_CONTEXT_LENGTH = None
-if config.has_option("DEFAULT", "max-context-length"):
+def _get_float(
+    config: configparser.ConfigParser, option: str, default: float | None = None
+) -> float | None:
     try:
-        MAX_CONTEXT_LENGTH = config.getint("DEFAULT", "max-context-length")
+        return config.getfloat("DEFAULT", option, fallback=default)
     except ValueError:
+        raise ValueError(f"{CONFIG_FILE}: Invalid type for {option}: must be a number")
+
+
+def _get_list(
+    config: configparser.ConfigParser, section: str, option: str
+) -> frozenset[str]:
+    value = config.get(section, option, fallback="")
+    return frozenset(item.strip() for item in value.split(",") if item.strip())
+
+
+def _read_route(
+    config: configparser.ConfigParser, section: str, endpoints: list[Endpoint]
+) -> Route:
+    # Sections inherit the model of the DEFAULT section
+    model = config.get(section, "model", fallback=None) or os.getenv("OPENAI_MODEL", "")
+    endpoint = config.get(section, "endpoint", fallback=None) or None
+    if endpoint is not None and endpoint not in (e.name for e in endpoints):
+        raise ValueError(f"{CONFIG_FILE}: [{section}]: Unknown endpoint {endpoint}")
+    workflows = _get_list(config, section, "workflow")
+    if unknown := workflows - set(WORKFLOWS):
         raise ValueError(
-            f"{CONFIG_FILE}: Invalid type for max-context-length: must be an integer"
+            f"{CONFIG_FILE}: [{section}]: Unknown workflow {', '.join(sorted(unknown))}:"
+            f" must be one of {', '.join(WORKFLOWS)}"
         )
+
+    return Route(
+        name=section.removeprefix(ROUTE_SECTION_PREFIX),
+        model=model,
+        endpoint=endpoint,
+        workflows=workflows,
+        hints=_get_list(config, section, "hint"),
+        min_prompt_size=_get_int(config, "min-prompt-size", section=section),
+        max_prompt_size=_get_int(config, "max-prompt-size", section=section),
+        context_window=_get_int(config, "context-window", section=section),
+    )
+
+
+@cache
+def read_config_file() -> configparser.ConfigParser:
+    """Parse the config file on first use, instead of at import time."""
+
+    config = configparser.ConfigParser()
+    if os.path.exists(CONFIG_FILE):
+        config.read(CONFIG_FILE)
+    return config
+
+
+def config_file_stamp() -> tuple[int, int] | None:
+    """Return the modification time and size of the config file, which change
+    when it is edited, or None if there is none."""
+
+    try:
+        info = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
+        return None
+    return info.st_mtime_ns, info.st_size
+
+
+def reload_config():
+    """Read the config file again on next use, e.g. after it was edited."""
+
+    read_config_file.cache_clear()
+    load_config.cache_clear()
+
+
+@cache
+def load_config() -> Config:
+    config = read_config_file()
+
+    openai_base_url = (
+        config.get("DEFAULT", "base-url", fallback=None) or os.getenv("OPENAI_BASE_URL")
+    ) or None
+
+    openai_api_key = config.get("DEFAULT", "api-key", fallback=None) or os.getenv(
+        "OPENAI_API_KEY", ""
+    )
+
+    openai_model = config.get("DEFAULT", "model", fallback=None) or os.getenv(
+        "OPENAI_MODEL", ""
+    )
+
+    max_context_length = _get_int(config, "max-context-length")
+    max_context_commands = _get_int(config, "max-context-commands")
+    # Zero disables compaction
+    max_context_tokens = _get_int(
+        config, "max-context-tokens", DEFAULT_MAX_CONTEXT_TOKENS
+    )
+
+    try:
+        cache_enabled = config.getboolean("DEFAULT", "cache", fallback=False)
+    except ValueError:
+        raise ValueError(f"{CONFIG_FILE}: Invalid type for cache: must be a boolean")
+    cache_max_size = _get_int(config, "cache-max-size") or DEFAULT_CACHE_MAX_SIZE
+    cache_ttl = _get_int(config, "cache-ttl", DEFAULT_CACHE_TTL) or None
+
+    # Opt-in, since the file grows with every completion
+    usage_file = config.get("DEFAULT", "usage-file", fallback=None)
+    usage_file = os.path.expanduser(usage_file) if usage_file else None
+
+    # Sections inherit the keys they do not set from the DEFAULT section
+    endpoints = [
+        Endpoint(
+            "default",
+            openai_base_url,
+            openai_api_key,
+            openai_model,
+            requests_per_minute=_get_int(config, "requests-per-minute"),
+            tokens_per_minute=_get_int(config, "tokens-per-minute"),
+        )
+    ]
+    for section in config.sections():
+        if section.startswith(ENDPOINT_SECTION_PREFIX):
+            endpoints.append(
+                Endpoint(
+                    name=section.removeprefix(ENDPOINT_SECTION_PREFIX),
+                    base_url=config.get(section, "base-url", fallback=None)
+                    or openai_base_url,
+                    api_key=config.get(section, "api-key", fallback=None)
+                    or openai_api_key,
+                    model=config.get(section, "model", fallback=None) or openai_model,
+                    requests_per_minute=_get_int(
+                        config, "requests-per-minute", section=section
+                    ),
+                    tokens_per_minute=_get_int(
+                        config, "tokens-per-minute", section=section
+                    ),
+                )
+            )
+
+    hedge_delay = _get_float(config, "hedge-delay")
+
+    routes = [
+        _read_route(config, section, endpoints)
+        for section in config.sections()
+        if section.startswith(ROUTE_SECTION_PREFIX)
+    ]
+
+    # Zero disables a timeout
+    connect_timeout = _get_float(config, "connect-timeout", DEFAULT_CONNECT_TIMEOUT)
+    first_token_timeout = _get_float(
+        config, "first-token-timeout", DEFAULT_FIRST_TOKEN_TIMEOUT
+    )
+    token_timeout = _get_float(config, "token-timeout", DEFAULT_TOKEN_TIMEOUT)
+    request_timeout = _get_float(config, "request-timeout", DEFAULT_REQUEST_TIMEOUT)
+
+    # None by default, since tool calls are not approved, and all with `all`
+    names = _get_list(config, "DEFAULT", "tools")
+    if "all" in names:
+        names = frozenset(TOOLS)
+    if unknown := names.difference(TOOLS):
+        raise ValueError(f"{CONFIG_FILE}: Unknown tool {min(unknown)}")
+    tools = tuple(name for name in TOOLS if name in names)
+    tool_paths = tuple(
+        os.path.expanduser(path)
+        for path in _get_list(config, "DEFAULT", "tool-paths") or (".",)
+    )
+
+    return Config(
+        openai_base_url=openai_base_url,
+        openai_api_key=openai_api_key,
+        openai_model=openai_model,
+        max_context_length=max_context_length,
+        max_context_commands=max_context_commands,
+        max_context_tokens=max_context_tokens or None,
+        cache=cache_enabled,
+        cache_max_size=cache_max_size,
+        cache_ttl=cache_ttl,
+        usage_file=usage_file,
+        endpoints=tuple(endpoints),
+        hedge_delay=hedge_delay,
+        connect_timeout=connect_timeout or None,
+        first_token_timeout=first_token_timeout or None,
+        token_timeout=token_timeout or None,
+        request_timeout=request_timeout or None,
+        routes=tuple(routes),
+        tools=tools,
+        tool_paths=tool_paths,
+    )
@@ -0,0 +1,196 @@
+import codecs
+import os
+import zlib
+
+from .models import LogPosition
+from .recorder import CommandIndex, MarkKind, RingLog, index_path, is_ring_log
+from .terminal import replay
+
+# Bytes read from the end of the log at first, doubled until the budget is met
+READ_BLOCK_SIZE = 64 * 1024
+
+# Most bytes read for a budget, for logs of endlessly redrawn output
+MAX_READ_SIZE = 64 * 1024 * 1024
+
+# How far into a block to look for a line break to cut at
+MAX_CUT_SEARCH = 4096
+
+# Bytes before a log position that are checked to be unchanged
+FINGERPRINT_SIZE = 256
+
+
+def cut_start(data: bytes) -> bytes:
+    """Cut log bytes read from an arbitrary offset at the first line break.
+
+    If there is none nearby, they are at least cut at a character boundary, to
+    avoid starting in the middle of a multi-byte character or an escape
+    sequence.
+    """
+
+    newline = data.find(b"\n", 0, MAX_CUT_SEARCH)
+    if newline != -1:
+        return data[newline + 1 :]
+    # Skip UTF-8 continuation bytes
+    start = 0
+    while start < len(data) and start < 4 and 0x80 <= data[start] < 0xC0:
+        start += 1
+    return data[start:]
+
+
+def _decode(data: bytes, *, cut: bool) -> str:
+    """Decode log bytes, dropping partial characters at both ends.
+
+    With `cut`, the data starts at an arbitrary offset (see `cut_start`).
+    """
+
+    if cut:
+        data = cut_start(data)
+
+    # The end of a log that is being written to may hold an incomplete
+    # character, which is left for the next read
+    return codecs.getincrementaldecoder("utf-8")(errors="replace").decode(data)
+
+
+def read_context(
+    path: str,
+    max_length: int | None = None,
+    *,
+    max_commands: int | None = None,
+    since: int = 0,
+) -> str:
+    """Return the last `max_length` characters of the log's visible text.
+
+    Only the end of the log is read, growing the read window until the budget
+    is met, so the cost does not depend on the size of the log.  The size is
+    taken once when the log is opened, so concurrent appends are ignored.
+
+    For ring buffer logs written by the recorder, the context is cut at the
+    start of a command where possible, and goes back at most `max_commands`
+    commands before the current one.
+
+    With `since`, only what was written after that position of the log (see
+    `log_position`) is read.
+    """
+
+    if is_ring_log(path):
+        return _read_ring_log_context(path, max_length, max_commands, since)
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        since = min(since, size)
+
+        if not max_length:
+            f.seek(since)
+            return replay(_decode(f.read(size - since), cut=False))
+
+        start = size
+        data = b""
+        window = max(READ_BLOCK_SIZE, max_length)
+        while True:
+            new_start = max(since, size - window)
+            f.seek(new_start)
+            block = f.read(start - new_start)
+            if len(block) < start - new_start:
+                # The log was truncated while reading, e.g. by `log clear`
+                return read_context(
+                    path, max_length, max_commands=max_commands, since=since
+                )
+            data = block + data
+            start = new_start
+
+            text = replay(_decode(data, cut=start > since))
+            if len(text) >= max_length or start == since or window >= MAX_READ_SIZE:
+                return text[-max_length:]
+            window *= 2
+
+
+def _read_ring_log_context(
+    path: str, max_length: int | None, max_commands: int | None, since: int
+) -> str:
+    with RingLog.open(path) as log:
+        end = log.head
+        first = max(log.start, min(since, end))
+
+        # Offsets of prompts, which make clean starting points
+        prompts = []
+        if os.path.exists(index_path(path)):
+            with CommandIndex.open(index_path(path)) as index:
+                prompts = [
+                    mark.offset
+                    for mark in index.marks()
+                    if mark.kind == MarkKind.PROMPT and first <= mark.offset <= end
+                ]
+        if max_commands and len(prompts) > max_commands:
+            # The last prompt is that of the current command
+            first = prompts[-max_commands - 1]
+        clean_starts = {0, log.cleared, *prompts}
+        if since and first == since:
+            # Where the previous read ended
+            clean_starts.add(since)
+
+        window = max(READ_BLOCK_SIZE, max_length or 0)
+        while True:
+            start = max(first, end - window) if max_length else first
+            if start > first:
+                # Start at the oldest prompt in the window, if there is one
+                start = next((offset for offset in prompts if offset >= start), start)
+            try:
+                data = log.read(start, end)
+            except ValueError:
+                # Overwritten by the recorder while reading
+                return _read_ring_log_context(path, max_length, max_commands, since)
+
+            text = replay(_decode(data, cut=start not in clean_starts))
+            if (
+                not max_length
+                or len(text) >= max_length
+                or start <= first
+                or window >= MAX_READ_SIZE
+            ):
+                return text[-max_length:] if max_length else text
+            window *= 2
+
+
+def _fingerprint(path: str, offset: int) -> int:
+    """Checksum of the bytes before an offset, to tell if they were rewritten."""
+
+    with open(path, "rb") as f:
+        start = max(0, offset - FINGERPRINT_SIZE)
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start))
+
+
+def log_position(path: str, offset: int | None = None) -> LogPosition:
+    """Return the current end of the log, to read what is written after it.
+
+    With `offset`, return that position of a plain log instead.
+    """
+
+    stat = os.stat(path)
+    log_id = f"{stat.st_dev}:{stat.st_ino}"
+    if is_ring_log(path):
+        with RingLog.open(path) as log:
+            return LogPosition(log_id, log.head)
+    if offset is None:
+        offset = stat.st_size
+    return LogPosition(log_id, offset, _fingerprint(path, offset))
+
+
+def is_position_readable(path: str, position: LogPosition) -> bool:
+    """Whether the log can still be read from the position.
+
+    This is not the case once the log was replaced, cleared or truncated (even
+    if it has grown back since), or when a ring buffer log has overwritten the
+    position.
+    """
+
+    try:
+        current = log_position(path)
+        if current.log_id != position.log_id or current.offset < position.offset:
+            return False
+        if is_ring_log(path):
+            with RingLog.open(path) as log:
+                return log.start <= position.offset
+        return _fingerprint(path, position.offset) == position.fingerprint
+    except (OSError, ValueError):
+        return False
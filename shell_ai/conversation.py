@@ -0,0 +1,37 @@
+import json
+import os
+from dataclasses import asdict
+
+from .models import Conversation, LogPosition
+
+# Rounds after which a proceed round starts over with the full context, to
+# bound the size of the history
+MAX_ROUNDS = 10
+
+
+def conversation_path(context_file: str) -> str:
+    return context_file + ".conversation"
+
+
+def load_conversation(context_file: str) -> Conversation | None:
+    """Return the conversation saved for the session log, if any."""
+
+    try:
+        with open(conversation_path(context_file)) as f:
+            data = json.load(f)
+        return Conversation(data["messages"], LogPosition(**data["position"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_conversation(context_file: str, conversation: Conversation):
+    """Save the conversation atomically, so that readers never see a partial file."""
+
+    path = conversation_path(context_file)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "w") as f:
+            json.dump(asdict(conversation), f)
+        os.replace(temporary_path, path)
+    except OSError:
+        pass
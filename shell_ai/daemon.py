@@ -0,0 +1,272 @@
+"""Long-lived per-user shell-ai daemon.
+
+The daemon keeps the interpreter, the configuration and the API client's
+connection pool warm, and serves CLI invocations forwarded by `client.py` over a
+Unix socket.  Each connection speaks newline-delimited JSON:
+
+- client -> daemon: `{"type": "run", "argv": [...], "started_at": ..., "cwd": ...,
+  "env": {...}}`, then `{"type": "input", "data": "..." | null}` in reply to
+  input requests
+- daemon -> client: `{"type": "write", "stream": "stdout" | "stderr", "data": ...}`,
+  `{"type": "input"}` and finally `{"type": "exit", "code": ...}`, or
+  `{"type": "decline"}` right away if the client's environment (see
+  `client.forwarded_environment`) differs from the daemon's, in which case the
+  client runs the call in-process
+
+The config file is read again when it has changed since the last call.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from contextvars import ContextVar
+
+from . import main
+from .client import forwarded_environment, runtime_dir, socket_path
+from .completion import close_client
+from .config import config_file_stamp, reload_config
+from .utils import line_reader, working_directory
+
+
+class Session:
+    """A single forwarded CLI invocation."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.inputs: asyncio.Queue[str | None] = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+
+    def send(self, message: dict):
+        """Send a message, also from worker threads, e.g. of `asyncio.to_thread`."""
+
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._send(message)
+        else:
+            # Transports are not thread-safe.  Messages keep their order, since
+            # the worker's result is passed back to the loop the same way
+            self.loop.call_soon_threadsafe(self._send, message)
+
+    def _send(self, message: dict):
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b"\n")
+
+    async def read_line(self) -> str:
+        self.send({"type": "input"})
+        data = await self.inputs.get()
+        if data is None:
+            raise EOFError("EOF when reading a line")
+        return data.removesuffix("\n")
+
+
+# Stamp of the config file when it was last read
+_config_stamp: tuple[int, int] | None = None
+
+
+def refresh_config():
+    """Reload the config if its file was edited since it was read."""
+
+    global _config_stamp
+    stamp = config_file_stamp()
+    if stamp != _config_stamp:
+        reload_config()
+        _config_stamp = stamp
+
+
+_session: ContextVar[Session | None] = ContextVar("session", default=None)
+
+
+class SessionStream(io.TextIOBase):
+    """Standard stream that writes to the client of the current session."""
+
+    def __init__(self, name: str, fallback: io.TextIOBase):
+        self.name = name
+        self.fallback = fallback
+
+    def write(self, s: str) -> int:
+        if (session := _session.get()) is not None:
+            session.send({"type": "write", "stream": self.name, "data": s})
+        else:
+            self.fallback.write(s)
+        return len(s)
+
+    def flush(self):
+        if _session.get() is None:
+            self.fallback.flush()
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    session = Session(reader, writer)
+
+    try:
+        request = json.loads(await reader.readline())
+    except ValueError:
+        writer.close()
+        return
+
+    if request.get("env") != forwarded_environment():
+        session.send({"type": "decline"})
+        writer.close()
+        return
+    refresh_config()
+
+    _session.set(session)
+    line_reader.set(session.read_line)
+    working_directory.set(request.get("cwd"))
+
+    async def run() -> int:
+        # Keep SystemExit inside the task, so it cannot stop the event loop
+        try:
+            await main(request["argv"], started_at=request.get("started_at"))
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        return 0
+
+    run_task = asyncio.create_task(run())
+
+    async def receive():
+        # Dispatch input replies, and cancel the run if the client goes away
+        while line := await reader.readline():
+            message = json.loads(line)
+            if message["type"] == "input":
+                session.inputs.put_nowait(message["data"])
+        run_task.cancel()
+
+    receive_task = asyncio.create_task(receive())
+
+    try:
+        code = await run_task
+    except asyncio.CancelledError:
+        code = 130
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        code = 1
+    finally:
+        receive_task.cancel()
+
+    session.send({"type": "exit", "code": code})
+    try:
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+def pid_path() -> str:
+    return os.path.join(runtime_dir(), "daemon.pid")
+
+
+def is_running() -> bool:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+async def serve():
+    # Checks that the runtime directory is private before touching its files
+    path = socket_path()
+    if os.path.exists(path):
+        # Remove the stale socket of a daemon that did not exit cleanly
+        os.unlink(path)
+
+    refresh_config()
+    sys.stdout = SessionStream("stdout", sys.stdout)
+    sys.stderr = SessionStream("stderr", sys.stderr)
+
+    server = await asyncio.start_unix_server(handle_connection, path=path)
+    os.chmod(path, 0o600)
+    with open(pid_path(), "w") as f:
+        f.write(str(os.getpid()))
+
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: stopped.done() or stopped.set_result(None))
+
+    try:
+        async with server:
+            await stopped
+    finally:
+        for file in (path, pid_path()):
+            try:
+                os.unlink(file)
+            except FileNotFoundError:
+                pass
+        await close_client()
+
+
+def start() -> int:
+    if is_running():
+        print("shell-ai daemon is already running", file=sys.stderr)
+        return 0
+
+    subprocess.Popen(
+        [sys.executable, "-m", "shell_ai.daemon", "run"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+    # Wait for the socket to accept connections
+    for _ in range(100):
+        if is_running():
+            print("shell-ai daemon started", file=sys.stderr)
+            return 0
+        time.sleep(0.05)
+    print("Error: shell-ai daemon failed to start", file=sys.stderr)
+    return 1
+
+
+def stop() -> int:
+    try:
+        with open(pid_path()) as f:
+            pid = int(f.read())
+        os.kill(pid, signal.SIGTERM)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        print("shell-ai daemon is not running", file=sys.stderr)
+        return 1
+    print("shell-ai daemon stopped", file=sys.stderr)
+    return 0
+
+
+def status() -> int:
+    if is_running():
+        print(f"shell-ai daemon is running, socket: {socket_path()}", file=sys.stderr)
+        return 0
+    print("shell-ai daemon is not running", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="shell-ai-daemon")
+    parser.add_argument("command", choices=["start", "stop", "status", "run"])
+    args = parser.parse_args()
+
+    try:
+        runtime_dir()
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == "run":
+        asyncio.run(serve())
+    else:
+        sys.exit({"start": start, "stop": stop, "status": status}[args.command]())
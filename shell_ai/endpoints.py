@@ -0,0 +1,88 @@
+"""Latency statistics of the configured endpoints.
+
+The smoothed time to first token of each endpoint, and its variation, are
+kept across calls.  They decide which endpoint is tried first, and how long a
+request waits for its first token before it is hedged on the next endpoint.
+"""
+
+import json
+import os
+import time
+
+from .config import STATE_DIR, Endpoint
+
+STATS_FILE = os.path.join(STATE_DIR, "endpoints.json")
+
+# Hedge delay of an endpoint without statistics yet, and bounds of the
+# adaptive delay
+DEFAULT_HEDGE_DELAY = 2.0
+MIN_HEDGE_DELAY = 0.25
+MAX_HEDGE_DELAY = 10.0
+
+# Seconds during which an endpoint that failed is tried last
+FAILURE_PENALTY = 60.0
+
+
+def load_stats() -> dict[str, dict]:
+    try:
+        with open(STATS_FILE) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return stats if isinstance(stats, dict) else {}
+
+
+def update_stats(samples: dict[str, float | None]):
+    """Add the time to first token of each endpoint, or `None` for a failure."""
+
+    stats = load_stats()
+    now = time.time()
+    for name, sample in samples.items():
+        entry = stats.setdefault(name, {})
+        if sample is None:
+            entry["failures"] = entry.get("failures", 0) + 1
+            entry["last_failure"] = now
+        elif "ttft" not in entry:
+            entry["ttft"] = sample
+            entry["ttft_var"] = sample / 2
+        else:
+            # Smoothed like TCP round-trip times (RFC 6298)
+            entry["ttft_var"] = 0.75 * entry["ttft_var"] + 0.25 * abs(
+                entry["ttft"] - sample
+            )
+            entry["ttft"] = 0.875 * entry["ttft"] + 0.125 * sample
+
+    temporary_path = f"{STATS_FILE}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        with open(temporary_path, "w") as f:
+            json.dump(stats, f)
+        os.replace(temporary_path, STATS_FILE)
+    except OSError:
+        pass
+
+
+def rank(endpoints: tuple[Endpoint, ...], stats: dict[str, dict]) -> list[Endpoint]:
+    """Order the endpoints by recent failures, then by time to first token.
+
+    Endpoints without statistics come after the others, in config order.
+    """
+
+    now = time.time()
+
+    def key(endpoint: Endpoint):
+        entry = stats.get(endpoint.name, {})
+        failed = now - entry.get("last_failure", 0) < FAILURE_PENALTY
+        return failed, entry.get("ttft", float("inf"))
+
+    return sorted(endpoints, key=key)
+
+
+def hedge_delay(endpoint: Endpoint, stats: dict[str, dict]) -> float:
+    """Time to wait for the endpoint's first token before hedging."""
+
+    entry = stats.get(endpoint.name)
+    if not entry or "ttft" not in entry:
+        return DEFAULT_HEDGE_DELAY
+    delay = entry["ttft"] + 4 * entry["ttft_var"]
+    return min(max(delay, MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum, auto
 from typing import Any, Generic, TypeVar
 
@@ -15,9 +15,59 @@ class Ref(Generic[T]):
 
 class EventType(Enum):
     SUGGEST_COMMAND = auto()
+    CALL_TOOL = auto()
 
 
 @dataclass
 class Event:
     type: EventType
     data: Any
+
+
+@dataclass
+class SuggestedCommand:
+    command: str
+    # Marked `<exec parallel>`, so that it can run alongside its neighbours
+    parallel: bool = False
+
+
+class Workflow(Enum):
+    """Kind of request, as named in the routing rules of the config."""
+
+    PROCEED = "proceed"  # `ai proceed`, a round of an ongoing task
+    EMPTY = "empty"  # `ai` without a message
+    MESSAGE = "message"
+    RAW = "raw"  # Raw prompts, e.g. from extensions
+
+
+class ParseEventType(Enum):
+    TEXT = auto()
+    OPENING_TAG = auto()
+    CLOSING_TAG = auto()
+
+
+@dataclass
+class ParseEvent:
+    type: ParseEventType
+    data: str
+    tag: str | None = None
+    attrs: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class LogPosition:
+    log_id: str  # Device and inode, to tell if the log was replaced
+    offset: int
+    fingerprint: int | None = None  # Checksum of the bytes before the offset
+
+
+@dataclass
+class Conversation:
+    messages: list[Message]  # Turns so far, without the system prompt
+    position: LogPosition  # End of the terminal output already sent
+
+
+@dataclass
+class CommandBlock:
+    command: str | None  # Prompt line with the command, None before the first
+    output: list[str]  # Lines
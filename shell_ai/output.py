@@ -0,0 +1,116 @@
+import asyncio
+import io
+import os
+import time
+from collections.abc import Callable
+from typing import TextIO
+
+# Longest time output is held back, about a frame at 60 Hz
+FLUSH_INTERVAL = 0.016
+
+# Buffered size at which output is written right away
+FLUSH_SIZE = 4096
+
+
+class OutputWriter:
+    """Coalesce streamed output into few writes to a standard stream.
+
+    Text is buffered and written at most every `interval` seconds, or once
+    `size` bytes are buffered, so fast streams do not cost a write and a
+    terminal redraw per token.  Call `flush` at points where the output must
+    be visible, e.g. before prompting the user, and `hold` to keep it back
+    while the user is prompted.
+
+    Output goes straight to the stream's file descriptor when it has one, and
+    through the stream otherwise (e.g. the daemon's session streams).  Pass a
+    function returning the stream, e.g. `lambda: sys.stderr`, to write to the
+    stream current at each write, such as one redirected after the writer was
+    made.
+    """
+
+    def __init__(
+        self,
+        stream: TextIO | Callable[[], TextIO],
+        *,
+        interval: float = FLUSH_INTERVAL,
+        size: int = FLUSH_SIZE,
+    ):
+        self._stream = stream
+        self.interval = interval
+        self.size = size
+        self.writes = 0
+        self._buffer: list[str] = []
+        self._buffered = 0
+        self._last_flush = 0.0
+        self._held = False
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def stream(self) -> TextIO:
+        return self._stream() if callable(self._stream) else self._stream
+
+    def write(self, text: str):
+        if not text:
+            return
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._held:
+            return
+
+        if (
+            self._buffered >= self.size
+            or time.monotonic() - self._last_flush >= self.interval
+        ):
+            self.flush()
+        elif self._timer is None:
+            # Write the rest once the interval is over, if nothing else does
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            delay = self.interval - (time.monotonic() - self._last_flush)
+            self._timer = loop.call_later(delay, self.flush)
+
+    def hold(self):
+        """Buffer all output until `release`."""
+
+        self._held = True
+
+    def release(self):
+        """Write the output held back, and resume writing."""
+
+        self._held = False
+        self.flush()
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._held:
+            return
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        self.writes += 1
+
+        stream = self.stream
+        try:
+            fd = stream.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            stream.write(text)
+            stream.flush()
+            return
+
+        # Keep the order with what was written through the stream
+        stream.flush()
+        data = text.encode(stream.encoding or "utf-8", errors="replace")
+        while data:
+            try:
+                data = data[os.write(fd, data) :]
+            except InterruptedError:
+                continue
@@ -0,0 +1,119 @@
+import re
+from collections.abc import Iterable
+
+from .models import ParseEvent, ParseEventType
+
+# Longest text that is held back while deciding whether it starts a tag
+MAX_TAG_LENGTH = 256
+
+_ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)(?:="([^"]*)")?')
+
+
+class TagParser:
+    """Incremental parser for XML-like tags in a response stream.
+
+    Each chunk is scanned once, and only a possible partial tag at the end of a
+    chunk (at most `MAX_TAG_LENGTH` characters) is held back until the next one,
+    so the total cost is linear in the length of the response.  Tags do not
+    nest: inside a tag, everything up to its closing tag is text.
+    """
+
+    def __init__(self, tags: Iterable[str]):
+        self.tags = tuple(tags)
+        self.open_tag: str | None = None
+        self._opening_pattern = re.compile(
+            rf"<({'|'.join(re.escape(tag) for tag in self.tags)})(\s[^<>]*)?>"
+        )
+        self._closing_tags = {tag: f"</{tag}>" for tag in self.tags}
+        self._pending = ""
+
+    def feed(self, chunk: str) -> list[ParseEvent]:
+        """Parse the next chunk of the stream and return the resulting events."""
+
+        events: list[ParseEvent] = []
+        text = self._pending + chunk
+        self._pending = ""
+
+        pos = 0
+        while pos < len(text):
+            if self.open_tag is None:
+                pos = self._parse_outside(text, pos, events)
+            else:
+                pos = self._parse_inside(text, pos, events)
+        return events
+
+    def close(self) -> list[ParseEvent]:
+        """Flush the text held back at the end of the stream."""
+
+        events: list[ParseEvent] = []
+        if self._pending:
+            self._emit_text(self._pending, events)
+            self._pending = ""
+        return events
+
+    def _emit_text(self, text: str, events: list[ParseEvent]):
+        if text:
+            events.append(ParseEvent(ParseEventType.TEXT, text, tag=self.open_tag))
+
+    def _parse_outside(self, text: str, pos: int, events: list[ParseEvent]) -> int:
+        start = pos
+        while (pos := text.find("<", pos)) != -1:
+            if match := self._opening_pattern.match(text, pos):
+                self._emit_text(text[start:pos], events)
+                self.open_tag = match.group(1)
+                events.append(
+                    ParseEvent(
+                        ParseEventType.OPENING_TAG,
+                        match.group(0),
+                        tag=self.open_tag,
+                        attrs={
+                            name: value
+                            for name, value in _ATTRIBUTE_PATTERN.findall(
+                                match.group(2) or ""
+                            )
+                        },
+                    )
+                )
+                return match.end()
+            if self._is_partial_opening_tag(text, pos):
+                self._emit_text(text[start:pos], events)
+                self._pending = text[pos:]
+                return len(text)
+            pos += 1
+
+        self._emit_text(text[start:], events)
+        return len(text)
+
+    def _parse_inside(self, text: str, pos: int, events: list[ParseEvent]) -> int:
+        closing_tag = self._closing_tags[self.open_tag]
+
+        if (end := text.find(closing_tag, pos)) != -1:
+            self._emit_text(text[pos:end], events)
+            events.append(
+                ParseEvent(ParseEventType.CLOSING_TAG, closing_tag, tag=self.open_tag)
+            )
+            self.open_tag = None
+            return end + len(closing_tag)
+
+        # Hold back a suffix that may be the start of the closing tag
+        for size in range(min(len(closing_tag) - 1, len(text) - pos), 0, -1):
+            if text[-size] == "<" and text.endswith(closing_tag[:size]):
+                self._emit_text(text[pos:-size], events)
+                self._pending = text[-size:]
+                return len(text)
+
+        self._emit_text(text[pos:], events)
+        return len(text)
+
+    def _is_partial_opening_tag(self, text: str, pos: int) -> bool:
+        if len(text) - pos > MAX_TAG_LENGTH:
+            return False
+        rest = text[pos + 1 :]
+        if ">" in rest or "<" in rest:
+            return False
+        for tag in self.tags:
+            if tag.startswith(rest):
+                return True
+            if rest.startswith(tag) and rest[len(tag)].isspace():
+                return True
+        return False
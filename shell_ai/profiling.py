@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+from typing import TextIO
+
+# Modules imported on the way to sending a request
+STARTUP_MODULES = ("shell_ai", "shell_ai.completion", "httpx", "openai")
+
+
+def measure_import_times(
+    modules: tuple[str, ...] = STARTUP_MODULES,
+) -> list[tuple[str, int, int]]:
+    """Import the modules in a fresh interpreter with `-X importtime`.
+
+    Return a list of `(module, self_us, cumulative_us)` tuples in import order.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    entries = []
+    for line in result.stderr.splitlines():
+        # Format: "import time: <self> | <cumulative> | <indented module name>"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def print_startup_profile(*, limit: int = 15, file: TextIO = sys.stderr):
+    """Print the import cost of the startup path, summarized per package."""
+
+    entries = measure_import_times()
+
+    packages: dict[str, int] = {}
+    for name, self_us, _ in entries:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    total_us = sum(packages.values())
+
+    print(f"Import time on startup: {total_us / 1000:.1f} ms", file=file)
+    print(f"{'package':<24} {'ms':>8} {'share':>7}", file=file)
+    for package, us in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+        print(
+            f"{package:<24} {us / 1000:>8.1f} {us / total_us if total_us else 0:>7.1%}",
+            file=file,
+        )
+    if len(packages) > limit:
+        rest_us = sum(sorted(packages.values(), reverse=True)[limit:])
+        print(
+            f"{f'({len(packages) - limit} more)':<24} {rest_us / 1000:>8.1f} {rest_us / total_us:>7.1%}",
+            file=file,
+        )
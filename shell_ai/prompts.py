@@ -1,10 +1,8 @@
-import sys
+from .models import Message, Workflow
 
-
-PROMPT_TEMPLATE = """You are an automated AI agent that works in the user's shell environment, invoked with `ai` command.  You are designed to understand the user's natural language specifications and help them run correct commands.  Your response should be brief if not specified otherwise.  You are responsible for the output of previous `ai` commands, but your raw response is processed by the system before writing to the terminal (i.e., colored, XML tags stripped, "AI:" added before, etc.) and may contain some system messages (e.g. asking the user for approval), so you must always keep your raw response format, and never imitate the previous output.
-
-Workflow:
-{workflow}
+# Sent first and identical on every call, so that providers can cache it as a
+# prompt prefix.  Everything that varies goes into USER_TEMPLATE.
+SYSTEM_PROMPT = """You are an automated AI agent that works in the user's shell environment, invoked with `ai` command.  You are designed to understand the user's natural language specifications and help them run correct commands.  Your response should be brief if not specified otherwise.  You are responsible for the output of previous `ai` commands, but your raw response is processed by the system before writing to the terminal (i.e., colored, XML tags stripped, "AI:" added before, etc.) and may contain some system messages (e.g. asking the user for approval), so you must always keep your raw response format, and never imitate the previous output.
 
 You are capable of interacting with the environment using XML tags (only tags defined below are allowed to use):
 -   exec: When suggesting a command for the user, write the command within <exec></exec>.  Then the command will be executed under the user's approval.
@@ -17,12 +15,29 @@ EOF
 ) && chmod +x hello.sh)</exec>
 -   If your command needs some information from the user, use `read -p` command to prompt the user for input.  For example, when you need the user's name before echoing a greeting, you can do: <exec>read -p "Enter your name: " name; echo "Hello, $name!"</exec>
 -   Use separate exec tags when requesting the user's approval separately is necessary.  The approved commands will execute in order.
+-   Independent commands that only gather information, e.g. <exec parallel>df -h</exec> and <exec parallel>journalctl -b -p err | tail -20</exec>, can be marked with the `parallel` attribute.  Consecutive approved parallel commands run at the same time, and their outputs are shown in order once they all finish.  They must not depend on each other, read input, change the shell state (e.g. `cd` or variables), or call `ai proceed`, which always runs last on its own.
 -   It's recommended to use here-document for purposes like multiline writing.  When editing a big file (>100 lines), make sure you have already read the original content, and use search-and-replace strategy to apply difference rather than recreating the whole file.  If failed, you can fall back to rewriting.
 -   You can call yourself tail-recursively with `ai proceed` command as the very last sub-command to perform a multi-round task automation.  For example, when you need to see a file content, you can say this to call your new self with the knowledge of the output of `cat`: <exec>cat filename; ai proceed</exec>
-    This will call yourself with the knowledge of the execution results.  Note that the separator must be `;` to make sure you can proceed regardless of the exit status of the preceding command.
-{optional_tips}
+    This will call yourself with the knowledge of the execution results.  Note that the separator must be `;` to make sure you can proceed regardless of the exit status of the preceding command."""
+
+# Appended to the system prompt when tools are enabled in the config
+TOOLS_PROMPT = """
+
+You can also gather information without the user's approval, with read-only tools that run right away:
+-   tool: To call a tool, write a JSON object with its `name` and arguments within <tool></tool>, e.g. <tool>{{"name": "read_file", "path": "setup.py", "end": 40}}</tool>.  After your tool calls, end your response: the results are sent to you in a new message that the user does not see, and you continue from there.  Prefer tools over `cat filename; ai proceed` to read files and search, since they need no approval and no new round.  Tools cannot read hidden files (names starting with a dot).
+    The tools are:
+{tools}"""
+
+TOOL_RESULTS_TEMPLATE = """Results of your tool calls:
+
+{results}
+
+Continue your response."""
+
+USER_TEMPLATE = """Workflow:
+{workflow}
 
-Terminal context:
+{context_title}:
 {session_context}
 
 {optional_message_section}"""
@@ -33,28 +48,73 @@ EMPTY_MESSAGE_WORKFLOW = """You should first analyze the terminal context (which
 
 DEFAULT_WORKFLOW = """Reply to the user, make decisions, and interact with the environment if necessary.  When you are not done after this round of command execution, you should make a tail self call with `ai proceed`."""
 
+# Sent after a response that was cut off, with the partial response before it
+RESUME_PROMPT = """Your previous response was cut off.  Continue it exactly where it stopped, without repeating anything."""
 
-def construct_prompt(**kwargs):
-    message: str = kwargs["message"]
-    raw_mode = kwargs.get("raw_mode", False)
 
+def workflow_type(message: str, raw_mode: bool = False) -> Workflow:
     if raw_mode:
-        return message
+        return Workflow.RAW
+    if message == "proceed" or message.startswith("proceed "):
+        return Workflow.PROCEED
+    if not message:
+        return Workflow.EMPTY
+    return Workflow.MESSAGE
+
 
-    kwargs["optional_tips"] = ""
+def construct_prompt(**kwargs) -> list[Message]:
+    """Return the messages to send: the fixed system prompt, then the variable
+    workflow, terminal context and user message.
 
-    if message.startswith("proceed "):
-        kwargs["optional_message_section"] = f"Task:\n{message[len('proceed ') :]}"
+    With a `history` of previous turns, they are sent before the new turn,
+    whose context is only the terminal output since the last turn.  With the
+    description of `tools`, the system prompt tells how to call them.
+    """
+
+    message: str = kwargs["message"]
+    raw_mode = kwargs.get("raw_mode", False)
+    history: list[Message] = kwargs.get("history") or []
+    tools: str | None = kwargs.get("tools")
+
+    workflow = workflow_type(message, raw_mode)
+    if workflow == Workflow.RAW:
+        return [{"role": "user", "content": message}]
+
+    if workflow == Workflow.PROCEED:
+        task = message[len("proceed ") :]
+        kwargs["optional_message_section"] = f"Task:\n{task}" if task else ""
         kwargs["workflow"] = PROCEED_WORKFLOW
-    elif message == "proceed":
+    elif workflow == Workflow.EMPTY:
         kwargs["optional_message_section"] = ""
-        kwargs["workflow"] = PROCEED_WORKFLOW
+        kwargs["workflow"] = EMPTY_MESSAGE_WORKFLOW
     else:
-        if not message:
-            kwargs["optional_message_section"] = ""
-            kwargs["workflow"] = EMPTY_MESSAGE_WORKFLOW
-        else:
-            kwargs["optional_message_section"] = f"User message:\n{message}"
-            kwargs["workflow"] = DEFAULT_WORKFLOW
-
-    return PROMPT_TEMPLATE.format(**kwargs)
+        kwargs["optional_message_section"] = f"User message:\n{message}"
+        kwargs["workflow"] = DEFAULT_WORKFLOW
+
+    kwargs["context_title"] = (
+        "New terminal output since your last response"
+        if history
+        else "Terminal context"
+    )
+
+    system_prompt = SYSTEM_PROMPT
+    if tools:
+        system_prompt += TOOLS_PROMPT.format(tools=tools)
+
+    return [
+        {"role": "system", "content": system_prompt},
+        *history,
+        {"role": "user", "content": USER_TEMPLATE.format(**kwargs)},
+    ]
+
+
+def tool_results_prompt(calls: list[str], results: list[str]) -> Message:
+    return {
+        "role": "user",
+        "content": TOOL_RESULTS_TEMPLATE.format(
+            results="\n\n".join(
+                f"<tool-result>\n{call.strip()}\n{result}\n</tool-result>"
+                for call, result in zip(calls, results)
+            )
+        ),
+    }
@@ -0,0 +1,179 @@
+"""Rate limits shared by all the shell-ai processes of the user.
+
+An endpoint with `requests-per-minute` or `tokens-per-minute` in the config
+has a token bucket for each, refilled continuously up to a minute's worth, in
+a state file of the runtime directory that is only accessed under an
+exclusive `flock`.  Requests that would exceed a limit wait their turn in a
+first-in, first-out queue kept in the same file, instead of being sent and
+failing with 429 errors.
+
+Summarize the state with `python -m shell_ai.ratelimit`.
+"""
+
+import asyncio
+import copy
+import fcntl
+import json
+import os
+import sys
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from .client import runtime_dir
+from .config import Endpoint, load_config
+
+# Longest sleep between two checks of the queue
+POLL_INTERVAL = 0.05
+
+# Seconds after which a waiter that stopped checking, e.g. because it was
+# killed, is dropped from the queue
+STALE_WAITER = 5.0
+
+
+def state_path() -> str:
+    return os.path.join(runtime_dir(), "ratelimit.json")
+
+
+@contextmanager
+def _locked_state() -> Iterator[dict]:
+    """Yield the state, and write it back, under an exclusive lock."""
+
+    fd = os.open(state_path(), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        with os.fdopen(os.dup(fd), "r+") as f:
+            try:
+                state = json.load(f)
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+    finally:
+        # Also releases the lock
+        os.close(fd)
+
+
+def _refill(bucket: dict, per_minute: int, now: float):
+    level = bucket.get("level", per_minute)
+    elapsed = max(now - bucket.get("updated", now), 0.0)
+    bucket["level"] = min(level + elapsed * per_minute / 60, per_minute)
+    bucket["updated"] = now
+
+
+def _try_acquire(endpoint: Endpoint, waiter: str, tokens: int) -> float:
+    """Take the request's share of the buckets if it is its turn.
+
+    Returns 0 on success, and otherwise the seconds to wait before trying
+    again.
+    """
+
+    now = time.time()
+    with _locked_state() as state:
+        entry = state.setdefault(endpoint.name, {})
+        # Waiters in order of arrival, with the time they last checked
+        queue: dict[str, float] = entry.setdefault("queue", {})
+        queue[waiter] = now
+        for other, seen in list(queue.items()):
+            if now - seen > STALE_WAITER:
+                del queue[other]
+        if next(iter(queue)) != waiter:
+            return POLL_INTERVAL
+
+        costs = []
+        delay = 0.0
+        for key, per_minute, cost in (
+            ("requests", endpoint.requests_per_minute, 1),
+            ("tokens", endpoint.tokens_per_minute, tokens),
+        ):
+            if not per_minute:
+                continue
+            bucket = entry.setdefault(key, {})
+            _refill(bucket, per_minute, now)
+            # A request larger than the bucket waits for a full bucket
+            cost = min(cost, per_minute)
+            if bucket["level"] < cost:
+                delay = max(delay, (cost - bucket["level"]) * 60 / per_minute)
+            costs.append((bucket, cost))
+        if delay:
+            return delay
+
+        for bucket, cost in costs:
+            bucket["level"] -= cost
+        del queue[waiter]
+        return 0.0
+
+
+def _leave(endpoint: Endpoint, waiter: str):
+    with _locked_state() as state:
+        state.get(endpoint.name, {}).get("queue", {}).pop(waiter, None)
+
+
+def is_limited(endpoint: Endpoint) -> bool:
+    return bool(endpoint.requests_per_minute or endpoint.tokens_per_minute)
+
+
+async def acquire(endpoint: Endpoint, tokens: int) -> float:
+    """Wait until a request of about `tokens` tokens can be sent to the endpoint.
+
+    Returns the seconds spent waiting.
+    """
+
+    if not is_limited(endpoint):
+        return 0.0
+
+    waiter = uuid.uuid4().hex
+    started = time.monotonic()
+    try:
+        while delay := _try_acquire(endpoint, waiter, tokens):
+            await asyncio.sleep(min(delay, POLL_INTERVAL))
+    except BaseException:
+        # Give up the place in the queue, e.g. when interrupted
+        _leave(endpoint, waiter)
+        raise
+    return time.monotonic() - started
+
+
+def settle(endpoint: Endpoint, estimated_tokens: int, tokens: int):
+    """Charge the difference between the estimated and actual tokens used."""
+
+    if not endpoint.tokens_per_minute or tokens == estimated_tokens:
+        return
+    with _locked_state() as state:
+        bucket = state.setdefault(endpoint.name, {}).setdefault("tokens", {})
+        _refill(bucket, endpoint.tokens_per_minute, time.time())
+        # Going below zero delays the next requests
+        bucket["level"] -= tokens - estimated_tokens
+
+
+def main():
+    with _locked_state() as state:
+        state = copy.deepcopy(state)
+    if not state:
+        print("No rate-limited requests yet", file=sys.stderr)
+        return
+
+    now = time.time()
+    for endpoint in load_config().endpoints:
+        if endpoint.name not in state or not is_limited(endpoint):
+            continue
+        entry = state[endpoint.name]
+        levels = []
+        for key, per_minute in (
+            ("requests", endpoint.requests_per_minute),
+            ("tokens", endpoint.tokens_per_minute),
+        ):
+            if per_minute and key in entry:
+                _refill(entry[key], per_minute, now)
+                levels.append(f"{key} {entry[key]['level']:.0f}/{per_minute}")
+        print(
+            f"{endpoint.name}: {len(entry.get('queue', {}))} waiting, "
+            f"{', '.join(levels)} available"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""PTY session recorder, a replacement for `script -fq`.
+
+The recorded output goes to a fixed-size ring buffer file, so disk use stays
+bounded however long the session runs, and command boundaries are kept in a
+side index, so the last commands can be looked up by offset instead of by
+scanning the log.
+
+Boundaries come from the OSC 133 "semantic prompt" markers, which
+`profile.d/shell-ai.sh` emits in recorder mode: `A` at the start of a prompt,
+`C` where command output starts, and `D;<exit status>` when a command is done.
+
+Offsets are logical: the number of bytes written to the log since it was
+created, which keep growing as the ring wraps around.
+"""
+
+import argparse
+import fcntl
+import os
+import pty
+import select
+import signal
+import struct
+import sys
+import termios
+import time
+import tty
+from dataclasses import dataclass
+from enum import IntEnum
+
+RING_MAGIC = b"SHAIRING"
+INDEX_MAGIC = b"SHAIINDX"
+VERSION = 1
+
+DEFAULT_CAPACITY = 8 * 1024 * 1024
+DEFAULT_INDEX_SLOTS = 4096
+
+# Magic, version, capacity, head and cleared offsets
+_RING_HEADER = struct.Struct("<8sIQQQ")
+_RING_HEAD_OFFSET = struct.calcsize("<8sIQ")
+_RING_CLEARED_OFFSET = struct.calcsize("<8sIQQ")
+RING_HEADER_SIZE = 64
+
+# Magic, version, slots and number of records ever written
+_INDEX_HEADER = struct.Struct("<8sIIQ")
+_INDEX_COUNT_OFFSET = struct.calcsize("<8sII")
+INDEX_HEADER_SIZE = 32
+
+# Kind, exit status, offset and time
+_INDEX_RECORD = struct.Struct("<BxxxiQd")
+
+MARKER_PREFIX = b"\x1b]133;"
+MAX_MARKER_LENGTH = 64
+
+
+class MarkKind(IntEnum):
+    PROMPT = 1
+    OUTPUT = 2
+    DONE = 3
+
+
+_MARK_KINDS = {b"A": MarkKind.PROMPT, b"C": MarkKind.OUTPUT, b"D": MarkKind.DONE}
+
+
+@dataclass
+class Mark:
+    kind: MarkKind
+    offset: int
+    status: int = 0
+    time: float = 0.0
+
+
+@dataclass
+class Command:
+    """A prompt, the command typed at it and its output, by log offsets."""
+
+    start: int
+    output_start: int | None = None
+    end: int | None = None
+    status: int | None = None
+
+
+def index_path(path: str) -> str:
+    return path + ".index"
+
+
+def is_ring_log(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(RING_MAGIC)) == RING_MAGIC
+    except OSError:
+        return False
+
+
+class RingLog:
+    """A log file holding the last `capacity` bytes written to it."""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        magic, version, self.capacity, self.head, self.cleared = _RING_HEADER.unpack(
+            os.pread(fd, _RING_HEADER.size, 0)
+        )
+        if magic != RING_MAGIC or version != VERSION:
+            raise ValueError("Not a ring buffer log")
+
+    @classmethod
+    def create(cls, path: str, capacity: int = DEFAULT_CAPACITY) -> "RingLog":
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        header = _RING_HEADER.pack(RING_MAGIC, VERSION, capacity, 0, 0)
+        os.pwrite(fd, header.ljust(RING_HEADER_SIZE, b"\0"), 0)
+        return cls(fd)
+
+    @classmethod
+    def open(cls, path: str, *, writable: bool = False) -> "RingLog":
+        return cls(os.open(path, os.O_RDWR if writable else os.O_RDONLY))
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def start(self) -> int:
+        """The oldest offset that can still be read."""
+
+        return max(self.cleared, self.head - self.capacity)
+
+    def refresh(self):
+        """Re-read the offsets written by the recording process."""
+
+        self.head, self.cleared = struct.unpack(
+            "<QQ", os.pread(self.fd, 16, _RING_HEAD_OFFSET)
+        )
+
+    def append(self, data: bytes):
+        if len(data) > self.capacity:
+            # Only the end of the data fits
+            self.head += len(data) - self.capacity
+            data = data[-self.capacity :]
+
+        position = self.head % self.capacity
+        first = data[: self.capacity - position]
+        os.pwrite(self.fd, first, RING_HEADER_SIZE + position)
+        if len(first) < len(data):
+            os.pwrite(self.fd, data[len(first) :], RING_HEADER_SIZE)
+
+        # Publish the new head only after the data is in place
+        self.head += len(data)
+        os.pwrite(self.fd, struct.pack("<Q", self.head), _RING_HEAD_OFFSET)
+
+    def clear(self):
+        """Hide everything written so far from readers."""
+
+        self.refresh()
+        self.cleared = self.head
+        os.pwrite(self.fd, struct.pack("<Q", self.cleared), _RING_CLEARED_OFFSET)
+
+    def read(self, start: int, end: int) -> bytes:
+        """Read the bytes between two offsets.
+
+        Raise `ValueError` if the range is no longer available, including when
+        the recorder overwrote it during the read.
+        """
+
+        if start < self.start or end > self.head or start > end:
+            raise ValueError("Range not available in the ring buffer log")
+
+        position = start % self.capacity
+        size = end - start
+        data = os.pread(
+            self.fd, min(size, self.capacity - position), RING_HEADER_SIZE + position
+        )
+        if len(data) < size:
+            data += os.pread(self.fd, size - len(data), RING_HEADER_SIZE)
+
+        self.refresh()
+        if start < self.head - self.capacity:
+            raise ValueError("Range overwritten while reading the ring buffer log")
+        return data
+
+
+class CommandIndex:
+    """A fixed number of the latest command boundary marks of a ring log."""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        magic, version, self.slots, self.count = _INDEX_HEADER.unpack(
+            os.pread(fd, _INDEX_HEADER.size, 0)
+        )
+        if magic != INDEX_MAGIC or version != VERSION:
+            raise ValueError("Not a command index")
+
+    @classmethod
+    def create(cls, path: str, slots: int = DEFAULT_INDEX_SLOTS) -> "CommandIndex":
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        header = _INDEX_HEADER.pack(INDEX_MAGIC, VERSION, slots, 0)
+        os.pwrite(fd, header.ljust(INDEX_HEADER_SIZE, b"\0"), 0)
+        return cls(fd)
+
+    @classmethod
+    def open(cls, path: str) -> "CommandIndex":
+        return cls(os.open(path, os.O_RDONLY))
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, mark: Mark):
+        record = _INDEX_RECORD.pack(mark.kind, mark.status, mark.offset, mark.time)
+        slot = self.count % self.slots
+        os.pwrite(self.fd, record, INDEX_HEADER_SIZE + slot * _INDEX_RECORD.size)
+        self.count += 1
+        os.pwrite(self.fd, struct.pack("<Q", self.count), _INDEX_COUNT_OFFSET)
+
+    def marks(self, limit: int | None = None) -> list[Mark]:
+        """Return the latest marks, oldest first."""
+
+        (count,) = struct.unpack("<Q", os.pread(self.fd, 8, _INDEX_COUNT_OFFSET))
+        first = max(0, count - self.slots, count - limit if limit else 0)
+
+        # Read all slots at once, they are small
+        records = os.pread(self.fd, self.slots * _INDEX_RECORD.size, INDEX_HEADER_SIZE)
+        marks = []
+        for number in range(first, count):
+            kind, status, offset, timestamp = _INDEX_RECORD.unpack_from(
+                records, number % self.slots * _INDEX_RECORD.size
+            )
+            marks.append(Mark(MarkKind(kind), offset, status, timestamp))
+        return marks
+
+
+class MarkerScanner:
+    """Find OSC 133 markers in recorded output, across read boundaries."""
+
+    def __init__(self):
+        self._carry = b""
+
+    def feed(self, data: bytes, offset: int) -> list[Mark]:
+        """Scan data starting at the given log offset for markers."""
+
+        buffer = self._carry + data
+        base = offset - len(self._carry)
+        self._carry = b""
+
+        marks = []
+        pos = 0
+        while (pos := buffer.find(MARKER_PREFIX, pos)) != -1:
+            body_start = pos + len(MARKER_PREFIX)
+            end = buffer.find(b"\x07", body_start, body_start + MAX_MARKER_LENGTH)
+            if end == -1:
+                end = buffer.find(b"\x1b\\", body_start, body_start + MAX_MARKER_LENGTH)
+            if end == -1:
+                if len(buffer) - pos < MAX_MARKER_LENGTH:
+                    # Possibly split across reads
+                    self._carry = buffer[pos:]
+                    break
+                pos = body_start
+                continue
+
+            kind, _, arguments = buffer[body_start:end].partition(b";")
+            if kind in _MARK_KINDS:
+                status = arguments.split(b";")[0]
+                marks.append(
+                    Mark(
+                        _MARK_KINDS[kind],
+                        base + pos,
+                        int(status) if status.lstrip(b"-").isdigit() else 0,
+                        time.time(),
+                    )
+                )
+            pos = end
+
+        # Keep a partial prefix at the end for the next read
+        if not self._carry:
+            for size in range(min(len(MARKER_PREFIX) - 1, len(buffer)), 0, -1):
+                if buffer.endswith(MARKER_PREFIX[:size]):
+                    self._carry = buffer[-size:]
+                    break
+        return marks
+
+
+def last_commands(path: str, n: int) -> list[Command]:
+    """Return the last `n` commands of a ring log that are still readable."""
+
+    with RingLog.open(path) as log, CommandIndex.open(index_path(path)) as index:
+        commands: list[Command] = []
+        for mark in index.marks():
+            if mark.offset < log.start:
+                continue
+            if mark.kind == MarkKind.PROMPT:
+                if commands and commands[-1].end is None:
+                    commands[-1].end = mark.offset
+                commands.append(Command(start=mark.offset))
+            elif commands and mark.kind == MarkKind.OUTPUT:
+                commands[-1].output_start = mark.offset
+            elif commands and mark.kind == MarkKind.DONE:
+                commands[-1].end = mark.offset
+                commands[-1].status = mark.status
+        return commands[-n:] if n > 0 else []
+
+
+def _copy_window_size(source_fd: int, target_fd: int):
+    try:
+        size = fcntl.ioctl(source_fd, termios.TIOCGWINSZ, b"\0" * 8)
+        fcntl.ioctl(target_fd, termios.TIOCSWINSZ, size)
+    except OSError:
+        pass
+
+
+def _write_all(fd: int, data: bytes):
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+def record(path: str, command: list[str], capacity: int = DEFAULT_CAPACITY) -> int:
+    """Run a command in a pseudo-terminal and record its output to a ring log."""
+
+    log = RingLog.create(path, capacity)
+    index = CommandIndex.create(index_path(path))
+    scanner = MarkerScanner()
+
+    pid, master_fd = pty.fork()
+    if pid == 0:
+        try:
+            os.execvp(command[0], command)
+        finally:
+            os._exit(127)
+
+    stdin_fd, stdout_fd = sys.stdin.fileno(), sys.stdout.fileno()
+    interactive = os.isatty(stdin_fd)
+    if interactive:
+        _copy_window_size(stdin_fd, master_fd)
+        signal.signal(
+            signal.SIGWINCH, lambda *_: _copy_window_size(stdin_fd, master_fd)
+        )
+        saved_mode = termios.tcgetattr(stdin_fd)
+        tty.setraw(stdin_fd)
+
+    inputs = [master_fd, stdin_fd]
+    try:
+        while True:
+            try:
+                readable, _, _ = select.select(inputs, [], [])
+            except InterruptedError:
+                continue
+
+            if master_fd in readable:
+                try:
+                    data = os.read(master_fd, 65536)
+                except OSError:
+                    # The child closed the terminal
+                    break
+                if not data:
+                    break
+                _write_all(stdout_fd, data)
+                for mark in scanner.feed(data, log.head):
+                    index.append(mark)
+                log.append(data)
+
+            if stdin_fd in readable:
+                data = os.read(stdin_fd, 65536)
+                if data:
+                    _write_all(master_fd, data)
+                else:
+                    inputs.remove(stdin_fd)
+    finally:
+        if interactive:
+            termios.tcsetattr(stdin_fd, termios.TCSAFLUSH, saved_mode)
+        log.close()
+        index.close()
+        os.close(master_fd)
+
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+def parse_size(text: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if text and text[-1].upper() in units:
+        return int(text[:-1]) * units[text[-1].upper()]
+    return int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="shell-ai-recorder", description=__doc__)
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Record a session")
+    record_parser.add_argument("log_file")
+    record_parser.add_argument(
+        "--size",
+        type=parse_size,
+        default=DEFAULT_CAPACITY,
+        help="Size of the ring buffer, e.g. 8M (default: 8M)",
+    )
+    record_parser.add_argument(
+        "command", nargs="*", help="Command to run after --, (default: $SHELL)"
+    )
+
+    dump_parser = subparsers.add_parser("dump", help="Print the recorded output")
+    dump_parser.add_argument("log_file")
+
+    clear_parser = subparsers.add_parser("clear", help="Clear the recorded output")
+    clear_parser.add_argument("log_file")
+
+    commands_parser = subparsers.add_parser(
+        "commands", help="Print the offsets of the last commands"
+    )
+    commands_parser.add_argument("log_file")
+    commands_parser.add_argument("-n", type=int, default=10)
+
+    # Split off the command, whose options are not for the parser
+    argv = sys.argv[1:]
+    command = []
+    if "--" in argv:
+        separator = argv.index("--")
+        argv, command = argv[:separator], argv[separator + 1 :]
+    args = parser.parse_args(argv)
+
+    if args.action == "record":
+        command = args.command + command or [os.environ.get("SHELL", "/bin/sh")]
+        sys.exit(record(args.log_file, command, args.size))
+    elif args.action == "dump":
+        with RingLog.open(args.log_file) as log:
+            sys.stdout.buffer.write(log.read(log.start, log.head))
+    elif args.action == "clear":
+        with RingLog.open(args.log_file, writable=True) as log:
+            log.clear()
+    elif args.action == "commands":
+        for command in last_commands(args.log_file, args.n):
+            print(
+                f"start={command.start} output={command.output_start} "
+                f"end={command.end} status={command.status}"
+            )
+
+
+if __name__ == "__main__":
+    main()
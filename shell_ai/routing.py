@@ -0,0 +1,45 @@
+"""Choice of the model for a request, from the [route:*] sections of the config.
+
+The routes are checked in order, and the first one whose conditions all hold
+is used: the workflow of the request, a hint from the caller (e.g.
+"translate"), and the size of the prompt once the context has been trimmed.
+A route whose `context-window` is too small for the prompt is skipped.
+Without a matching route, the default model and endpoints are used.
+"""
+
+from .config import Route, load_config
+from .models import Message, Workflow
+from .utils import estimate_tokens
+
+
+def prompt_size(messages: list[Message]) -> int:
+    return sum(len(message["content"]) for message in messages)
+
+
+def select_route(
+    messages: list[Message], workflow: Workflow, hint: str | None = None
+) -> Route | None:
+    """Return the first route that matches the request, if any."""
+
+    routes = load_config().routes
+    if not routes:
+        return None
+
+    size = prompt_size(messages)
+    tokens = None
+    for route in routes:
+        if route.workflows and workflow.value not in route.workflows:
+            continue
+        if route.hints and hint not in route.hints:
+            continue
+        if route.min_prompt_size is not None and size < route.min_prompt_size:
+            continue
+        if route.max_prompt_size is not None and size > route.max_prompt_size:
+            continue
+        if route.context_window is not None:
+            if tokens is None:
+                tokens = sum(estimate_tokens(m["content"]) for m in messages)
+            if tokens > route.context_window:
+                continue
+        return route
+    return None
@@ -0,0 +1,164 @@
+"""Context snapshots of session logs, kept up to date in the background.
+
+The prompt hook of the profile script starts a refresh once 64 KiB were
+written to the log since the previous one, so that commands with little
+output cost no process.  A refresh replays only the bytes appended to the log
+since the previous one, on top of the saved state of the terminal, and saves
+that state with the offset of the log it reached.  `ai` then only replays the
+output written since, instead of reading, decoding and replaying the end of
+the log from scratch.
+
+A snapshot is only used while the log still holds the bytes before its
+offset, i.e. was not replaced, cleared or truncated since.  Ring buffer logs
+of the recorder, which are cut at command boundaries, are read as before.
+"""
+
+import codecs
+import fcntl
+import json
+import os
+import sys
+from dataclasses import asdict
+
+from .compaction import read_length
+from .config import load_config
+from .context import MAX_READ_SIZE, cut_start, is_position_readable, log_position
+from .models import LogPosition
+from .recorder import is_ring_log
+from .terminal import TerminalReplay
+
+# Output read on top of a snapshot, over which the end of the log is read from
+# scratch instead
+MAX_TAIL_SIZE = 4 * 1024 * 1024
+
+# Bytes of the end of the log that a new snapshot starts from, per character
+# of the context
+START_BYTES_PER_CHAR = 4
+
+
+def snapshot_path(context_file: str) -> str:
+    return context_file + ".snapshot"
+
+
+def _load(context_file: str) -> tuple[LogPosition, TerminalReplay] | None:
+    try:
+        with open(snapshot_path(context_file)) as f:
+            data = json.load(f)
+        return LogPosition(**data["position"]), TerminalReplay.restore(data["terminal"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save(context_file: str, position: LogPosition, terminal: TerminalReplay):
+    """Save the snapshot atomically, so that readers never see a partial file."""
+
+    path = snapshot_path(context_file)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "w") as f:
+            json.dump({"position": asdict(position), "terminal": terminal.save()}, f)
+        os.replace(temporary_path, path)
+    except OSError:
+        pass
+
+
+def _replay_from(
+    terminal: TerminalReplay, context_file: str, start: int, end: int, *, cut: bool
+) -> int:
+    """Replay the log between two offsets, and return the offset reached.
+
+    An incomplete character at the end is left for the next replay.
+    """
+
+    with open(context_file, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    end = start + len(data)
+    if cut:
+        data = cut_start(data)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    terminal.feed(decoder.decode(data))
+    return end - len(decoder.getstate()[0])
+
+
+def _trim_history(terminal: TerminalReplay, max_length: int):
+    """Drop the rows that scrolled out of reach and out of the context."""
+
+    length = sum(len(row) + 1 for row in terminal.history)
+    drop = 0
+    while drop < len(terminal.history):
+        row_length = len(terminal.history[drop]) + 1
+        if length - row_length < max_length:
+            break
+        length -= row_length
+        drop += 1
+    del terminal.history[:drop]
+
+
+def refresh(context_file: str, max_length: int):
+    """Bring the snapshot of the log up to date."""
+
+    with open(context_file, "rb") as log:
+        # A refresh that is already running will do
+        try:
+            fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+
+        size = os.fstat(log.fileno()).st_size
+        snapshot = _load(context_file)
+        if (
+            snapshot is not None
+            and size - snapshot[0].offset <= MAX_READ_SIZE
+            and is_position_readable(context_file, snapshot[0])
+        ):
+            position, terminal = snapshot
+            if position.offset == size:
+                return
+            offset = _replay_from(
+                terminal, context_file, position.offset, size, cut=False
+            )
+        else:
+            # Start over from the end of the log
+            start = max(0, size - START_BYTES_PER_CHAR * max_length)
+            terminal = TerminalReplay()
+            offset = _replay_from(terminal, context_file, start, size, cut=start > 0)
+
+        _trim_history(terminal, max_length)
+        _save(context_file, log_position(context_file, offset), terminal)
+
+
+def read_snapshot(context_file: str, max_length: int | None) -> str | None:
+    """Return the end of the log's visible text, like `read_context`, from its
+    snapshot and the output written since.
+
+    Returns None if there is no snapshot that can be used.
+    """
+
+    if not max_length or is_ring_log(context_file):
+        return None
+    snapshot = _load(context_file)
+    if snapshot is None:
+        return None
+    position, terminal = snapshot
+    size = os.path.getsize(context_file)
+    if size - position.offset > MAX_TAIL_SIZE or not is_position_readable(
+        context_file, position
+    ):
+        return None
+
+    _replay_from(terminal, context_file, position.offset, size, cut=False)
+    return terminal.text()[-max_length:]
+
+
+def main():
+    """Refresh the snapshot of the log given as argument, if it is used."""
+
+    context_file = sys.argv[1]
+    max_length = read_length(load_config())
+    if max_length and not is_ring_log(context_file):
+        refresh(context_file, max_length)
+
+
+if __name__ == "__main__":
+    main()
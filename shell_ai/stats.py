@@ -0,0 +1,9 @@
+"""Summary of the usage log, also run as `python -m shell_ai.stats`.
+
+See `shell_ai.usage`, which writes and reads the log.
+"""
+
+from .usage import main
+
+if __name__ == "__main__":
+    main()
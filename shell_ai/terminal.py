@@ -0,0 +1,241 @@
+import re
+
+# Rows at the bottom of the replayed output that cursor movements can reach.
+# Rows above are final, since the log carries no record of the real screen size.
+DEFAULT_HEIGHT = 100
+
+# Longest incomplete escape sequence held back at the end of a chunk
+MAX_PENDING_LENGTH = 4096
+
+_TOKEN_PATTERN = re.compile(
+    r"(?P<text>[^\x00-\x1f\x7f]+)"
+    r"|\x1b\[(?P<csi_params>[0-?]*)[ -/]*(?P<csi_final>[@-~])"
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"  # OSC, e.g. window title
+    r"|\x1b(?P<esc_final>[ -/]*[0-Z`-~])"
+    r"|(?P<control>[\x00-\x1a\x1c-\x1f\x7f])"
+)
+_PARTIAL_ESCAPE_PATTERN = re.compile(
+    r"\x1b(\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[ -/]*)?\Z"
+)
+
+_ALTERNATE_SCREEN_MODES = {"?47", "?1047", "?1049"}
+
+
+class TerminalReplay:
+    """Replay terminal output into the text that is left visible.
+
+    Carriage returns, backspaces, cursor movements, line and screen erasure and
+    alternate screen switches (e.g. `less`, `vim`, `top`) are applied, so that
+    redrawn progress bars and full-screen applications leave only their final
+    state.  Output can be fed chunk by chunk, and escape sequences split across
+    chunks are handled.
+    """
+
+    def __init__(self, height: int = DEFAULT_HEIGHT):
+        self.height = height
+        self.history: list[str] = []  # Rows scrolled out of reach of the cursor
+        self.screen: list[str] = [""]
+        self.row = 0
+        self.col = 0
+        self._saved_cursor = (0, 0)
+        self._main_screen: tuple[list[str], int, int] | None = None
+        self._pending = ""
+
+    def save(self) -> dict:
+        """Return the state of the replay, to resume it later with `restore`."""
+
+        return {
+            "height": self.height,
+            "history": self.history,
+            "screen": self.screen,
+            "cursor": [self.row, self.col],
+            "saved_cursor": list(self._saved_cursor),
+            "main_screen": self._main_screen,
+            "pending": self._pending,
+        }
+
+    @classmethod
+    def restore(cls, state: dict) -> "TerminalReplay":
+        terminal = cls(state["height"])
+        terminal.history = state["history"]
+        terminal.screen = state["screen"]
+        terminal.row, terminal.col = state["cursor"]
+        terminal._saved_cursor = tuple(state["saved_cursor"])
+        if state["main_screen"] is not None:
+            screen, row, col = state["main_screen"]
+            terminal._main_screen = (screen, row, col)
+        terminal._pending = state["pending"]
+        return terminal
+
+    @property
+    def in_alternate_screen(self) -> bool:
+        return self._main_screen is not None
+
+    def feed(self, chunk: str):
+        data = self._pending + chunk if self._pending else chunk
+        self._pending = ""
+
+        pos = 0
+        match_token = _TOKEN_PATTERN.match
+        while pos < len(data):
+            match = match_token(data, pos)
+            if match is None:
+                # An escape sequence that is incomplete or unknown
+                partial = _PARTIAL_ESCAPE_PATTERN.match(data, pos)
+                if partial and len(data) - pos < MAX_PENDING_LENGTH:
+                    self._pending = data[pos:]
+                    return
+                pos += 1
+                continue
+            pos = match.end()
+
+            kind = match.lastgroup
+            if kind == "text":
+                self._write(match.group("text"))
+            elif kind == "control":
+                self._control(match.group("control"))
+            elif kind == "csi_final":
+                self._csi(match.group("csi_params"), match.group("csi_final"))
+            elif kind == "esc_final":
+                self._esc(match.group("esc_final"))
+
+    def text(self) -> str:
+        """Return the visible text, with trailing spaces removed from each row."""
+
+        rows = self.history + self.screen
+        while len(rows) > 1 and not rows[-1].strip():
+            rows.pop()
+        return "\n".join(row.rstrip() for row in rows)
+
+    def _write(self, text: str):
+        line = self.screen[self.row]
+        if self.col == len(line):
+            self.screen[self.row] = line + text
+        elif self.col > len(line):
+            self.screen[self.row] = line + " " * (self.col - len(line)) + text
+        else:
+            self.screen[self.row] = (
+                line[: self.col] + text + line[self.col + len(text) :]
+            )
+        self.col += len(text)
+
+    def _line_feed(self):
+        self.row += 1
+        if self.row == len(self.screen):
+            self.screen.append("")
+            if len(self.screen) > self.height:
+                # Scroll the top row out of reach
+                scrolled = self.screen.pop(0)
+                if not self.in_alternate_screen:
+                    self.history.append(scrolled)
+                self.row -= 1
+
+    def _move_to(self, row: int, col: int):
+        self.row = max(0, min(row, self.height - 1))
+        self.col = max(0, col)
+        while self.row >= len(self.screen):
+            self.screen.append("")
+
+    def _control(self, char: str):
+        if char in "\n\x0b\x0c":
+            # Treat as a new line, as the tty driver does with `onlcr`, so that
+            # logs or files without carriage returns are replayed as expected
+            self.col = 0
+            self._line_feed()
+        elif char == "\r":
+            self.col = 0
+        elif char == "\b":
+            self.col = max(0, self.col - 1)
+        elif char == "\t":
+            self._write(" " * (8 - self.col % 8))
+
+    def _csi(self, params: str, final: str):
+        if params.startswith("?") or final in "hl":
+            if final in "hl" and params in _ALTERNATE_SCREEN_MODES:
+                self._switch_screen(alternate=final == "h")
+            return
+
+        args = [int(arg) if arg.isdigit() else 0 for arg in params.split(";")]
+        n = max(args[0], 1)
+
+        if final == "A":
+            self._move_to(self.row - n, self.col)
+        elif final in "Be":
+            self._move_to(self.row + n, self.col)
+        elif final in "Ca":
+            self.col += n
+        elif final == "D":
+            self.col = max(0, self.col - n)
+        elif final == "E":
+            self._move_to(self.row + n, 0)
+        elif final == "F":
+            self._move_to(self.row - n, 0)
+        elif final in "G`":
+            self.col = n - 1
+        elif final in "Hf":
+            self._move_to(n - 1, max(args[1] if len(args) > 1 else 1, 1) - 1)
+        elif final == "d":
+            self._move_to(n - 1, self.col)
+        elif final == "K":
+            self._erase_in_line(args[0])
+        elif final == "J":
+            self._erase_in_display(args[0])
+        elif final == "s":
+            self._saved_cursor = (self.row, self.col)
+        elif final == "u":
+            self._move_to(*self._saved_cursor)
+
+    def _esc(self, final: str):
+        if final == "7":
+            self._saved_cursor = (self.row, self.col)
+        elif final == "8":
+            self._move_to(*self._saved_cursor)
+        elif final == "M":
+            # Reverse index
+            self._move_to(self.row - 1, self.col)
+        elif final in "DE":
+            if final == "E":
+                self.col = 0
+            self._line_feed()
+        elif final == "c":
+            # Full reset
+            self.__init__(self.height)
+
+    def _erase_in_line(self, mode: int):
+        line = self.screen[self.row]
+        if mode == 0:
+            self.screen[self.row] = line[: self.col]
+        elif mode == 1:
+            self.screen[self.row] = " " * (self.col + 1) + line[self.col + 1 :]
+        elif mode == 2:
+            self.screen[self.row] = ""
+
+    def _erase_in_display(self, mode: int):
+        if mode == 0:
+            self._erase_in_line(0)
+            del self.screen[self.row + 1 :]
+        elif mode == 1:
+            for row in range(self.row):
+                self.screen[row] = ""
+            self._erase_in_line(1)
+        elif mode == 2:
+            self.screen = [""] * (self.row + 1)
+        elif mode == 3:
+            # Erase the scrollback, as `clear` does
+            self.history.clear()
+
+    def _switch_screen(self, *, alternate: bool):
+        if alternate and self._main_screen is None:
+            self._main_screen = (self.screen, self.row, self.col)
+            self.screen, self.row, self.col = [""], 0, 0
+        elif not alternate and self._main_screen is not None:
+            self.screen, self.row, self.col = self._main_screen
+            self._main_screen = None
+
+
+def replay(text: str, height: int = DEFAULT_HEIGHT) -> str:
+    """Return the visible text left by replaying terminal output."""
+
+    terminal = TerminalReplay(height)
+    terminal.feed(text)
+    return terminal.text()
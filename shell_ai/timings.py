@@ -0,0 +1,89 @@
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TextIO
+
+# Phases in the order they happen, for the report
+PHASES = [
+    "startup",
+    "context",
+    "prompt",
+    "connect",
+    "queue",
+    "first token",
+    "streaming",
+    "tools",
+    "approval",
+]
+
+# Phases that overlap with others, so are not part of the total on their own
+CONCURRENT_PHASES = {
+    "connect": "loading the SDK and connecting, concurrent with context and prompt",
+    "approval": "waiting for the user, partly concurrent with streaming",
+}
+
+
+@dataclass
+class Timings:
+    """Durations of the phases of an invocation, in seconds."""
+
+    started_at: float = field(default_factory=time.time)
+    phases: dict[str, float] = field(default_factory=dict)
+    prompt_size: int = 0
+    prompt_tokens: int | None = None
+    cached_tokens: int | None = None  # Of the prompt tokens
+    completion_tokens: int | None = None
+    model: str | None = None  # Model that served the request
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    @property
+    def total(self) -> float:
+        return time.time() - self.started_at
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        streaming = self.phases.get("streaming")
+        if not self.completion_tokens or not streaming:
+            return None
+        return self.completion_tokens / streaming
+
+    def report(self, *, file: TextIO = sys.stderr):
+        print("Timings:", file=file)
+        for phase in PHASES:
+            if phase not in self.phases:
+                continue
+            line = f"  {phase:<12} {self.phases[phase] * 1000:>9.1f} ms"
+            if phase in CONCURRENT_PHASES:
+                line += f"  ({CONCURRENT_PHASES[phase]})"
+            elif phase == "streaming" and self.tokens_per_second is not None:
+                line += (
+                    f"  ({self.completion_tokens} tokens, "
+                    f"{self.tokens_per_second:.1f} tokens/s)"
+                )
+            print(line, file=file)
+        print(f"  {'total':<12} {self.total * 1000:>9.1f} ms", file=file)
+
+    def to_record(self, model: str) -> dict:
+        return {
+            "time": self.started_at,
+            "model": model,
+            "prompt_size": self.prompt_size,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "time_to_first_token": self.phases.get("first token"),
+            "tokens_per_second": self.tokens_per_second,
+            "total": self.total,
+            "phases": self.phases,
+        }
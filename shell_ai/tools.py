@@ -0,0 +1,267 @@
+"""Read-only tools that the model can call in-process.
+
+A response calls tools with `<tool>{"name": ..., ...}</tool>` tags, and then
+ends.  The tools run in the CLI process, and their results are sent back in
+the same conversation, so reading a few files takes one process and
+connection instead of an approved `ai proceed` round, with a new process and
+the whole context, for each.  The tools are off unless enabled in the config,
+have no side effects, only read below the `tool-paths` of the config, never
+read hidden files, where credentials and configs live, and their output is
+capped.
+"""
+
+import json
+import os
+import re
+import stat as stat_module
+import time
+from collections.abc import Iterator
+
+from .config import load_config
+from .context import read_context
+from .utils import working_directory
+
+# Rounds of tool calls in a row, after which the response is taken as is
+MAX_TOOL_ROUNDS = 5
+
+# Calls run per response
+MAX_CALLS = 8
+
+# Characters of a tool's result, over which it is cut
+MAX_OUTPUT = 8000
+
+MAX_READ_LINES = 400
+MAX_ENTRIES = 200
+MAX_MATCHES = 100
+MAX_GREP_FILES = 5000
+MAX_GREP_FILE_SIZE = 1024 * 1024
+
+# Never read by tools, even below the allowed paths, besides hidden files
+DENIED_NAMES = frozenset(
+    {"id_rsa", "id_dsa", "id_ecdsa", "id_ed25519", "credentials", "shell-ai.conf"}
+)
+
+# Not searched by `grep`
+SKIPPED_DIRS = frozenset({"node_modules", "__pycache__"})
+
+
+class ToolError(Exception):
+    """A tool call that cannot be run, reported to the model."""
+
+
+def _is_denied(name: str) -> bool:
+    """Whether a file or directory name is hidden from tools, e.g. `.env`,
+    `.ssh` or `.config`."""
+
+    return name.startswith(".") or name in DENIED_NAMES
+
+
+def _allowed_roots() -> list[str]:
+    cwd = working_directory.get() or os.getcwd()
+    return [
+        os.path.realpath(os.path.join(cwd, root)).rstrip(os.sep) + os.sep
+        for root in load_config().tool_paths
+    ]
+
+
+def _denial(full: str, roots: list[str]) -> str | None:
+    """Return why tools cannot read a real path, or None if they can."""
+
+    below_root = False
+    for root in roots:
+        if (full + os.sep).startswith(root):
+            # Only below the allowed path, which can itself be hidden, e.g.
+            # ~/.config/nvim
+            names = full[len(root) :].split(os.sep)
+            if not any(_is_denied(name) for name in names if name):
+                return None
+            below_root = True
+    if below_root:
+        return "is not readable by tools"
+    return "is outside the paths allowed for tools"
+
+
+def _resolve(path: str) -> str:
+    """Return the real path of a path of a call, if tools can read it."""
+
+    cwd = working_directory.get() or os.getcwd()
+    full = os.path.realpath(os.path.join(cwd, os.path.expanduser(path)))
+    if (reason := _denial(full, _allowed_roots())) is not None:
+        raise ToolError(f"{path} {reason}")
+    return full
+
+
+def _is_binary(path: str) -> bool:
+    with open(path, "rb") as f:
+        return b"\0" in f.read(8192)
+
+
+def read_file(path: str, start: int = 1, end: int | None = None) -> str:
+    """`path`, optional `start` and `end` lines (1-based, inclusive): the
+    numbered lines of a text file."""
+
+    full = _resolve(path)
+    if _is_binary(full):
+        raise ToolError(f"{path} is a binary file")
+    start = max(int(start), 1)
+    end = start + MAX_READ_LINES - 1 if end is None else int(end)
+    end = min(end, start + MAX_READ_LINES - 1)
+
+    lines = []
+    with open(full, errors="replace") as f:
+        for number, line in enumerate(f, 1):
+            if number > end:
+                lines.append(f"[... more lines after line {end} ...]")
+                break
+            if number >= start:
+                lines.append(f"{number}: {line.rstrip()}")
+    return "\n".join(lines) or f"[{path} has no lines from {start}]"
+
+
+def list_dir(path: str = ".") -> str:
+    """Optional `path`: the entries of a directory, with a slash after
+    subdirectories."""
+
+    full = _resolve(path)
+    with os.scandir(full) as entries:
+        names = sorted(
+            entry.name + ("/" if entry.is_dir() else "")
+            for entry in entries
+            if not _is_denied(entry.name)
+        )
+    if len(names) > MAX_ENTRIES:
+        names[MAX_ENTRIES:] = [f"[... {len(names) - MAX_ENTRIES} more entries ...]"]
+    return "\n".join(names) or f"[{path} is empty]"
+
+
+def _files_below(directory: str) -> Iterator[str]:
+    roots = _allowed_roots()
+    for parent, subdirectories, names in os.walk(directory, followlinks=False):
+        # Prune in place, and search in a stable order
+        subdirectories[:] = sorted(
+            name
+            for name in subdirectories
+            if name not in SKIPPED_DIRS and not _is_denied(name)
+        )
+        for name in sorted(names):
+            file = os.path.join(parent, name)
+            # A symbolic link can point outside the allowed paths, or to a
+            # hidden file
+            if not _is_denied(name) and _denial(os.path.realpath(file), roots) is None:
+                yield file
+
+
+def grep(pattern: str, path: str = ".", ignore_case: bool = False) -> str:
+    """`pattern` (a Python regular expression), optional `path` and
+    `ignore_case`: the matching lines of the text files below a path."""
+
+    full = _resolve(path)
+    try:
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    except re.error as e:
+        raise ToolError(f"Invalid pattern: {e}")
+
+    files = [full] if os.path.isfile(full) else _files_below(full)
+    matches = []
+    for count, file in enumerate(files):
+        if count == MAX_GREP_FILES or len(matches) > MAX_MATCHES:
+            break
+        # Named as the caller would, from the path of the call
+        name = os.path.normpath(os.path.join(path, os.path.relpath(file, full)))
+        try:
+            if os.path.getsize(file) > MAX_GREP_FILE_SIZE or _is_binary(file):
+                continue
+            with open(file, errors="replace") as f:
+                for number, line in enumerate(f, 1):
+                    if regex.search(line):
+                        matches.append(f"{name}:{number}: {line.rstrip()}")
+        except OSError:
+            continue
+    if len(matches) > MAX_MATCHES:
+        matches[MAX_MATCHES:] = ["[... more matches ...]"]
+    return "\n".join(matches) or "[No matches]"
+
+
+def stat(path: str) -> str:
+    """`path`: the type, permissions, size and modification time of a file."""
+
+    full = _resolve(path)
+    info = os.stat(full)
+    return (
+        f"{stat_module.filemode(info.st_mode)} {info.st_size} bytes, modified "
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info.st_mtime))}"
+    )
+
+
+def tail_log(context_file: str | None, lines: int = 50) -> str:
+    """Optional `lines`: the last lines of the terminal session log, as it is
+    now."""
+
+    if not context_file:
+        raise ToolError("There is no session log")
+    text = read_context(context_file, MAX_OUTPUT)
+    return "\n".join(text.split("\n")[-max(int(lines), 1) :])
+
+
+TOOLS = {
+    "read_file": read_file,
+    "list_dir": list_dir,
+    "grep": grep,
+    "stat": stat,
+    "tail_log": tail_log,
+}
+
+
+def describe_tools(names: tuple[str, ...]) -> str:
+    """Describe the tools for the system prompt, from their docstrings."""
+
+    return "\n".join(
+        f"    -   {name}: {' '.join(TOOLS[name].__doc__.split())}" for name in names
+    )
+
+
+def describe_call(call: str) -> str:
+    """Summarize a call for the terminal, e.g. "read_file setup.py"."""
+
+    try:
+        arguments = json.loads(call)
+        name = arguments.pop("name")
+    except (ValueError, AttributeError, KeyError, TypeError):
+        return call.strip()
+    return " ".join([str(name), *(str(value) for value in arguments.values())])
+
+
+def run_tool(call: str, context_file: str | None) -> str:
+    """Run a call, and return its result or error, cut to MAX_OUTPUT."""
+
+    try:
+        arguments = json.loads(call)
+        if not isinstance(arguments, dict):
+            raise ToolError("A call must be a JSON object")
+        name = arguments.pop("name", None)
+        if name not in load_config().tools:
+            raise ToolError(f"Unknown tool: {name}")
+        try:
+            if name == "tail_log":
+                result = tail_log(context_file, **arguments)
+            else:
+                result = TOOLS[name](**arguments)
+        except (TypeError, ValueError) as e:
+            raise ToolError(f"Invalid arguments: {e}")
+    except ValueError as e:
+        result = f"Error: Invalid JSON: {e}"
+    except (ToolError, OSError) as e:
+        result = f"Error: {e}"
+
+    if len(result) > MAX_OUTPUT:
+        result = (
+            result[:MAX_OUTPUT]
+            + f"\n[... {len(result) - MAX_OUTPUT} characters cut ...]"
+        )
+    return result
+
+
+def run_tools(calls: list[str], context_file: str | None) -> list[str]:
+    results = [run_tool(call, context_file) for call in calls[:MAX_CALLS]]
+    results += [f"Error: Over {MAX_CALLS} calls in a response"] * len(calls[MAX_CALLS:])
+    return results
@@ -0,0 +1,142 @@
+"""Usage log of invocations, written when `usage-file` is set in the config.
+
+Each CLI invocation, batch prompt or API call appends a JSON line with its
+model, prompt size, prompt, cached and completion tokens, time to first
+token, tokens per second and phase timings (see `Timings.to_record`), so that
+prefix cache hit rates and latency can be tracked over time.
+
+Usage: python -m shell_ai.usage [USAGE_FILE] [--model MODEL]
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from collections import defaultdict
+
+from .config import load_config
+from .timings import PHASES, Timings
+
+PERCENTILES = [50, 95, 99]
+
+
+def record_usage(timings: Timings, model: str):
+    """Append the record of an invocation to the usage log, if enabled."""
+
+    path = load_config().usage_file
+    if not path:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        # A single short append, so lines of concurrent processes do not mix
+        with open(path, "a") as f:
+            f.write(json.dumps(timings.to_record(model)) + "\n")
+    except OSError:
+        pass
+
+
+def read_usage(path: str, model: str | None = None) -> list[dict]:
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash
+                continue
+            if model is None or record.get("model") == model:
+                records.append(record)
+    return records
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize_tokens(records: list[dict]) -> dict[str, dict[str, float]]:
+    """Sum the calls and token counts of each model."""
+
+    totals: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for record in records:
+        model_totals = totals[record["model"]]
+        model_totals["calls"] += 1
+        for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+            model_totals[key] += record.get(key) or 0
+    return totals
+
+
+def summarize_latency(records: list[dict]) -> dict[str, list[float]]:
+    """Collect the values of each metric, sorted, skipping missing ones."""
+
+    metrics: dict[str, list[float]] = {
+        "time to first token (ms)": [],
+        "tokens per second": [],
+        "total (ms)": [],
+        "prompt size (chars)": [],
+    }
+    phases: dict[str, list[float]] = {phase: [] for phase in PHASES}
+    for record in records:
+        if record.get("time_to_first_token") is not None:
+            metrics["time to first token (ms)"].append(
+                record["time_to_first_token"] * 1000
+            )
+        if record.get("tokens_per_second") is not None:
+            metrics["tokens per second"].append(record["tokens_per_second"])
+        if record.get("total") is not None:
+            metrics["total (ms)"].append(record["total"] * 1000)
+        if record.get("prompt_size"):
+            metrics["prompt size (chars)"].append(record["prompt_size"])
+        for phase, seconds in record.get("phases", {}).items():
+            if phase != "first token":  # Reported above
+                phases.setdefault(phase, []).append(seconds * 1000)
+
+    metrics.update(
+        (f"{phase} (ms)", values) for phase, values in phases.items() if values
+    )
+    return {name: sorted(values) for name, values in metrics.items() if values}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", nargs="?", help="Usage log (default: config)")
+    parser.add_argument("--model", help="Only include calls of this model")
+    args = parser.parse_args()
+
+    path = args.file or load_config().usage_file
+    if not path:
+        parser.error("no usage log given, and usage-file is not configured")
+
+    try:
+        records = read_usage(path, args.model)
+    except FileNotFoundError:
+        print(f"{path}: No such file", file=sys.stderr)
+        sys.exit(1)
+    if not records:
+        print("No usage recorded", file=sys.stderr)
+        sys.exit(1)
+
+    for model, model_totals in sorted(summarize_tokens(records).items()):
+        prompt_tokens = model_totals["prompt_tokens"]
+        cached_tokens = model_totals["cached_tokens"]
+        hit_rate = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        print(f"{model}:")
+        print(f"  calls:             {model_totals['calls']:.0f}")
+        print(f"  prompt tokens:     {prompt_tokens:.0f}")
+        print(f"  cached tokens:     {cached_tokens:.0f} ({hit_rate:.1%})")
+        print(f"  completion tokens: {model_totals['completion_tokens']:.0f}")
+
+    print()
+    header = "".join(f"{f'p{p}':>10}" for p in PERCENTILES)
+    print(f"{'':<28}{header}")
+    for name, values in summarize_latency(records).items():
+        row = "".join(f"{percentile(values, p):>10.1f}" for p in PERCENTILES)
+        print(f"{name:<28}{row}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
+import asyncio
 import json
 import re
 import sys
+import threading
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from functools import cache
 from typing import Literal
 
 
@@ -98,22 +103,22 @@ _CODE_MAP = {
 }
 
 
-def styled(
-    text: object, *attrs: StyleAttribute, code_tuple: tuple[int, ...] | None = None
+@cache
+def style_prefix(
+    attrs: tuple[StyleAttribute, ...], code_tuple: tuple[int, ...] | None = None
 ) -> str:
-    result = str(text)
+    """Render the escape sequences of a style once, for reuse."""
 
+    prefix = "".join("\033[%dm" % _CODE_MAP[attr] for attr in attrs if attr is not None)
     if code_tuple:
-        result = "\033[%sm%s" % (";".join(str(n) for n in code_tuple), result)
-
-    for attr in reversed(attrs):
-        if attr is None:
-            continue
-        result = "\033[%dm%s" % (_CODE_MAP[attr], result)
+        prefix += "\033[%sm" % ";".join(str(n) for n in code_tuple)
+    return prefix
 
-    result += "\033[0m"
 
-    return result
+def styled(
+    text: object, *attrs: StyleAttribute, code_tuple: tuple[int, ...] | None = None
+) -> str:
+    return style_prefix(attrs, code_tuple) + str(text) + "\033[0m"
 
 
 def print_styled(
@@ -129,15 +134,55 @@ def strip_ansi(ansi_string: str) -> str:
     return re.sub(r"\x1B\[\d+(;\d+){0,2}m|\x00", "", ansi_string)
 
 
-def ask_yes_no(question: str = "", default: bool | None = None) -> bool:
+# Overrides where user input is read from, e.g. a daemon client's terminal
+line_reader: ContextVar[Callable[[], Awaitable[str]] | None] = ContextVar(
+    "line_reader", default=None
+)
+
+
+# Overrides the directory that relative paths are resolved in, e.g. a daemon
+# client's working directory
+working_directory: ContextVar[str | None] = ContextVar(
+    "working_directory", default=None
+)
+
+
+async def read_line() -> str:
+    """Read a line of user input without blocking the event loop."""
+
+    if (reader := line_reader.get()) is not None:
+        return await reader()
+
+    loop = asyncio.get_running_loop()
+    future: asyncio.Future[str] = loop.create_future()
+
+    def resolve(callback: Callable, value):
+        if not future.done():
+            callback(value)
+
+    def target():
+        try:
+            line = input()
+        except BaseException as e:
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, line)
+
+    # Use a daemon thread so that an interrupted prompt does not block exit
+    threading.Thread(target=target, daemon=True).start()
+    return await future
+
+
+async def ask_yes_no(question: str = "", default: bool | None = None) -> bool:
     while True:
         try:
             print(
                 f"{question + ' ' if question else ''}[{'Y' if default is True else 'y'}/{'N' if default is False else 'n'}] ",
                 end="",
+                flush=True,
                 file=sys.stderr,
             )
-            answer = input().lower().strip()
+            answer = (await read_line()).lower().strip()
             if answer in ("y", "yes"):
                 return True
             elif answer in ("n", "no"):
@@ -158,3 +203,11 @@ def indent(text: str, size: int, /, *, except_first_line: bool = False) -> str:
 
 def escape_printf(text: str) -> str:
     return json.dumps(text).replace("%", "%%")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: about 4 characters per token for ASCII text, and a
+    token per character for other scripts"""
+
+    ascii_chars = len(text.encode("ascii", errors="ignore"))
+    return ascii_chars // 4 + len(text) - ascii_chars
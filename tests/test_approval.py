@@ -0,0 +1,83 @@
+import asyncio
+import io
+import unittest
+from contextlib import redirect_stderr
+from unittest import mock
+
+from shell_ai import StreamState, approve_commands, buffer_handler, stop_handler
+from shell_ai.models import EventType, SuggestedCommand
+from shell_ai.output import OutputWriter
+from shell_ai.timings import Timings
+
+
+class ApprovalTest(unittest.TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+        self.events = []
+
+    def strip(self, text: str) -> str:
+        # Without the styles of commands
+        return (
+            text.replace("\x1b[1m", "")
+            .replace("\x1b[38;2;255;159;64m", "")
+            .replace("\x1b[0m", "")
+        )
+
+    def run_response(self, tokens: list[str], answers: list[bool], delay: float):
+        """Stream the tokens `delay` apart while answering the approvals, and
+        return the approved commands and the output seen at each approval."""
+
+        seen = []
+
+        async def ask_yes_no(prompt: str) -> bool:
+            seen.append(self.strip(self.output.getvalue()))
+            # Let the response go on while the user thinks
+            await asyncio.sleep(0.01)
+            return answers[len(seen) - 1]
+
+        async def respond():
+            state = StreamState(
+                stdout=OutputWriter(self.output),
+                stderr=OutputWriter(self.output),
+                suggestions=asyncio.Queue(),
+            )
+            approval = asyncio.create_task(approve_commands(state, Timings()))
+            for token in tokens:
+                buffer_handler(token, self.events, state=state, print_mode=False)
+                await asyncio.sleep(delay)
+            stop_handler(self.events, state=state, print_mode=False)
+            state.suggestions.put_nowait(None)
+            return await approval
+
+        with mock.patch("shell_ai.ask_yes_no", ask_yes_no), redirect_stderr(
+            io.StringIO()
+        ):
+            approved = asyncio.run(respond())
+        return approved, seen
+
+    def test_asks_while_streaming(self):
+        approved, seen = self.run_response(
+            ["First <exec>ls</exec>", " then ", "<exec parallel>df</exec>", " done"],
+            [True, False],
+            delay=0.05,
+        )
+        self.assertEqual(approved, [SuggestedCommand("ls", False)])
+        # Asked as soon as each command was complete, with the rest held back
+        self.assertEqual(seen, ["First ls", "First ls then df"])
+        self.assertEqual(self.strip(self.output.getvalue()), "First ls then df done\n")
+        self.assertEqual(
+            [event.type for event in self.events], [EventType.SUGGEST_COMMAND] * 2
+        )
+
+    def test_held_while_approvals_pending(self):
+        approved, seen = self.run_response(
+            ["<exec>ls</exec>", "<exec>df</exec>", " done"], [False, True], delay=0
+        )
+        self.assertEqual(approved, [SuggestedCommand("df", False)])
+        # Both were suggested before the first answer
+        self.assertEqual(seen, ["ls", "ls"])
+        self.assertEqual(self.strip(self.output.getvalue()), "lsdf done\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+from unittest import mock
+
+from shell_ai import batch, parse_arguments
+
+
+class SplitTest(unittest.TestCase):
+    def test_split_commands(self):
+        self.assertEqual(
+            batch.split_commands(
+                "Run <exec>ls &amp;&amp; pwd</exec> and <exec parallel>df</exec>"
+            ),
+            ("Run ls && pwd and df", ["ls && pwd", "df"]),
+        )
+        self.assertEqual(batch.split_commands("Try <exec>ls"), ("Try <exec>ls", []))
+
+    def test_read_items(self):
+        items = list(
+            batch.read_items(
+                io.StringIO(
+                    '{"message": "a"}\n\nnot json\n{"id": "x", "message": "b"}\n[1]\n'
+                )
+            )
+        )
+        self.assertEqual(items[0], {"message": "a", "id": 1})
+        self.assertEqual(items[1]["id"], 3)
+        self.assertIn("error", items[1])
+        self.assertEqual(items[2], {"id": "x", "message": "b"})
+        self.assertIn("error", items[3])
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input = os.path.join(directory.name, "prompts.jsonl")
+        self.output = os.path.join(directory.name, "results.jsonl")
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requested = []
+
+    async def fake_completion(self, messages, **kwargs):
+        message = messages[-1]["content"]
+        self.requested.append(message)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if "fail" in message:
+            raise RuntimeError("server error")
+        return {"role": "assistant", "content": f"<exec>echo {len(message)}</exec>"}
+
+    def run_batch(self, **kwargs) -> batch.BatchSummary:
+        with mock.patch.object(
+            batch, "request_completion", self.fake_completion
+        ), redirect_stderr(io.StringIO()):
+            return asyncio.run(
+                batch.run_batch(self.input, self.output, raw=True, **kwargs)
+            )
+
+    def results(self) -> list[dict]:
+        with open(self.output) as f:
+            return [json.loads(line) for line in f]
+
+    def test_concurrency_and_resume(self):
+        with open(self.input, "w") as f:
+            for i in range(20):
+                message = "please fail" if i == 7 else f"prompt {i}"
+                f.write(json.dumps({"id": i, "message": message}) + "\n")
+
+        summary = self.run_batch(concurrency=4)
+        self.assertEqual((summary.completed, summary.failed), (19, 1))
+        self.assertLessEqual(self.max_in_flight, 4)
+        self.assertEqual(
+            sorted(result["id"] for result in self.results()), list(range(20))
+        )
+        self.assertEqual(
+            next(result for result in self.results() if result["id"] == 3)["commands"],
+            ["echo 8"],
+        )
+
+        # Only the failed prompt is run again
+        self.requested.clear()
+        summary = self.run_batch(concurrency=4)
+        self.assertEqual((summary.skipped, summary.failed), (19, 1))
+        self.assertEqual(len(self.requested), 1)
+        self.assertIn("please fail", self.requested[0])
+
+    def test_load_done_ignores_partial_lines(self):
+        with open(self.output, "w") as f:
+            f.write('{"id": 1, "content": ""}\n{"id": 2, "error": "x"}\n{"id": 3, "con')
+        self.assertEqual(batch.load_done(self.output), {"1"})
+
+
+class ArgumentsTest(unittest.TestCase):
+    def test_concurrency_must_be_positive(self):
+        for value in ("0", "-2"):
+            with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                parse_arguments(["--batch", "-", "--concurrency", value])
+
+
+if __name__ == "__main__":
+    unittest.main()
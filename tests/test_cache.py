@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from shell_ai.cache import CompletionCache, cache_key
+
+
+class CompletionCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "completions.sqlite3")
+        self.now = 1000.0
+        patcher = mock.patch("shell_ai.cache.time.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open(self, **kwargs) -> CompletionCache:
+        cache = CompletionCache(self.path, **{"max_size": 10**6, "ttl": 0, **kwargs})
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_key_normalization(self):
+        messages = [{"role": "user", "content": "Translate:\r\nhello\n"}]
+        self.assertEqual(
+            cache_key("m", messages),
+            cache_key("m", [{"role": "user", "content": "Translate:\nhello"}]),
+        )
+        self.assertNotEqual(cache_key("m", messages), cache_key("n", messages))
+
+    def test_hit_and_miss(self):
+        cache = self.open()
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "m", "content")
+        self.assertEqual(cache.get("a"), "content")
+        # Shared with other processes
+        self.assertEqual(self.open().get("a"), "content")
+        self.assertEqual(
+            {name: cache.stats()[name] for name in ("hits", "misses", "entries")},
+            {"hits": 2, "misses": 1, "entries": 1},
+        )
+
+    def test_ttl(self):
+        cache = self.open(ttl=60)
+        cache.put("a", "m", "content")
+        self.now += 61
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_least_recently_used_are_evicted(self):
+        # Room for two entries of 101 bytes
+        cache = self.open(max_size=250)
+        for key in "abc":
+            if key == "c":
+                # Use `a`, so that `b` is the least recently used
+                self.assertIsNotNone(cache.get("a"))
+            cache.put(key, "m", "x" * 100)
+            self.now += 1
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from shell_ai.client import runtime_dir
+
+
+class RuntimeDirTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base = directory.name
+        self.path = os.path.join(self.base, "shell-ai")
+        patcher = mock.patch.dict(os.environ, {"XDG_RUNTIME_DIR": self.base})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_created_private(self):
+        self.assertEqual(runtime_dir(), self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o700)
+
+    def test_shared_directory_refused(self):
+        os.mkdir(self.path)
+        os.chmod(self.path, 0o777)
+        with self.assertRaises(PermissionError):
+            runtime_dir()
+
+    def test_symlink_refused(self):
+        target = os.path.join(self.base, "elsewhere")
+        os.mkdir(target, 0o700)
+        os.symlink(target, self.path)
+        with self.assertRaises(PermissionError):
+            runtime_dir()
+
+    def test_other_owner_refused(self):
+        os.mkdir(self.path, 0o700)
+        with mock.patch("os.getuid", return_value=os.getuid() + 1):
+            with self.assertRaises(PermissionError):
+                runtime_dir()
+
+
+if __name__ == "__main__":
+    unittest.main()
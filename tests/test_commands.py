@@ -0,0 +1,69 @@
+import re
+import subprocess
+import time
+import unittest
+
+from shell_ai import combine_commands, group_commands
+from shell_ai.models import SuggestedCommand
+
+STYLE_PATTERN = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def run(commands: list[SuggestedCommand]) -> str:
+    """Run the combined commands like the `ai` shell function, without styles."""
+
+    result = subprocess.run(
+        ["bash", "-c", 'eval "$1"', "bash", combine_commands(commands)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return STYLE_PATTERN.sub("", result.stdout)
+
+
+class GroupCommandsTest(unittest.TestCase):
+    def test_groups(self):
+        commands = [
+            SuggestedCommand("df", True),
+            SuggestedCommand("du", True),
+            SuggestedCommand("cd src", False),
+            SuggestedCommand("ls", True),
+            SuggestedCommand("ai proceed", True),
+        ]
+        self.assertEqual(
+            group_commands(commands),
+            [[(1, "df"), (2, "du")], [(3, "cd src")], [(4, "ls")], [(5, "ai proceed")]],
+        )
+
+
+class CombineCommandsTest(unittest.TestCase):
+    def test_parallel_group(self):
+        started = time.monotonic()
+        output = run(
+            [
+                SuggestedCommand("sleep 0.5; echo first", True),
+                SuggestedCommand("echo second; exit 3", True),
+                SuggestedCommand("sleep 0.5; echo third >&2", True),
+                SuggestedCommand("echo after", False),
+            ]
+        )
+        self.assertLess(time.monotonic() - started, 1.0)
+        # In order, with their exit statuses
+        self.assertIn(
+            "(1-3/4) in parallel...\n"
+            "AI executed approved command (1/4), exit status: 0\nfirst\n\n"
+            "AI executed approved command (2/4), exit status: 3\nsecond\n\n"
+            "AI executed approved command (3/4), exit status: 0\nthird\n\n"
+            "AI is executing approved command (4/4):\nafter\n",
+            output,
+        )
+
+    def test_variables_kept_after_sequential_commands(self):
+        output = run(
+            [SuggestedCommand("x=1", False), SuggestedCommand("echo x=$x", False)]
+        )
+        self.assertIn("x=1\n", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from shell_ai.compaction import (
+    KEEP_RECENT,
+    collapse_repeats,
+    compact_context,
+    head_and_tail,
+    split_blocks,
+)
+from shell_ai.utils import estimate_tokens
+
+
+def session(commands: list[tuple[str, list[str]]]) -> str:
+    lines = []
+    for command, output in commands:
+        lines += [f"user@host:~/src$ {command}", *output]
+    return "\n".join([*lines, "user@host:~/src$ ai why did it fail?"])
+
+
+class CompactionTest(unittest.TestCase):
+    def test_within_budget_is_unchanged(self):
+        text = session([("ls", ["a", "b"])])
+        self.assertEqual(compact_context(text, 1000), text)
+
+    def test_split_blocks(self):
+        blocks = split_blocks(session([("ls", ["a", "b"]), ("pwd", ["/"])]).split("\n"))
+        self.assertEqual(
+            [block.command for block in blocks],
+            [
+                "user@host:~/src$ ls",
+                "user@host:~/src$ pwd",
+                "user@host:~/src$ ai why did it fail?",
+            ],
+        )
+        self.assertEqual(blocks[0].output, ["a", "b"])
+
+    def test_collapse_repeats(self):
+        self.assertEqual(
+            collapse_repeats(["start", *[f"progress {i}%" for i in range(10)], "end"]),
+            ["start", "progress 0%", "[... 8 similar lines ...]", "progress 9%", "end"],
+        )
+        self.assertEqual(
+            collapse_repeats(["same"] * 5),
+            ["same", "[... repeated 4 more times ...]"],
+        )
+        self.assertEqual(collapse_repeats(["a 1", "a 2", "b"]), ["a 1", "a 2", "b"])
+
+    def test_head_and_tail(self):
+        lines = [str(i) for i in range(10)]
+        self.assertEqual(
+            head_and_tail(lines, 3), ["0", "1", "[... 7 lines omitted ...]", "9"]
+        )
+        self.assertEqual(
+            head_and_tail(lines, 0), ["[... 10 lines of output omitted ...]"]
+        )
+        self.assertEqual(head_and_tail(lines, None), lines)
+
+    def test_fits_budget_and_keeps_commands(self):
+        commands = [
+            (
+                f"make target{i}",
+                [f"compiling file {j} of target{i}: ok" for j in range(300)],
+            )
+            for i in range(10)
+        ]
+        text = session(commands)
+        budget = 2000
+        compacted = compact_context(text, budget)
+
+        self.assertLessEqual(estimate_tokens(compacted), budget)
+        # The last commands and the `ai` call are kept
+        for command, _ in commands[-(KEEP_RECENT - 1) :]:
+            self.assertIn(f"user@host:~/src$ {command}", compacted)
+        self.assertTrue(compacted.endswith("user@host:~/src$ ai why did it fail?"))
+
+    def test_truncated(self):
+        self.assertEqual(
+            compact_context("tial line\nuser@host:~$ ai hi", 1000, truncated=True),
+            "[... earlier output omitted ...]\nuser@host:~$ ai hi",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+from shell_ai import completion
+from shell_ai.completion import (
+    MAX_RESUMES,
+    MIN_OVERLAP,
+    IncompleteResponse,
+    _drop_overlap,
+    _watched_stream,
+)
+from shell_ai.config import Endpoint
+from shell_ai.models import Ref
+from shell_ai.prompts import RESUME_PROMPT
+
+
+class DropOverlapTest(unittest.TestCase):
+    def test_exact(self):
+        self.assertEqual(_drop_overlap("The plan is", "The plan is"), "")
+
+    def test_partial(self):
+        self.assertEqual(
+            _drop_overlap("First, list the files", "the files, then count"),
+            ", then count",
+        )
+
+    def test_below_min_overlap(self):
+        short = "x" * (MIN_OVERLAP - 1)
+        self.assertEqual(_drop_overlap("abc" + short, short + "def"), short + "def")
+
+    def test_none(self):
+        self.assertEqual(
+            _drop_overlap("Hello there", "General Kenobi"), "General Kenobi"
+        )
+
+
+class WatchedStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.endpoint = Endpoint("default", None, "key", "model")
+        config = types.SimpleNamespace(
+            endpoints=(self.endpoint,),
+            request_timeout=None,
+            first_token_timeout=0.05,
+            token_timeout=0.05,
+        )
+        patcher = mock.patch.object(completion, "load_config", lambda: config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requests: list[list] = []
+
+    def run_stream(self, replies: list[tuple[list[str], bool]]) -> list[str]:
+        """Stream through fake requests, each yielding its tokens, and then
+        stalling or ending."""
+
+        async def start_stream(model, messages, usage, endpoint, fail_over=False):
+            tokens, stalls = replies[len(self.requests)]
+            self.requests.append(messages)
+
+            async def stream():
+                for token in tokens:
+                    yield token
+                if stalls:
+                    await asyncio.sleep(10)
+
+            return stream()
+
+        async def collect():
+            received = []
+            try:
+                async for token in _watched_stream(
+                    "model",
+                    None,
+                    [{"role": "user", "content": "hi"}],
+                    Ref(None),
+                    Ref(None),
+                    Ref(0.0),
+                ):
+                    received.append(token)
+            finally:
+                self.received = received
+            return received
+
+        with mock.patch.object(completion, "_start_stream", start_stream):
+            return asyncio.run(collect())
+
+    def test_resumed_without_repeat(self):
+        received = self.run_stream(
+            [
+                (["Run the ", "tests with "], True),
+                (["tests with ", "unittest."], False),
+            ]
+        )
+        self.assertEqual("".join(received), "Run the tests with unittest.")
+        self.assertEqual(
+            self.requests[1][1:],
+            [
+                {"role": "assistant", "content": "Run the tests with "},
+                {"role": "user", "content": RESUME_PROMPT},
+            ],
+        )
+
+    def test_stops_after_max_resumes(self):
+        with self.assertRaises(IncompleteResponse):
+            self.run_stream([(["Partial answer"], True)] * (MAX_RESUMES + 2))
+        self.assertEqual(len(self.requests), MAX_RESUMES + 1)
+        self.assertEqual("".join(self.received), "Partial answer")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from shell_ai.context import (
+    READ_BLOCK_SIZE,
+    cut_start,
+    is_position_readable,
+    log_position,
+    read_context,
+)
+from shell_ai.terminal import replay
+
+
+class ContextTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "session.log")
+
+    def write(self, data: bytes, mode: str = "ab"):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def test_tail_matches_full_replay(self):
+        # Longer than the first read block, with redraws and colors
+        lines = b"".join(
+            b"\x1b[1mline %d\x1b[0m caf\xc3\xa9 progress 10%%\rdone\r\n" % i
+            for i in range(20000)
+        )
+        self.assertGreater(len(lines), READ_BLOCK_SIZE)
+        self.write(lines)
+        full = replay(lines.decode())
+        for max_length in (100, 5000, 200000):
+            self.assertEqual(
+                read_context(self.path, max_length), full[-max_length:], max_length
+            )
+        self.assertEqual(read_context(self.path), full)
+
+    def test_since(self):
+        self.write(b"$ make\r\nold output\r\n")
+        position = log_position(self.path)
+        self.write(b"$ ai\r\nnew output\r\n")
+        self.assertEqual(
+            read_context(self.path, 1000, since=position.offset),
+            "$ ai\nnew output",
+        )
+
+    def test_position_readable(self):
+        self.write(b"first\r\n")
+        position = log_position(self.path)
+        self.write(b"second\r\n")
+        self.assertTrue(is_position_readable(self.path, position))
+
+        # Cleared, and grown back to a larger size
+        self.write(b"other output, longer than before\r\n", "r+b")
+        self.assertFalse(is_position_readable(self.path, position))
+
+    def test_cut_start(self):
+        self.assertEqual(cut_start(b"partial line\nnext line\n"), b"next line\n")
+        # No line break nearby: skip the rest of a multi-byte character
+        self.assertEqual(cut_start("é".encode()[1:] + b"abc"), b"abc")
+
+
+if __name__ == "__main__":
+    unittest.main()
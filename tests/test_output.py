@@ -0,0 +1,80 @@
+import asyncio
+import io
+import unittest
+from unittest import mock
+
+from shell_ai.output import OutputWriter
+
+
+class OutputWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch("shell_ai.output.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stream = io.StringIO()
+        self.writer = OutputWriter(self.stream, interval=0.5, size=10)
+
+    def test_coalesces_within_interval(self):
+        async def write():
+            for token in ("a", "b", "c"):
+                self.writer.write(token)
+            # The first write goes out right away, the rest after the interval
+            self.assertEqual(self.stream.getvalue(), "a")
+            self.now += 0.5
+            self.writer.write("d")
+
+        asyncio.run(write())
+        self.assertEqual(self.stream.getvalue(), "abcd")
+        self.assertEqual(self.writer.writes, 2)
+
+    def test_writes_right_away_without_loop(self):
+        self.writer.write("a")
+        self.writer.write("b")
+        self.assertEqual(self.stream.getvalue(), "ab")
+
+    def test_flushes_at_size(self):
+        async def write():
+            self.writer.write("a")
+            self.writer.write("b")
+            self.writer.write("0123456789")
+            self.assertEqual(self.stream.getvalue(), "ab0123456789")
+
+        asyncio.run(write())
+
+    def test_hold_and_release(self):
+        self.writer.hold()
+        self.writer.write("0123456789 held")
+        self.writer.flush()
+        self.assertEqual(self.stream.getvalue(), "")
+        self.writer.release()
+        self.assertEqual(self.stream.getvalue(), "0123456789 held")
+
+    def test_stream_resolved_at_flush(self):
+        streams = [io.StringIO()]
+        writer = OutputWriter(lambda: streams[-1], interval=0.5)
+        writer.write("first ")
+        streams.append(io.StringIO())
+        self.now += 0.5
+        writer.write("second")
+        self.assertEqual(streams[0].getvalue(), "first ")
+        self.assertEqual(streams[1].getvalue(), "second")
+
+
+class OutputTimerTest(unittest.TestCase):
+    def test_timer_writes_the_rest(self):
+        stream = io.StringIO()
+        writer = OutputWriter(stream, interval=0.05)
+
+        async def write():
+            writer.write("a")
+            writer.write("b")
+            self.assertEqual(stream.getvalue(), "a")
+            await asyncio.sleep(0.1)
+
+        asyncio.run(write())
+        self.assertEqual(stream.getvalue(), "ab")
+
+
+if __name__ == "__main__":
+    unittest.main()
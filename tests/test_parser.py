@@ -0,0 +1,91 @@
+import unittest
+
+from shell_ai.models import ParseEventType
+from shell_ai.parser import TagParser
+
+RESPONSE = (
+    "Check the disk: <exec>df -h | awk '$5 > 90'</exec> and if x < y, "
+    '<exec parallel timeout="5">cat <<EOF\n</exe\nEOF</exec> then <b>bold</b> '
+    "<tool>{}</tool> done <"
+)
+
+
+def parse(chunks: list[str]) -> list[tuple]:
+    """Parse the chunks, and merge adjacent text events."""
+
+    parser = TagParser(["exec", "tool"])
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    events += parser.close()
+
+    merged = []
+    for event in events:
+        if (
+            event.type == ParseEventType.TEXT
+            and merged
+            and merged[-1][0] == ParseEventType.TEXT
+            and merged[-1][2] == event.tag
+        ):
+            merged[-1] = (event.type, merged[-1][1] + event.data, event.tag, {})
+        else:
+            merged.append((event.type, event.data, event.tag, event.attrs))
+    return merged
+
+
+class TagParserTest(unittest.TestCase):
+    def test_tags(self):
+        self.assertEqual(
+            parse([RESPONSE]),
+            [
+                (ParseEventType.TEXT, "Check the disk: ", None, {}),
+                (ParseEventType.OPENING_TAG, "<exec>", "exec", {}),
+                (ParseEventType.TEXT, "df -h | awk '$5 > 90'", "exec", {}),
+                (ParseEventType.CLOSING_TAG, "</exec>", "exec", {}),
+                (ParseEventType.TEXT, " and if x < y, ", None, {}),
+                (
+                    ParseEventType.OPENING_TAG,
+                    '<exec parallel timeout="5">',
+                    "exec",
+                    {"parallel": "", "timeout": "5"},
+                ),
+                (ParseEventType.TEXT, "cat <<EOF\n</exe\nEOF", "exec", {}),
+                (ParseEventType.CLOSING_TAG, "</exec>", "exec", {}),
+                (ParseEventType.TEXT, " then <b>bold</b> ", None, {}),
+                (ParseEventType.OPENING_TAG, "<tool>", "tool", {}),
+                (ParseEventType.TEXT, "{}", "tool", {}),
+                (ParseEventType.CLOSING_TAG, "</tool>", "tool", {}),
+                (ParseEventType.TEXT, " done <", None, {}),
+            ],
+        )
+
+    def test_chunking(self):
+        # Tags split anywhere across chunks parse the same as in one piece
+        expected = parse([RESPONSE])
+        for size in range(1, 12):
+            chunks = [RESPONSE[i : i + size] for i in range(0, len(RESPONSE), size)]
+            self.assertEqual(parse(chunks), expected, f"chunks of {size}")
+
+    def test_unclosed_tag(self):
+        self.assertEqual(
+            parse(["<exec>ls", " -l </ex"]),
+            [
+                (ParseEventType.OPENING_TAG, "<exec>", "exec", {}),
+                (ParseEventType.TEXT, "ls -l </ex", "exec", {}),
+            ],
+        )
+
+    def test_partial_tag_is_held_back(self):
+        parser = TagParser(["exec"])
+        self.assertEqual(
+            [event.data for event in parser.feed("run <ex")],
+            ["run "],
+        )
+        self.assertEqual(
+            [event.type for event in parser.feed("ec>")],
+            [ParseEventType.OPENING_TAG],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from shell_ai import ratelimit
+from shell_ai.config import Endpoint
+
+
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.now = 1000.0
+        for patcher in (
+            mock.patch.object(
+                ratelimit,
+                "state_path",
+                lambda: os.path.join(directory.name, "ratelimit.json"),
+            ),
+            mock.patch("shell_ai.ratelimit.time.time", lambda: self.now),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def endpoint(self, **limits) -> Endpoint:
+        return Endpoint("default", None, "key", "model", **limits)
+
+    def test_requests_per_minute(self):
+        endpoint = self.endpoint(requests_per_minute=2)
+        self.assertEqual(ratelimit._try_acquire(endpoint, "a", 0), 0.0)
+        self.assertEqual(ratelimit._try_acquire(endpoint, "b", 0), 0.0)
+        # Refilled at one request per 30 seconds
+        self.assertAlmostEqual(ratelimit._try_acquire(endpoint, "c", 0), 30.0)
+        self.now += 30
+        self.assertEqual(ratelimit._try_acquire(endpoint, "c", 0), 0.0)
+
+    def test_tokens_per_minute(self):
+        endpoint = self.endpoint(tokens_per_minute=1000)
+        self.assertEqual(ratelimit._try_acquire(endpoint, "a", 900), 0.0)
+        self.assertAlmostEqual(ratelimit._try_acquire(endpoint, "b", 400), 18.0)
+        # Using fewer tokens than estimated gives them back
+        ratelimit.settle(endpoint, 900, 600)
+        self.assertEqual(ratelimit._try_acquire(endpoint, "b", 400), 0.0)
+
+    def test_first_in_first_out(self):
+        endpoint = self.endpoint(requests_per_minute=1)
+        self.assertEqual(ratelimit._try_acquire(endpoint, "a", 0), 0.0)
+        self.assertGreater(ratelimit._try_acquire(endpoint, "b", 0), 0.0)
+        # `b` keeps its place by checking again
+        self.now += 59
+        self.assertGreater(ratelimit._try_acquire(endpoint, "b", 0), 0.0)
+        self.now += 1
+        # `b` is first in the queue, so `c` waits even though there is room
+        self.assertEqual(
+            ratelimit._try_acquire(endpoint, "c", 0), ratelimit.POLL_INTERVAL
+        )
+        self.assertEqual(ratelimit._try_acquire(endpoint, "b", 0), 0.0)
+
+    def test_stale_waiters_are_dropped(self):
+        endpoint = self.endpoint(requests_per_minute=1)
+        ratelimit._try_acquire(endpoint, "a", 0)
+        ratelimit._try_acquire(endpoint, "killed", 0)
+        self.now += 60 + ratelimit.STALE_WAITER + 1
+        self.assertEqual(ratelimit._try_acquire(endpoint, "b", 0), 0.0)
+
+    def test_unlimited(self):
+        self.assertEqual(asyncio.run(ratelimit.acquire(self.endpoint(), 10**6)), 0.0)
+        self.assertFalse(os.path.exists(ratelimit.state_path()))
+
+
+if __name__ == "__main__":
+    unittest.main()
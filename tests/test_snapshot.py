@@ -0,0 +1,114 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import time
+import unittest
+
+from shell_ai.context import read_context
+from shell_ai.snapshot import read_snapshot, refresh, snapshot_path
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "session.log")
+
+    def write(self, data: bytes, mode: str = "ab"):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def test_matches_full_read(self):
+        self.write(b"".join(b"$ make %d\r\nbuilding\rdone\r\n" % i for i in range(500)))
+        refresh(self.path, 2000)
+        self.assertTrue(os.path.exists(snapshot_path(self.path)))
+        # Output written since the refresh is replayed on top of the snapshot
+        self.write(b"$ ls\r\nsrc tests caf\xc3\xa9\r\n")
+        self.assertEqual(read_snapshot(self.path, 2000), read_context(self.path, 2000))
+
+    def test_cleared_log_not_used(self):
+        self.write(b"$ make\r\nold output\r\n")
+        refresh(self.path, 2000)
+        self.write(b"$ ls\r\n", "wb")
+        self.assertIsNone(read_snapshot(self.path, 2000))
+
+
+class RefreshHookTest(unittest.TestCase):
+    """The prompt hook of the profile script, with a stub refresher."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        root = directory.name
+        os.mkdir(os.path.join(root, "profile.d"))
+        os.mkdir(os.path.join(root, "bin"))
+        shutil.copy(
+            os.path.join(PROJECT_ROOT, "profile.d", "shell-ai.sh"),
+            os.path.join(root, "profile.d"),
+        )
+        self.refreshes = os.path.join(root, "refreshes")
+        stub = os.path.join(root, "bin", "shell-ai-snapshot")
+        with open(stub, "w") as f:
+            f.write(f'#!/bin/sh\necho "$1" >>{self.refreshes}\n')
+        os.chmod(stub, 0o755)
+        self.root = root
+        self.log = os.path.join(root, "session.log")
+        open(self.log, "w").close()
+
+    def run_hook(self, script: str) -> int:
+        """Run the script in an interactive shell with the profile, and return
+        the number of refreshes started."""
+
+        subprocess.run(
+            [
+                "bash",
+                "--norc",
+                "-i",
+                "-c",
+                f"source {self.root}/profile.d/shell-ai.sh\n{textwrap.dedent(script)}",
+            ],
+            # An existing log, so that the profile does not start recording
+            env={
+                **{
+                    name: value
+                    for name, value in os.environ.items()
+                    if not name.startswith(("SHELL_AI_", "SESSION_LOG"))
+                },
+                "SESSION_LOG_FILE": self.log,
+            },
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        # The refresher runs in the background
+        time.sleep(0.2)
+        try:
+            with open(self.refreshes) as f:
+                return len(f.readlines())
+        except FileNotFoundError:
+            return 0
+
+    def test_refreshes_after_enough_output(self):
+        count = self.run_hook(f"""
+            head -c 1000 /dev/zero >>{self.log}; log update
+            head -c 70000 /dev/zero >>{self.log}; log update
+            head -c 1000 /dev/zero >>{self.log}; log update
+            """)
+        self.assertEqual(count, 1)
+
+    def test_refreshes_after_clear(self):
+        count = self.run_hook(f"""
+            SHELL_AI_SNAPSHOT_INTERVAL=100
+            head -c 200 /dev/zero >>{self.log}; log update
+            : >{self.log}; echo small >>{self.log}; log update
+            """)
+        self.assertEqual(count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
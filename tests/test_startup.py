@@ -0,0 +1,55 @@
+"""Startup regression tests: the SDK is only imported once a request is made,
+and the cold start stays within the budget of benchmarks/startup.py."""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+)
+
+import startup  # noqa: E402
+
+HEAVY_MODULES = {"openai", "httpx"}
+
+
+def imported_modules(*args: str) -> set[str]:
+    """Return the heavy modules imported by a `python -X importtime` run."""
+
+    with tempfile.TemporaryDirectory() as home:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", *args],
+            cwd=startup.PROJECT_ROOT,
+            env=startup.isolated_env("http://127.0.0.1:9/v1", home),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    return {
+        line.rsplit("|", 1)[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    } & HEAVY_MODULES
+
+
+class LazyImportTest(unittest.TestCase):
+    def test_import(self):
+        self.assertEqual(imported_modules("-c", "import shell_ai"), set())
+
+    def test_help(self):
+        self.assertEqual(imported_modules("-m", "shell_ai", "--help"), set())
+
+
+class ColdStartTest(unittest.TestCase):
+    def test_budget(self):
+        baseline = statistics.median(startup.measure_baseline(3))
+        median = statistics.median(startup.measure_cold_start(3))
+        self.assertLessEqual(median, startup.MAX_RATIO * baseline)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from shell_ai import tools
+from shell_ai.tools import MAX_MATCHES, ToolError, _resolve, grep, list_dir, read_file
+from shell_ai.utils import working_directory
+
+
+class ToolsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base = os.path.realpath(directory.name)
+        self.root = os.path.join(self.base, "project")
+        os.mkdir(self.root)
+        self.write("readme.txt", "API_KEY=placeholder\n")
+        self.write(".env", "API_KEY=hidden\n")
+        self.write("id_rsa", "API_KEY=denied\n")
+        self.write(".git/config", "API_KEY=hidden directory\n")
+        os.mkdir(os.path.join(self.base, "secret"))
+        with open(os.path.join(self.base, "secret", "keys.txt"), "w") as f:
+            f.write("API_KEY=outside\n")
+
+        config = types.SimpleNamespace(
+            tool_paths=(self.root,), tools=tuple(tools.TOOLS)
+        )
+        patcher = mock.patch.object(tools, "load_config", lambda: config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        token = working_directory.set(self.root)
+        self.addCleanup(working_directory.reset, token)
+
+    def write(self, name: str, text: str):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+
+    def test_resolve_allowed(self):
+        self.assertEqual(_resolve("readme.txt"), os.path.join(self.root, "readme.txt"))
+        self.assertEqual(_resolve("."), self.root)
+
+    def test_resolve_outside(self):
+        for path in ("../secret/keys.txt", os.path.join(self.base, "secret"), "/etc"):
+            with self.assertRaisesRegex(ToolError, "outside the paths allowed"):
+                _resolve(path)
+
+    def test_resolve_denied_names(self):
+        for path in (".env", "id_rsa", ".git/config", "sub/../.env"):
+            with self.assertRaisesRegex(ToolError, "not readable"):
+                _resolve(path)
+
+    def test_hidden_root_allowed(self):
+        hidden = os.path.join(self.base, ".config")
+        os.mkdir(hidden)
+        with open(os.path.join(hidden, "init.lua"), "w") as f:
+            f.write("-- config\n")
+        config = types.SimpleNamespace(tool_paths=(hidden,))
+        with mock.patch.object(tools, "load_config", lambda: config):
+            self.assertEqual(
+                read_file(os.path.join(hidden, "init.lua")), "1: -- config"
+            )
+
+    def test_list_dir_hides_denied(self):
+        self.assertEqual(list_dir(), "readme.txt")
+
+    def test_symlink_escape(self):
+        os.symlink(
+            os.path.join(self.base, "secret", "keys.txt"),
+            os.path.join(self.root, "notes.txt"),
+        )
+        os.symlink(".env", os.path.join(self.root, "env.txt"))
+        os.symlink(os.path.join(self.base, "secret"), os.path.join(self.root, "linked"))
+        for path in ("notes.txt", "env.txt", "linked/keys.txt"):
+            with self.assertRaises(ToolError):
+                read_file(path)
+        self.assertEqual(grep("API_KEY"), "readme.txt:1: API_KEY=placeholder")
+
+    def test_grep_truncates_matches(self):
+        self.write("many.txt", "match\n" * (MAX_MATCHES + 10))
+        lines = grep("match", "many.txt").split("\n")
+        self.assertEqual(len(lines), MAX_MATCHES + 1)
+        self.assertEqual(lines[-1], "[... more matches ...]")
+
+    def test_grep_file_limit(self):
+        for i in range(5):
+            self.write(f"files/{i}.txt", "match\n")
+        with mock.patch.object(tools, "MAX_GREP_FILES", 3):
+            self.assertEqual(
+                grep("match", "files"),
+                "files/0.txt:1: match\nfiles/1.txt:1: match\nfiles/2.txt:1: match",
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()